@@ -4,6 +4,7 @@ import json
 import logging
 
 from config import get_settings
+from deadline import DeadlineExceeded, stage_session
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -118,7 +119,7 @@ class APIManager:
         last_error = None
         for attempt in range(self.settings.max_retries):
             try:
-                async with aiohttp.ClientSession() as session:
+                async with stage_session("llm", self.current_claude_model) as session:
                     async with session.post(self.settings.anthropic_url, json=data, headers=headers) as response:
                         response_json = await response.json()
                         if response.status == 200:
@@ -154,6 +155,9 @@ class APIManager:
                     await asyncio.sleep(delay)
                 else:
                     logger.error(f"Request failed after {self.settings.max_retries} attempts: {e}")
+            except (DeadlineExceeded, asyncio.CancelledError):
+                # Let the server answer 504 with the stage that ran out of time
+                raise
             except Exception as e:
                 logger.error(f"Error in generate_anthropic_response: {str(e)}", exc_info=True)
                 return "I apologize, but I encountered an error while processing your request."
@@ -186,7 +190,7 @@ class APIManager:
         logger.debug(f"Media LLM (OpenRouter) Request - Data: {json.dumps(data, indent=2)}")
 
         try:
-            async with aiohttp.ClientSession() as session:
+            async with stage_session("llm", self.media_llm_model) as session:
                 # Using OPENROUTER_HEADERS defined in config
                 async with session.post(self.settings.openrouter_url, json=data, headers=self.settings.openrouter_headers) as response:
                     response_json = await response.json()
@@ -203,6 +207,8 @@ class APIManager:
                     else:
                         logger.error("No choices in Media LLM (OpenRouter) response")
                         return None # Indicate error
+        except (DeadlineExceeded, asyncio.CancelledError):
+            raise
         except Exception as e:
             logger.error(f"Exception during Media LLM (OpenRouter) call: {e}", exc_info=True)
             return None # Indicate error
@@ -273,7 +279,7 @@ class APIManager:
 
         for attempt in range(self.settings.max_retries):
             try:
-                async with aiohttp.ClientSession() as session:
+                async with stage_session("llm", self.current_openrouter_model) as session:
                     async with session.post(self.settings.openrouter_url, json=data, headers=self.settings.openrouter_headers) as response:
                         response_json = await response.json()
                         logger.debug(f"OpenRouter Response Status: {response.status}")
@@ -299,6 +305,8 @@ class APIManager:
                 else:
                     logger.error(f"OpenRouter request failed after {self.settings.max_retries} attempts: {e}")
                     return "I'm having trouble connecting to the OpenRouter service right now. Please try again."
+            except (DeadlineExceeded, asyncio.CancelledError):
+                raise
             except Exception as e:
                 logger.error(f"Error in generate_openrouter_response: {str(e)}", exc_info=True)
                 return "I apologize, but I encountered an error while processing your request."
@@ -314,7 +322,7 @@ class APIManager:
 
         for attempt in range(self.settings.max_retries):
             try:
-                async with aiohttp.ClientSession() as session:
+                async with stage_session("llm", self.current_lmstudio_model) as session:
                     async with session.post(self.settings.lmstudio_url, json={
                         "model": self.current_lmstudio_model,
                         "messages": messages,
@@ -341,6 +349,8 @@ class APIManager:
                 else:
                     logger.error(f"OpenRouter request failed after {self.settings.max_retries} attempts: {e}")
                     return "I cannot connect to the local LMStudio server. Is it running?"
+            except (DeadlineExceeded, asyncio.CancelledError):
+                raise
             except Exception as e:
                 logger.error(f"Error in generate_lmstudio_response: {str(e)}", exc_info=True)
                 return "I encountered an error while communicating with LMStudio."
@@ -0,0 +1,166 @@
+import asyncio
+import errno
+import logging
+import os
+import secrets
+from datetime import datetime
+from typing import Dict, Optional
+
+from config import BLOB_STORE_ENABLED, BLOB_STORE_DIR
+from download_manager import sha256_file
+
+logger = logging.getLogger(__name__)
+
+# Errors meaning the filesystem can't hard link here at all (other failures are per file)
+LINKS_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+
+def unique_timestamp() -> str:
+    """Timestamp for media file names, with a random suffix so names made in the same second differ."""
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(3)}"
+
+
+class BlobStore:
+    """Content-addressed storage for session media, deduplicated with hard links.
+
+    Every stored file is kept once under its SHA256 (blobs/ab/cd/<sha256>), and the
+    session folder name is a hard link to that blob. A second copy of the same
+    content (a repeated download, a re-saved image) is replaced by another link, so
+    identical artifacts take the space of one. Session paths stay ordinary files,
+    so nothing that reads, serves or exports them needs to know about blobs; the
+    media registry's sha256 column is the reference from a session file to its blob.
+    A blob whose only remaining link is its own is no longer used by any session
+    and is removed by collect_garbage(), which runs before the server takes requests.
+
+    Stored files must be replaced (write elsewhere, then os.replace), never
+    rewritten in place, since every link shares the same data. Hard links need the
+    store on the same filesystem as output/; where linking fails, files are left
+    as they are.
+    """
+
+    def __init__(self, root: str = BLOB_STORE_DIR, enabled: bool = BLOB_STORE_ENABLED):
+        self.root = root
+        self.enabled = enabled
+        self._link_failed = False  # warn once if the filesystem can't hard link
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def has(self, digest: Optional[str], size: Optional[int] = None) -> bool:
+        """Whether the blob for a hash exists (and has the expected size, if given)."""
+        if not digest:
+            return False
+        try:
+            return size is None or os.path.getsize(self.blob_path(digest)) == size
+        except OSError:
+            return False
+
+    def _ingest(self, path: str, digest: Optional[str]) -> Dict:
+        digest = digest or sha256_file(path)
+        stat = os.stat(path)
+        result = {"sha256": digest, "size": stat.st_size, "blob": None, "deduplicated": False}
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        # A second pass covers the blob being garbage collected between the two links below
+        for _ in range(2):
+            try:
+                os.link(path, blob)
+                break
+            except FileExistsError:
+                pass
+            try:
+                blob_stat = os.stat(blob)
+                if (blob_stat.st_dev, blob_stat.st_ino) != (stat.st_dev, stat.st_ino):
+                    # Same content stored before: make this name another link to the blob
+                    link_path = f"{path}.blob"
+                    os.link(blob, link_path)
+                    os.replace(link_path, path)
+                    result["deduplicated"] = True
+                break
+            except FileNotFoundError:
+                if not os.path.exists(path):
+                    raise
+        else:
+            return result
+        result["blob"] = blob
+        return result
+
+    def _unlinked(self, path: str, digest: Optional[str]) -> Dict:
+        digest = digest or sha256_file(path)
+        return {"sha256": digest, "size": os.path.getsize(path), "blob": None, "deduplicated": False}
+
+    async def ingest(self, path: str, digest: Optional[str] = None) -> Optional[Dict]:
+        """Store a session file by content, deduplicating it against earlier ones.
+
+        Args:
+            path: File to store; it stays at this path (as a link to the blob)
+            digest: Its SHA256 if already known (saves hashing it again)
+
+        Returns:
+            {"sha256", "size", "blob", "deduplicated"}; "blob" is None if the store
+            is off or linking failed. None if the file can't be read.
+        """
+        try:
+            if not self.enabled or self._link_failed:
+                return await asyncio.to_thread(self._unlinked, path, digest)
+            for attempt in range(2):
+                try:
+                    result = await asyncio.to_thread(self._ingest, path, digest)
+                    break
+                except OSError as e:
+                    if not os.path.exists(path):
+                        raise
+                    if e.errno in LINKS_UNSUPPORTED:
+                        self._link_failed = True
+                        logger.warning(f"[Blobs] Hard links unavailable between {self.root} and "
+                                       f"{os.path.dirname(path)} ({e}); storing files without deduplication")
+                        return await asyncio.to_thread(self._unlinked, path, digest)
+                    # Anything else (disk full, a racing cleanup...) only affects this file
+                    logger.warning(f"[Blobs] Could not store {os.path.basename(path)} (attempt {attempt + 1}/2): {e}")
+            else:
+                return await asyncio.to_thread(self._unlinked, path, digest)
+        except OSError as e:
+            logger.warning(f"[Blobs] Could not read {path}: {e}")
+            return None
+        if result["deduplicated"]:
+            logger.info(f"[Blobs] {os.path.basename(path)} is a duplicate, linked to {result['sha256'][:12]} "
+                        f"({result['size'] / 1024 / 1024:.1f} MB saved)")
+        return result
+
+    async def link(self, digest: str, path: str) -> bool:
+        """Place an existing blob at path (instead of writing the same content again)."""
+        if not self.enabled or not self.has(digest):
+            return False
+        part_path = f"{path}.blob"
+        try:
+            await asyncio.to_thread(os.link, self.blob_path(digest), part_path)
+            os.replace(part_path, path)
+            return True
+        except OSError as e:
+            logger.warning(f"[Blobs] Could not link {digest[:12]} to {path}: {e}")
+            if os.path.exists(part_path):
+                os.unlink(part_path)
+            return False
+
+    def collect_garbage(self) -> int:
+        """Delete blobs no session file links to any more. Returns the bytes freed."""
+        freed = 0
+        if not os.path.isdir(self.root):
+            return freed
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_nlink == 1:
+                        os.unlink(path)
+                        freed += stat.st_size
+                except OSError:
+                    pass
+        if freed:
+            logger.info(f"[Blobs] Removed unused blobs ({freed / 1024 / 1024:.1f} MB)")
+        return freed
+
+
+# Shared so every writer of session media deduplicates against the same store
+blob_store = BlobStore()
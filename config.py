@@ -2,7 +2,7 @@ import json
 import logging
 import os
 from dataclasses import dataclass, field
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from dotenv import load_dotenv
 
@@ -70,6 +70,45 @@ class Settings:
 
     # Stable Diffusion / Image
     stable_diffusion_url: str = "http://127.0.0.1:7860/sdapi/v1/txt2img"
+    stable_diffusion_urls: List[str] = field(default_factory=list)
+    sd_health_interval: int = 15
+    sd_queue_fairness_window: float = 20.0
+    sd_max_batch_size: int = 4
+    rerender_max_steps: int = 60
+    model_catalog_file: str = "model_catalog.json"
+    model_catalog_refresh_interval: int = 300
+    hedge_stagger: float = 8.0
+    hedge_min_samples: int = 5
+    hedge_sd_model: str = ""
+    story_clip_cache_dir: str = "cache/story_clips"
+    story_clip_cache_max_mb: int = 2048
+    media_workers: int = 4
+    derived_assets_enabled: bool = True
+    derived_sprite_frames: int = 25
+    last_frame_candidates: int = 8
+    last_frame_budget: float = 3.0
+    mp4_streaming_mode: str = "faststart"
+    story_hls_min_seconds: float = 60.0
+    media_batch_workers: int = 3
+    story_one_pass_max_seconds: float = 10.0
+    media_variants_enabled: bool = True
+    media_variant_cache_dir: str = "cache/media_variants"
+    media_variant_cache_max_mb: int = 2048
+    thumbnail_cache_dir: str = "cache/thumbnails"
+    thumbnail_cache_max_mb: int = 512
+    blob_store_enabled: bool = True
+    blob_store_dir: str = "blobs"
+    prompt_cache_enabled: bool = False
+    prompt_cache_file: str = "prompt_cache.npz"
+    prompt_cache_threshold: float = 0.92
+    prompt_cache_window: int = 20
+    prompt_cache_max_entries: int = 1000
+    sd_shared_output_dir: str = ""
+    sd_shared_output_remote_dir: str = ""
+    face_model_cache_file: str = "face_models.json"
+    face_gate_enabled: bool = True
+    face_gate_min_score: float = 2.0
+    face_gate_min_size: float = 0.05
     insightface_model_path: str = "./models/insightface/inswapper_128.onnx"
     sd_checkpoints_folder: str = "C:/AI/ForgeUI/models/Stable-diffusion"
 
@@ -105,6 +144,15 @@ class Settings:
     hedra_headers: Dict[str, str] = field(default_factory=dict)
     zonos_url: str = "http://localhost:7860"
 
+    # Provider file uploads
+    upload_cache_file: str = "upload_cache.json"
+    wavespeed_upload_ttl: int = 21600
+
+    # LoRA sync
+    lora_sync_concurrency: int = 3
+    lora_sync_connections: int = 4
+    lora_sync_segment_threshold_mb: int = 64
+
     # Ngrok / remote
     ngrok_auth_token: Optional[str] = None
     use_ngrok: bool = False
@@ -115,6 +163,9 @@ class Settings:
     api_poll_interval: int = 1
     max_retries: int = 3
     retry_base_delay: float = 1.0
+    stage_timeouts: Dict[str, float] = field(default_factory=dict)
+    model_stage_timeouts: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    job_deadlines: Dict[str, float] = field(default_factory=dict)
 
     # Conversation limits
     max_conversation_history: int = 100
@@ -199,6 +250,9 @@ def build_settings(user_settings: Optional[Dict] = None) -> Settings:
         "Content-Type": "application/json",
     }
 
+    # STORY_COMPILE_WORKERS is the older name for the media worker limit
+    media_workers = int(os.getenv("MEDIA_WORKERS", os.getenv("STORY_COMPILE_WORKERS", "0"))) or os.cpu_count() or 2
+
     # Defaults that can be overridden by user_settings (UI wins)
     main_provider = (user_settings.get("main_provider") or os.getenv("DEFAULT_LLM") or "OpenRouter").lower()
     media_provider = user_settings.get("media_provider", "OpenRouter").lower()
@@ -224,6 +278,12 @@ def build_settings(user_settings: Optional[Dict] = None) -> Settings:
         default_media_model = default_openrouter_model
 
     stable_diffusion_url = _normalize_sd_url(os.getenv("STABLE_DIFFUSION_URL", "http://127.0.0.1:7860/sdapi/v1/txt2img"))
+    # Optional pool of SD backends (comma separated); defaults to the single URL above
+    stable_diffusion_urls = [
+        _normalize_sd_url(url.strip())
+        for url in os.getenv("STABLE_DIFFUSION_URLS", "").split(",")
+        if url.strip()
+    ] or [stable_diffusion_url]
 
     use_ngrok = user_settings.get("use_ngrok")
     if use_ngrok is None:
@@ -233,6 +293,38 @@ def build_settings(user_settings: Optional[Dict] = None) -> Settings:
 
     ngrok_auth_token = user_settings.get("ngrok_auth_token") or os.getenv("NGROK_AUTH_TOKEN")
 
+    # Per-stage time limits in seconds (each also capped by the request deadline)
+    stage_timeouts = {
+        "llm": 90,
+        "tts": 60,
+        "sd_txt2img": 180,
+        "sd_img2img": 120,
+        "upload": 60,
+        "replicate_poll": 600,
+        "wavespeed_poll": 600,
+        "download": 300,
+    }
+    stage_timeouts.update(json.loads(os.getenv("STAGE_TIMEOUTS", "{}")))
+
+    # Slower models get longer limits for specific stages
+    model_stage_timeouts = {
+        "lightricks/ltx-2-distilled": {"replicate_poll": 900},
+        "kwaivgi/kling-lip-sync": {"replicate_poll": 900},
+        "wan-video/wan-2.2-s2v": {"replicate_poll": 900},
+        "wavespeed-ai/infinitetalk": {"wavespeed_poll": 900},
+    }
+    model_stage_timeouts.update(json.loads(os.getenv("MODEL_STAGE_TIMEOUTS", "{}")))
+
+    # Total budget for a request, by job kind
+    job_deadlines = {
+        "image": 300,
+        "image_edit": 240,
+        "faceswap": 180,
+        "video": 1200,
+        "lipsync": 1200,
+    }
+    job_deadlines.update(json.loads(os.getenv("JOB_DEADLINES", "{}")))
+
     settings = Settings(
         discord_bot_token=os.getenv("DISCORD_BOT_TOKEN"),
         command_prefix="!",
@@ -267,6 +359,65 @@ def build_settings(user_settings: Optional[Dict] = None) -> Settings:
         },
         elevenlabs_output_format=os.getenv("ELEVENLABS_OUTPUT_FORMAT", "mp3_44100_192"),
         stable_diffusion_url=stable_diffusion_url,
+        stable_diffusion_urls=stable_diffusion_urls,
+        sd_health_interval=int(os.getenv("SD_HEALTH_INTERVAL", "15")),
+        sd_queue_fairness_window=float(os.getenv("SD_QUEUE_FAIRNESS_WINDOW", "20")),
+        sd_max_batch_size=int(os.getenv("SD_MAX_BATCH_SIZE", "4")),
+        rerender_max_steps=int(os.getenv("RERENDER_MAX_STEPS", "60")),
+        model_catalog_file=os.getenv("MODEL_CATALOG_FILE", "model_catalog.json"),
+        model_catalog_refresh_interval=int(os.getenv("MODEL_CATALOG_REFRESH_INTERVAL", "300")),
+        # "Fastest" image mode: seconds before starting the backup backend (until there is
+        # enough latency history), and the SD checkpoint it races against Qwen
+        hedge_stagger=float(os.getenv("HEDGE_STAGGER", "8")),
+        hedge_min_samples=int(os.getenv("HEDGE_MIN_SAMPLES", "5")),
+        hedge_sd_model=os.getenv("HEDGE_SD_MODEL", "") or os.getenv("LUMINA_SD_MODEL", "z-image-turbo-q4_k_m.gguf"),
+        # Story compile: normalized scene clips are cached here
+        story_clip_cache_dir=os.getenv("STORY_CLIP_CACHE_DIR", "cache/story_clips"),
+        story_clip_cache_max_mb=int(os.getenv("STORY_CLIP_CACHE_MAX_MB", "2048")),
+        # Media worker pool: FFmpeg / CPU-heavy jobs running at once (default: one per core),
+        # and how many of those batch work (story compiles) may take
+        media_workers=media_workers,
+        media_batch_workers=int(os.getenv("MEDIA_BATCH_WORKERS", "0")) or max(1, media_workers - 1),
+        # Last frame, poster and seek-thumbnail sprite extracted when a video arrives
+        derived_assets_enabled=os.getenv("DERIVED_ASSETS_ENABLED", "true").lower() == "true",
+        derived_sprite_frames=int(os.getenv("DERIVED_SPRITE_FRAMES", "25")),
+        # "Use Last Frame" picks the sharpest of the final N frames, within a latency budget (seconds)
+        last_frame_candidates=int(os.getenv("LAST_FRAME_CANDIDATES", "8")),
+        last_frame_budget=float(os.getenv("LAST_FRAME_BUDGET", "3")),
+        # Stored MP4s are remuxed so browsers can play them before the whole file arrives:
+        # "faststart" (moov first), "fragmented" or "off"; stories at least this long (seconds)
+        # also get an HLS rendition (0 = never)
+        mp4_streaming_mode=os.getenv("MP4_STREAMING_MODE", "faststart").lower(),
+        story_hls_min_seconds=float(os.getenv("STORY_HLS_MIN_SECONDS", "60")),
+        story_one_pass_max_seconds=float(os.getenv("STORY_ONE_PASS_MAX_SECONDS", "10")),
+        # Remote clients get smaller renditions of session media (WebP/AVIF, Opus, 480p),
+        # made on first request and cached here by content hash
+        media_variants_enabled=os.getenv("MEDIA_VARIANTS_ENABLED", "true").lower() == "true",
+        media_variant_cache_dir=os.getenv("MEDIA_VARIANT_CACHE_DIR", "cache/media_variants"),
+        media_variant_cache_max_mb=int(os.getenv("MEDIA_VARIANT_CACHE_MAX_MB", "2048")),
+        # Thumbnails for the web gallery, face picker and launcher, made once per image
+        thumbnail_cache_dir=os.getenv("THUMBNAIL_CACHE_DIR", "cache/thumbnails"),
+        thumbnail_cache_max_mb=int(os.getenv("THUMBNAIL_CACHE_MAX_MB", "512")),
+        # Session media is stored once per content hash and hard-linked into session folders
+        # (must be on the same filesystem as output/)
+        blob_store_enabled=os.getenv("BLOB_STORE_ENABLED", "true").lower() == "true",
+        blob_store_dir=os.getenv("BLOB_STORE_DIR", "blobs"),
+        # Reuse a recent image when a new direct prompt is nearly identical (cosine similarity)
+        prompt_cache_enabled=os.getenv("PROMPT_CACHE_ENABLED", "false").lower() == "true",
+        prompt_cache_file=os.getenv("PROMPT_CACHE_FILE", "prompt_cache.npz"),
+        prompt_cache_threshold=float(os.getenv("PROMPT_CACHE_THRESHOLD", "0.92")),
+        prompt_cache_window=int(os.getenv("PROMPT_CACHE_WINDOW", "20")),
+        prompt_cache_max_entries=int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "1000")),
+        # Folder Forge saves into that this server can also read (same host / shared volume);
+        # the remote dir is the same folder as Forge sees it, if mounted at a different path
+        sd_shared_output_dir=os.getenv("SD_SHARED_OUTPUT_DIR", ""),
+        sd_shared_output_remote_dir=os.getenv("SD_SHARED_OUTPUT_REMOTE_DIR", "") or os.getenv("SD_SHARED_OUTPUT_DIR", ""),
+        face_model_cache_file=os.getenv("FACE_MODEL_CACHE_FILE", "face_models.json"),
+        # Skip automatic face swaps when OpenCV finds no face (score = Haar cascade confidence,
+        # size = smallest face as a fraction of the image's shorter side)
+        face_gate_enabled=os.getenv("FACE_GATE_ENABLED", "true").lower() == "true",
+        face_gate_min_score=float(os.getenv("FACE_GATE_MIN_SCORE", "2.0")),
+        face_gate_min_size=float(os.getenv("FACE_GATE_MIN_SIZE", "0.05")),
         insightface_model_path=os.getenv("INSIGHTFACE_MODEL_PATH", "./models/insightface/inswapper_128.onnx"),
         sd_checkpoints_folder=os.getenv("SD_CHECKPOINTS_FOLDER", "C:/AI/ForgeUI/models/Stable-diffusion"),
         image_width=int(os.getenv("IMAGE_WIDTH", "896")),
@@ -294,6 +445,11 @@ def build_settings(user_settings: Optional[Dict] = None) -> Settings:
         hedra_base_url=os.getenv("HEDRA_BASE_URL", "https://mercury.dev.dream-ai.com/api"),
         hedra_headers=hedra_headers,
         zonos_url=os.getenv("ZONOS_URL", "http://localhost:7860"),
+        upload_cache_file=os.getenv("UPLOAD_CACHE_FILE", "upload_cache.json"),
+        wavespeed_upload_ttl=int(os.getenv("WAVESPEED_UPLOAD_TTL", "21600")),
+        lora_sync_concurrency=int(os.getenv("LORA_SYNC_CONCURRENCY", "3")),
+        lora_sync_connections=int(os.getenv("LORA_SYNC_CONNECTIONS", "4")),
+        lora_sync_segment_threshold_mb=int(os.getenv("LORA_SYNC_SEGMENT_THRESHOLD_MB", "64")),
         ngrok_auth_token=ngrok_auth_token,
         use_ngrok=bool(use_ngrok),
         remote_password=remote_password,
@@ -301,6 +457,9 @@ def build_settings(user_settings: Optional[Dict] = None) -> Settings:
         api_poll_interval=int(os.getenv("API_POLL_INTERVAL", "1")),
         max_retries=int(os.getenv("MAX_RETRIES", "3")),
         retry_base_delay=float(os.getenv("RETRY_BASE_DELAY", "1.0")),
+        stage_timeouts=stage_timeouts,
+        model_stage_timeouts=model_stage_timeouts,
+        job_deadlines=job_deadlines,
         max_conversation_history=int(os.getenv("MAX_CONVERSATION_HISTORY", "100")),
         message_chunk_size=int(os.getenv("MESSAGE_CHUNK_SIZE", "2000")),
         max_file_age_days=int(os.getenv("MAX_FILE_AGE_DAYS", "30")),
@@ -349,6 +508,45 @@ ELEVENLABS_VOICE_SETTINGS = settings.elevenlabs_voice_settings
 ELEVENLABS_OUTPUT_FORMAT = settings.elevenlabs_output_format
 
 STABLE_DIFFUSION_URL = settings.stable_diffusion_url
+STABLE_DIFFUSION_URLS = settings.stable_diffusion_urls
+SD_HEALTH_INTERVAL = settings.sd_health_interval
+SD_QUEUE_FAIRNESS_WINDOW = settings.sd_queue_fairness_window
+SD_MAX_BATCH_SIZE = settings.sd_max_batch_size
+RERENDER_MAX_STEPS = settings.rerender_max_steps
+MODEL_CATALOG_FILE = settings.model_catalog_file
+MODEL_CATALOG_REFRESH_INTERVAL = settings.model_catalog_refresh_interval
+HEDGE_STAGGER = settings.hedge_stagger
+HEDGE_MIN_SAMPLES = settings.hedge_min_samples
+HEDGE_SD_MODEL = settings.hedge_sd_model
+STORY_CLIP_CACHE_DIR = settings.story_clip_cache_dir
+STORY_CLIP_CACHE_MAX_MB = settings.story_clip_cache_max_mb
+MEDIA_WORKERS = settings.media_workers
+MEDIA_BATCH_WORKERS = settings.media_batch_workers
+DERIVED_ASSETS_ENABLED = settings.derived_assets_enabled
+DERIVED_SPRITE_FRAMES = settings.derived_sprite_frames
+LAST_FRAME_CANDIDATES = settings.last_frame_candidates
+LAST_FRAME_BUDGET = settings.last_frame_budget
+MP4_STREAMING_MODE = settings.mp4_streaming_mode
+STORY_HLS_MIN_SECONDS = settings.story_hls_min_seconds
+STORY_ONE_PASS_MAX_SECONDS = settings.story_one_pass_max_seconds
+MEDIA_VARIANTS_ENABLED = settings.media_variants_enabled
+MEDIA_VARIANT_CACHE_DIR = settings.media_variant_cache_dir
+MEDIA_VARIANT_CACHE_MAX_MB = settings.media_variant_cache_max_mb
+THUMBNAIL_CACHE_DIR = settings.thumbnail_cache_dir
+THUMBNAIL_CACHE_MAX_MB = settings.thumbnail_cache_max_mb
+BLOB_STORE_ENABLED = settings.blob_store_enabled
+BLOB_STORE_DIR = settings.blob_store_dir
+PROMPT_CACHE_ENABLED = settings.prompt_cache_enabled
+PROMPT_CACHE_FILE = settings.prompt_cache_file
+PROMPT_CACHE_THRESHOLD = settings.prompt_cache_threshold
+PROMPT_CACHE_WINDOW = settings.prompt_cache_window
+PROMPT_CACHE_MAX_ENTRIES = settings.prompt_cache_max_entries
+SD_SHARED_OUTPUT_DIR = settings.sd_shared_output_dir
+SD_SHARED_OUTPUT_REMOTE_DIR = settings.sd_shared_output_remote_dir
+FACE_MODEL_CACHE_FILE = settings.face_model_cache_file
+FACE_GATE_ENABLED = settings.face_gate_enabled
+FACE_GATE_MIN_SCORE = settings.face_gate_min_score
+FACE_GATE_MIN_SIZE = settings.face_gate_min_size
 INSIGHTFACE_MODEL_PATH = settings.insightface_model_path
 SD_CHECKPOINTS_FOLDER = settings.sd_checkpoints_folder
 
@@ -381,6 +579,13 @@ HEDRA_BASE_URL = settings.hedra_base_url
 HEDRA_HEADERS = settings.hedra_headers
 ZONOS_URL = settings.zonos_url
 
+UPLOAD_CACHE_FILE = settings.upload_cache_file
+WAVESPEED_UPLOAD_TTL = settings.wavespeed_upload_ttl
+
+LORA_SYNC_CONCURRENCY = settings.lora_sync_concurrency
+LORA_SYNC_CONNECTIONS = settings.lora_sync_connections
+LORA_SYNC_SEGMENT_THRESHOLD_MB = settings.lora_sync_segment_threshold_mb
+
 NGROK_AUTH_TOKEN = settings.ngrok_auth_token
 USE_NGROK = settings.use_ngrok
 
@@ -388,6 +593,9 @@ API_TIMEOUT = settings.api_timeout
 API_POLL_INTERVAL = settings.api_poll_interval
 MAX_RETRIES = settings.max_retries
 RETRY_BASE_DELAY = settings.retry_base_delay
+STAGE_TIMEOUTS = settings.stage_timeouts
+MODEL_STAGE_TIMEOUTS = settings.model_stage_timeouts
+JOB_DEADLINES = settings.job_deadlines
 
 MAX_CONVERSATION_HISTORY = settings.max_conversation_history
 MESSAGE_CHUNK_SIZE = settings.message_chunk_size
@@ -0,0 +1,115 @@
+import asyncio
+import contextvars
+import logging
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+import aiohttp
+
+from config import STAGE_TIMEOUTS, MODEL_STAGE_TIMEOUTS
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a pipeline stage runs out of time."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Timed out during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """Time budget for one request, shared by every stage it runs."""
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.stage = None  # stage currently running
+        self.timed_out_stage = None  # first stage that ran out of time
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+
+# Deadline of the request being handled. Tasks started by the request inherit it.
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def set_deadline(deadline: Optional[Deadline]) -> contextvars.Token:
+    """Make deadline the budget for the current request. Returns a token for reset_deadline."""
+    return _current_deadline.set(deadline)
+
+
+def reset_deadline(token: contextvars.Token):
+    _current_deadline.reset(token)
+
+
+def stage_limit(name: str, model: Optional[str] = None) -> Optional[float]:
+    """Configured time limit for a stage, with per-model overrides."""
+    model_limits = MODEL_STAGE_TIMEOUTS.get(model, {}) if model else {}
+    return model_limits.get(name, STAGE_TIMEOUTS.get(name))
+
+
+class Stage:
+    """One step of the pipeline with its own time limit, capped by the request deadline."""
+
+    def __init__(self, name: str, model: Optional[str] = None):
+        self.name = name
+        self.deadline = current_deadline()
+        limits = [limit for limit in (stage_limit(name, model),
+                                      self.deadline.remaining() if self.deadline else None)
+                  if limit is not None]
+        self.expires_at = time.monotonic() + min(limits) if limits else None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left for this stage (None = unlimited)."""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def timeout(self) -> aiohttp.ClientTimeout:
+        """aiohttp timeout covering the rest of this stage."""
+        return aiohttp.ClientTimeout(total=self.remaining())
+
+    def check(self):
+        """Raise DeadlineExceeded if the stage is out of time."""
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            raise self.expired()
+
+    def expired(self) -> DeadlineExceeded:
+        if self.deadline and self.deadline.timed_out_stage is None:
+            self.deadline.timed_out_stage = self.name
+        logger.warning(f"[Deadline] Stage '{self.name}' ran out of time")
+        return DeadlineExceeded(self.name)
+
+
+@contextmanager
+def stage(name: str, model: Optional[str] = None):
+    """Run a block as a named stage.
+
+    Yields a Stage whose timeout / remaining() the block should use. Timeouts inside
+    the block are reported as DeadlineExceeded(name).
+    """
+    current = Stage(name, model)
+    if current.deadline:
+        current.deadline.stage = name
+    current.check()
+    try:
+        yield current
+    except asyncio.TimeoutError:
+        raise current.expired()
+
+
+@asynccontextmanager
+async def stage_session(name: str, model: Optional[str] = None, **session_kwargs):
+    """aiohttp.ClientSession whose requests are bounded by the stage time limit."""
+    with stage(name, model) as current:
+        async with aiohttp.ClientSession(timeout=current.timeout, **session_kwargs) as session:
+            yield session
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import math
+import os
+from typing import Awaitable, Callable, Dict, Optional
+
+from config import DERIVED_ASSETS_ENABLED, DERIVED_SPRITE_FRAMES
+from last_frame import extract_last_frame
+from media_probe import MediaProber
+from media_registry import MediaRegistry
+from media_workers import media_workers
+
+logger = logging.getLogger(__name__)
+
+DERIVED_FOLDER = "derived"  # subfolder of the video's folder
+POSTER_WIDTH = 640
+SPRITE_THUMB_WIDTH = 160
+SPRITE_COLUMNS = 5
+# Points in a build that get() can wait for; the swap stage is done once the swap was tried
+STAGES = ("last_frame", "last_frame_swapped", "poster")
+
+
+class DerivedAssets:
+    """Builds preview assets for each new video in the background.
+
+    For every video that lands in a session this extracts the last frame (face-swapped
+    ahead of time, so "Use Last Frame" is a lookup), a small poster frame and a
+    seek-thumbnail sprite sheet. Each result goes into the video's media registry
+    metadata under "derived" (stamped with the video's size and mtime) as soon as
+    it exists, so callers can wait for just the asset they need.
+    """
+
+    def __init__(self, registry: MediaRegistry, prober: MediaProber, enabled: bool = DERIVED_ASSETS_ENABLED,
+                 sprite_frames: int = DERIVED_SPRITE_FRAMES):
+        self.registry = registry
+        self.prober = prober
+        self.enabled = enabled
+        self.sprite_frames = sprite_frames
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._stages: Dict[str, Dict[str, asyncio.Event]] = {}
+
+    @staticmethod
+    def _output_path(video_path: str, suffix: str) -> str:
+        folder = os.path.join(os.path.dirname(video_path), DERIVED_FOLDER)
+        os.makedirs(folder, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(video_path))[0]
+        return os.path.join(folder, f"{stem}_{suffix}")
+
+    async def _ffmpeg(self, args, output_path: str, kind: str, video_path: str) -> Optional[str]:
+        returncode, stderr = await media_workers.run_ffmpeg(
+            args, timeout=60, kind=kind, priority="normal", label=os.path.basename(video_path)
+        )
+        if returncode != 0 or not os.path.exists(output_path):
+            logger.warning(f"[Derived] {kind} failed for {os.path.basename(video_path)}: {stderr[:200]}")
+            return None
+        return output_path
+
+    async def _poster(self, video_path: str, duration: Optional[float]) -> Optional[str]:
+        output_path = self._output_path(video_path, "poster.jpg")
+        # A little way in, past fade-ins and black first frames
+        seek = min(1.0, duration * 0.1) if duration else 0
+        return await self._ffmpeg([
+            "-ss", f"{seek:.3f}",
+            "-i", video_path,
+            "-vframes", "1",
+            "-vf", f"scale={POSTER_WIDTH}:-2",
+            "-q:v", "4",
+            output_path,
+        ], output_path, "poster", video_path)
+
+    async def _sprite(self, video_path: str, probe: Optional[Dict]) -> Optional[Dict]:
+        """Evenly spaced thumbnails tiled into one JPEG, with the grid needed to index it."""
+        if not probe or not probe.get("duration") or not probe.get("width") or not probe.get("height"):
+            return None
+        duration = probe["duration"]
+        count = max(1, min(self.sprite_frames, math.ceil(duration)))
+        columns = min(SPRITE_COLUMNS, count)
+        rows = math.ceil(count / columns)
+        # ffmpeg autorotates while decoding, so tiles follow the displayed (rotated) shape
+        width, height = probe["width"], probe["height"]
+        if probe.get("rotation") in (90, 270):
+            width, height = height, width
+        thumb_height = max(2, round(SPRITE_THUMB_WIDTH * height / width / 2) * 2)
+
+        output_path = self._output_path(video_path, "sprite.jpg")
+        path = await self._ffmpeg([
+            "-i", video_path,
+            "-vf", f"fps={count}/{duration:.3f},scale={SPRITE_THUMB_WIDTH}:{thumb_height},tile={columns}x{rows}",
+            "-frames:v", "1",
+            "-q:v", "5",
+            output_path,
+        ], output_path, "sprite", video_path)
+        if not path:
+            return None
+        return {
+            "path": path,
+            "count": count,
+            "columns": columns,
+            "rows": rows,
+            "thumb_width": SPRITE_THUMB_WIDTH,
+            "thumb_height": thumb_height,
+            "interval": duration / count,
+        }
+
+    def _mark(self, video_path: str, *stages: str):
+        events = self._stages.get(os.path.abspath(video_path), {})
+        for stage in stages:
+            if stage in events:
+                events[stage].set()
+
+    def _record(self, video_path: str, derived: Dict, stage: Optional[str] = None, **fields):
+        """Add results to the video's "derived" metadata right away and wake anyone waiting on them."""
+        derived.update(fields)
+        self.registry.update_metadata(video_path, derived=dict(derived))
+        if stage:
+            self._mark(video_path, stage)
+
+    async def _swap_last_frame(self, video_path: str, derived: Dict, last_frame: str,
+                               faceswap: Callable[[str], Awaitable[Optional[str]]], character: Optional[str]):
+        try:
+            swapped = await faceswap(last_frame)
+            self._record(video_path, derived, "last_frame_swapped", last_frame_swapped=swapped, swapped_for=character)
+        except Exception as e:
+            # Left unswapped; "Use Last Frame" swaps it on demand
+            logger.warning(f"[Derived] Face swap of last frame failed for {os.path.basename(video_path)}: {e}")
+            self._mark(video_path, "last_frame_swapped")
+
+    async def _poster_step(self, video_path: str, derived: Dict, duration: Optional[float]):
+        self._record(video_path, derived, "poster", poster=await self._poster(video_path, duration))
+
+    async def build(self, video_path: str, faceswap: Optional[Callable[[str], Awaitable[Optional[str]]]] = None,
+                    character: Optional[str] = None) -> Optional[Dict]:
+        """Extract the last frame, poster and sprite of a video and record them.
+
+        The face swap of the last frame goes through the busy SD queue, so it runs
+        alongside the poster and sprite instead of holding them up.
+
+        Args:
+            video_path: Video to process
+            faceswap: Optional coroutine function applied to the last frame
+            character: Character the face swap was made for (so a later lookup can tell
+                whether it still applies)
+
+        Returns:
+            The "derived" metadata, or None if the video can't be read
+        """
+        try:
+            stat = os.stat(video_path)
+        except OSError:
+            return None
+
+        derived = {"size": stat.st_size, "mtime": stat.st_mtime}
+        steps = []
+        # Last frame first: it is what the user is most likely to ask for
+        picked = await extract_last_frame(video_path, self._output_path(video_path, "last.png"), self.prober,
+                                          priority="normal")
+        if picked:
+            last_frame = picked.pop("path")
+            self._record(video_path, derived, "last_frame", last_frame=last_frame, last_frame_pick=picked)
+            if faceswap:
+                steps.append(self._swap_last_frame(video_path, derived, last_frame, faceswap, character))
+        self._mark(video_path, "last_frame", *([] if steps else ["last_frame_swapped"]))
+
+        probe = await self.prober.probe(video_path)
+        steps.append(self._poster_step(video_path, derived, probe.get("duration") if probe else None))
+        sprite, *_ = await asyncio.gather(self._sprite(video_path, probe), *steps)
+        self._record(video_path, derived, sprite=sprite)
+        logger.info(f"[Derived] Assets ready for {os.path.basename(video_path)}")
+        return derived
+
+    def schedule(self, video_path: str, faceswap: Optional[Callable[[str], Awaitable[Optional[str]]]] = None,
+                 character: Optional[str] = None) -> Optional[asyncio.Task]:
+        """Start building a video's derived assets in the background."""
+        if not self.enabled:
+            return None
+        key = os.path.abspath(video_path)
+        task = self._tasks.get(key)
+        if task is None or task.done():
+            self._stages[key] = {stage: asyncio.Event() for stage in STAGES}
+            task = asyncio.create_task(self._run(key, faceswap, character))
+            self._tasks[key] = task
+        return task
+
+    async def _run(self, key: str, faceswap, character):
+        try:
+            return await self.build(key, faceswap, character)
+        except Exception as e:
+            logger.error(f"[Derived] Failed for {os.path.basename(key)}: {e}")
+            return None
+        finally:
+            self._mark(key, *STAGES)
+            self._stages.pop(key, None)
+            self._tasks.pop(key, None)
+
+    def building(self, video_path: str) -> bool:
+        """Whether a build of this video is still running."""
+        return os.path.abspath(video_path) in self._tasks
+
+    async def get(self, video_path: str, wait: bool = True, until: Optional[str] = None) -> Optional[Dict]:
+        """A video's derived assets, waiting for an in-flight build if asked.
+
+        Args:
+            video_path: Video to look up
+            wait: Wait for a build that is still running
+            until: With wait, return once this stage (one of STAGES) is recorded
+                instead of waiting for the whole build
+
+        Returns:
+            The "derived" metadata recorded so far; None if nothing was built yet or
+            the video changed since.
+        """
+        if until is not None and until not in STAGES:
+            raise ValueError(f"Unknown derived asset stage: {until}")
+        key = os.path.abspath(video_path)
+        task = self._tasks.get(key)
+        if task is not None and wait:
+            event = self._stages.get(key, {}).get(until) if until else None
+            if event is None:
+                # Shielded so a caller going away doesn't cancel the shared build
+                await asyncio.shield(task)
+            elif not event.is_set():
+                await event.wait()
+
+        entry = self.registry.get(key)
+        derived = entry["metadata"].get("derived") if entry else None
+        if not derived:
+            return None
+        try:
+            stat = os.stat(key)
+        except OSError:
+            return None
+        if derived.get("size") != stat.st_size or derived.get("mtime") != stat.st_mtime:
+            return None
+        return derived
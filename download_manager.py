@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from typing import Dict, Optional
+
+import aiohttp
+
+from config import MAX_RETRIES, RETRY_BASE_DELAY
+from deadline import stage
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB - bounds memory per download
+
+
+class DownloadError(Exception):
+    """Raised when a file could not be downloaded or failed verification."""
+
+
+def sha256_file(file_path: str) -> str:
+    """SHA256 of a file, read in chunks."""
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _total_size(response: aiohttp.ClientResponse, offset: int) -> Optional[int]:
+    """Work out the full file size from Content-Range or Content-Length."""
+    content_range = response.headers.get('Content-Range')
+    if content_range:
+        match = re.match(r'bytes \d+-\d+/(\d+)', content_range)
+        if match:
+            return int(match.group(1))
+    if response.content_length is not None:
+        return offset + response.content_length
+    return None
+
+
+class DownloadManager:
+    """Streams remote files to disk with bounded memory.
+
+    Data is written in chunks to a ``.part`` file next to the destination. Failed
+    transfers are resumed with an HTTP Range request, the result is checked against
+    the expected size / SHA256, and only then atomically renamed into place.
+    Completed session media is recorded in the media registry and, with a blob
+    store, stored by content; a URL that was downloaded before is linked from its
+    blob instead of being fetched again.
+    """
+
+    def __init__(self, registry=None, blobs=None, max_retries: int = MAX_RETRIES,
+                 chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+        self.registry = registry
+        self.blobs = blobs
+        self.max_retries = max_retries
+        self.chunk_size = chunk_size
+
+    async def _fetch(self, session: aiohttp.ClientSession, url: str, part_path: str,
+                     headers: Optional[Dict] = None) -> Optional[int]:
+        """Fetch (or resume) url into part_path. Returns the expected total size if known."""
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request_headers = dict(headers or {})
+        if offset:
+            request_headers['Range'] = f"bytes={offset}-"
+
+        async with session.get(url, headers=request_headers) as resp:
+            if resp.status == 416 and offset:
+                # Range not satisfiable - the part file already holds the whole body
+                return offset
+            if resp.status not in [200, 206]:
+                raise DownloadError(f"HTTP {resp.status}")
+
+            if resp.status == 200 and offset:
+                # Server ignored the Range header, start over
+                logger.info(f"[Download] Server does not support resume, restarting {os.path.basename(part_path)}")
+                offset = 0
+
+            total = _total_size(resp, offset)
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                async for chunk in resp.content.iter_chunked(self.chunk_size):
+                    await asyncio.to_thread(f.write, chunk)
+            return total
+
+    async def download(self, url: str, dest_path: str, expected_size: Optional[int] = None,
+                       sha256: Optional[str] = None, headers: Optional[Dict] = None,
+                       session: Optional[aiohttp.ClientSession] = None, keep_partial: bool = False) -> Dict:
+        """Download url to dest_path, resuming and verifying as needed.
+
+        The .part file is deleted when the download fails after all retries or is
+        cancelled, unless keep_partial is set (for callers that resume it on a later run).
+
+        Returns a dict with the final path, size and sha256.
+        Raises DownloadError if the download fails after all retries or does not verify.
+        """
+        part_path = f"{dest_path}.part"
+        owns_session = session is None
+        if owns_session:
+            session = aiohttp.ClientSession()
+
+        try:
+            last_error = None
+            for attempt in range(self.max_retries):
+                try:
+                    total = await self._fetch(session, url, part_path, headers=headers)
+                    expected_size = expected_size or total
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError, DownloadError) as e:
+                    last_error = e
+                    if attempt < self.max_retries - 1:
+                        delay = RETRY_BASE_DELAY * (2 ** attempt)
+                        logger.warning(
+                            f"[Download] {os.path.basename(dest_path)} failed (attempt {attempt + 1}/{self.max_retries}): {e}. "
+                            f"Resuming in {delay}s..."
+                        )
+                        await asyncio.sleep(delay)
+            else:
+                raise DownloadError(f"Download of {url} failed after {self.max_retries} attempts: {last_error}")
+        except BaseException:
+            # Includes cancellation (e.g. a timed-out stage), which would otherwise leave the .part behind
+            if not keep_partial and os.path.exists(part_path):
+                os.unlink(part_path)
+            raise
+        finally:
+            if owns_session:
+                await session.close()
+
+        size = os.path.getsize(part_path)
+        if expected_size is not None and size != expected_size:
+            os.unlink(part_path)
+            raise DownloadError(f"Size mismatch for {os.path.basename(dest_path)}: got {size}, expected {expected_size}")
+
+        digest = await asyncio.to_thread(sha256_file, part_path)
+        if sha256 and digest.lower() != sha256.lower():
+            os.unlink(part_path)
+            raise DownloadError(f"Checksum mismatch for {os.path.basename(dest_path)}")
+
+        os.replace(part_path, dest_path)
+        logger.info(f"[Download] Saved {dest_path} ({size / 1024 / 1024:.1f} MB)")
+        return {"path": dest_path, "size": size, "sha256": digest}
+
+    async def _reuse(self, url: str, dest_path: str) -> Optional[Dict]:
+        """Link a stored copy of a URL's earlier download to dest_path, if there is one."""
+        if not self.registry or not self.blobs:
+            return None
+        for entry in reversed(self.registry.find_by_source_url(url)):
+            if self.blobs.has(entry.get("sha256"), entry.get("size")) and await self.blobs.link(entry["sha256"], dest_path):
+                logger.info(f"[Download] {os.path.basename(dest_path)} already downloaded, linked from the blob store")
+                return {"path": dest_path, "size": entry["size"], "sha256": entry["sha256"]}
+        return None
+
+    async def download_to_session(self, url: str, conversation_manager, filename: str,
+                                  media_type: str, metadata: Optional[Dict] = None) -> str:
+        """Download generated media into the session folder and record it in the registry."""
+        dest_path = os.path.join(conversation_manager.subfolder_path, filename)
+        result = await self._reuse(url, dest_path)
+        if result is None:
+            with stage("download") as download_stage:
+                result = await asyncio.wait_for(self.download(url, dest_path), timeout=download_stage.remaining())
+            if self.blobs:
+                await self.blobs.ingest(dest_path, result["sha256"])
+
+        if self.registry:
+            self.registry.record(
+                dest_path,
+                media_type=media_type,
+                session_id=conversation_manager.session_id,
+                source_url=url,
+                size=result["size"],
+                sha256=result["sha256"],
+                metadata=metadata,
+            )
+        return dest_path
@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+from config import FACE_GATE_ENABLED, FACE_GATE_MIN_SCORE, FACE_GATE_MIN_SIZE
+from media_workers import media_workers
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # opencv-python is optional; without it every image is swapped
+    cv2 = None
+
+logger = logging.getLogger(__name__)
+
+MAX_DETECT_SIDE = 640  # images are downscaled to this before detection
+
+_cascades = None
+_cascade_lock = threading.Lock()  # CascadeClassifier isn't safe to share across threads
+
+
+def _load_cascades():
+    global _cascades
+    if _cascades is None:
+        _cascades = [
+            (name, cv2.CascadeClassifier(cv2.data.haarcascades + filename))
+            for name, filename in (
+                ("frontal", "haarcascade_frontalface_default.xml"),
+                ("profile", "haarcascade_profileface.xml"),
+            )
+        ]
+    return _cascades
+
+
+def _detect(image_path: str) -> Optional[Dict]:
+    # np.fromfile + imdecode also handles non-ASCII Windows paths, unlike imread
+    image = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        logger.warning(f"[Face Gate] Could not read {image_path}")
+        return None
+
+    height, width = image.shape[:2]
+    scale = min(1.0, MAX_DETECT_SIDE / max(height, width))
+    if scale < 1.0:
+        image = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    image = cv2.equalizeHist(image)
+    min_side = max(int(min(image.shape[:2]) * FACE_GATE_MIN_SIZE), 20)
+
+    faces = 0
+    best_score = 0.0
+    with _cascade_lock:
+        for name, cascade in _load_cascades():
+            # Profile cascade only finds faces turned left, so also try the mirrored image
+            variants = [image] if name == "frontal" else [image, cv2.flip(image, 1)]
+            for candidate in variants:
+                boxes, _, weights = cascade.detectMultiScale3(
+                    candidate, scaleFactor=1.1, minNeighbors=4,
+                    minSize=(min_side, min_side), outputRejectLevels=True,
+                )
+                for weight in (weights.flatten() if len(boxes) else []):
+                    best_score = max(best_score, float(weight))
+                    if weight >= FACE_GATE_MIN_SCORE:
+                        faces += 1
+
+    return {
+        "detector": "haar",
+        "faces": faces,
+        "score": round(best_score, 2),
+        "threshold": FACE_GATE_MIN_SCORE,
+    }
+
+
+async def detect_faces(image_path: str) -> Optional[Dict]:
+    """Look for faces in an image with OpenCV's Haar cascades, in the media worker pool.
+
+    Args:
+        image_path: Image to check
+
+    Returns:
+        {"detector", "faces", "score", "threshold"}, or None if the gate is disabled,
+        OpenCV isn't installed or the image couldn't be read (callers should then
+        assume there is a face)
+    """
+    if not FACE_GATE_ENABLED or cv2 is None:
+        return None
+    try:
+        return await media_workers.run_cpu(_detect, image_path, kind="face_detect", priority="interactive",
+                                           label=os.path.basename(image_path))
+    except Exception as e:
+        logger.warning(f"[Face Gate] Detection failed for {image_path}: {e}")
+        return None
@@ -0,0 +1,192 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Set
+
+import aiohttp
+
+from config import FACE_MODEL_CACHE_FILE
+from sd_pool import SDBackend
+
+logger = logging.getLogger(__name__)
+
+FACE_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+MAX_FACE_IMAGES = 20  # reference images blended into one face model
+
+
+def _face_images(folder: str) -> List[str]:
+    """Reference images in a faces folder, in a stable order."""
+    if not folder or not os.path.isdir(folder):
+        return []
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(FACE_IMAGE_EXTENSIONS)
+    )[:MAX_FACE_IMAGES]
+
+
+def folder_fingerprint(folder: str) -> Optional[str]:
+    """Hash of a faces folder's file names, sizes and mtimes (None if it has no images)."""
+    images = _face_images(folder)
+    if not images:
+        return None
+    sha = hashlib.sha256()
+    for path in images:
+        stat = os.stat(path)
+        sha.update(f"{os.path.basename(path)}|{stat.st_size}|{stat.st_mtime}\n".encode('utf-8'))
+    return sha.hexdigest()
+
+
+def _encode_images(paths: List[str]) -> List[str]:
+    encoded = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            encoded.append(base64.b64encode(f.read()).decode('utf-8'))
+    return encoded
+
+
+class FaceModelCache:
+    """Builds one ReActor face model per character faces folder and remembers it.
+
+    ReActor in "Source Folder" mode picks a random reference image on every swap. A
+    face model blends all of them once (POST /reactor/facemodels) and is then reused
+    with "Face Model" as the source. Models are named after the folder fingerprint, so
+    adding, removing or editing a reference image builds a fresh model. Each Forge
+    backend keeps its own models folder, so entries are per backend, and the first
+    use of a backend in this process checks which cached models it really has (its
+    models folder may have been cleared, or another machine may answer on its URL).
+    """
+
+    def __init__(self, path: str = FACE_MODEL_CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = self._load()
+        self._builds: Dict[str, asyncio.Lock] = {}
+        self._backend_models: Dict[str, Set[str]] = {}  # base_url -> model names it was seen to have
+
+    def _load(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load face model cache {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Failed to save face model cache {self.path}: {e}")
+
+    @staticmethod
+    def model_name(folder: str, fingerprint: str) -> str:
+        base = re.sub(r'[^A-Za-z0-9_-]+', '_', os.path.basename(os.path.normpath(folder))).strip('_') or 'face'
+        return f"{base}_{fingerprint[:10]}"
+
+    async def get(self, backend: SDBackend, folder: str) -> Optional[str]:
+        """Face model filename for a faces folder on a backend, building it if needed.
+
+        Args:
+            backend: Forge backend the swap will run on
+            folder: Character's source faces folder
+
+        Returns:
+            Face model filename (e.g. "mia_1a2b3c4d5e.safetensors"), or None if it
+            could not be built (callers then fall back to the faces folder)
+        """
+        fingerprint = await asyncio.to_thread(folder_fingerprint, folder)
+        if not fingerprint:
+            return None
+
+        key = f"{backend.base_url}|{os.path.abspath(folder)}"
+        lock = self._builds.setdefault(key, asyncio.Lock())
+        async with lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry and entry.get('fingerprint') == fingerprint:
+                if await self._backend_has(backend, entry.get('model')):
+                    return entry.get('model')
+                logger.info(f"[Face Models] {entry.get('model')} is missing on {backend.base_url}, rebuilding")
+
+            name = self.model_name(folder, fingerprint)
+            model = await self._build(backend, folder, name)
+            if not model:
+                return None
+            with self._lock:
+                self._entries[key] = {'fingerprint': fingerprint, 'model': model}
+                self._save()
+            if backend.base_url in self._backend_models:
+                self._backend_models[backend.base_url].add(self._stem(model))
+            return model
+
+    @staticmethod
+    def _stem(model: str) -> str:
+        return os.path.splitext(os.path.basename(model))[0]
+
+    async def _backend_has(self, backend: SDBackend, model: Optional[str]) -> bool:
+        """Whether a backend has a face model, from its model list (fetched once per process).
+
+        A list that can't be fetched counts as empty, so each model is rebuilt once
+        rather than trusted: ReActor silently skips the swap when its face model is
+        missing. Models built since are added to the list.
+        """
+        if not model:
+            return False
+        models = self._backend_models.get(backend.base_url)
+        if models is None:
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.get(f"{backend.base_url}/reactor/facemodels",
+                                           timeout=aiohttp.ClientTimeout(total=20)) as response:
+                        if response.status != 200:
+                            raise aiohttp.ClientError(f"HTTP {response.status}")
+                        data = await response.json()
+                # Names come without the .safetensors extension (or as paths, depending on the ReActor version)
+                models = {self._stem(name) for name in data.get("facemodels", [])}
+            except Exception as e:
+                logger.warning(f"[Face Models] Listing models on {backend.base_url} failed: {e}")
+                models = set()
+            self._backend_models[backend.base_url] = models
+        return self._stem(model) in models
+
+    async def _build(self, backend: SDBackend, folder: str, name: str) -> Optional[str]:
+        images = await asyncio.to_thread(_encode_images, _face_images(folder))
+        payload = {
+            "source_images": images,
+            "name": name,
+            "compute_method": 0,  # 0 - Mean, 1 - Median, 2 - Mode
+            "shape_check": False,
+        }
+        logger.info(f"[Face Models] Building '{name}' from {len(images)} image(s) in {folder} on {backend.base_url}")
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{backend.base_url}/reactor/facemodels", json=payload,
+                                        timeout=aiohttp.ClientTimeout(total=120)) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        logger.warning(f"[Face Models] Build failed ({response.status}): {error_text[:200]}")
+                        return None
+        except Exception as e:
+            logger.warning(f"[Face Models] Build failed: {e}")
+            return None
+        return f"{name}.safetensors"
+
+    def status(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {"backend": key.split('|', 1)[0], "folder": key.split('|', 1)[1], **entry}
+                for key, entry in self._entries.items()
+            ]
+
+
+# Shared instance so every ImageManager reuses the same face models
+face_models = FaceModelCache()
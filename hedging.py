@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from config import HEDGE_STAGGER, HEDGE_MIN_SAMPLES
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 50  # recent samples kept per backend
+
+
+class LatencyTracker:
+    """Recent end-to-end latencies of each image backend ("sd", "qwen")."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples: Dict[str, Deque[float]] = {}
+        self.window = window
+
+    def record(self, backend: str, seconds: float):
+        self.samples.setdefault(backend, deque(maxlen=self.window)).append(seconds)
+
+    def record_cancelled(self, backend: str, seconds: float):
+        """Record a job cancelled after `seconds` (a hedge it lost), which would have taken at least that long.
+
+        Counted as its usual median when that is longer: losing the race says nothing
+        about being faster, and skipping losers would freeze a slow backend's history.
+        """
+        median = self.percentile(backend, 50)
+        self.record(backend, max(seconds, median) if median is not None else seconds)
+
+    def percentile(self, backend: str, q: float) -> Optional[float]:
+        """q-th percentile (0-100) of recent latencies, or None without enough history."""
+        samples = sorted(self.samples.get(backend, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        index = min(int(round(q / 100 * (len(samples) - 1))), len(samples) - 1)
+        return samples[index]
+
+    def status(self) -> Dict:
+        return {
+            backend: {
+                "samples": len(samples),
+                "p50": self.percentile(backend, 50),
+                "p90": self.percentile(backend, 90),
+            }
+            for backend, samples in self.samples.items()
+        }
+
+
+latency_tracker = LatencyTracker()
+
+
+def plan_hedge(primary: str, secondary: str, primary_penalty: float = 1.0,
+               secondary_delay: float = 0.0) -> Tuple[str, str, Optional[float]]:
+    """Decide which backend starts first and when (if at all) to start the other.
+
+    Args:
+        primary: Preferred backend
+        secondary: The other backend
+        primary_penalty: Multiplier on the primary's expected latency (e.g. SD queue depth)
+        secondary_delay: Seconds added to the secondary's expected latency (e.g. its
+            face swap waiting behind the SD queue)
+
+    Returns:
+        (first, second, stagger) - stagger is None when hedging isn't worth it
+    """
+    p50 = {name: latency_tracker.percentile(name, 50) for name in (primary, secondary)}
+    p90 = {name: latency_tracker.percentile(name, 90) for name in (primary, secondary)}
+    if p50[primary] is not None:
+        p50[primary] *= primary_penalty
+        p90[primary] *= primary_penalty
+    if p50[secondary] is not None:
+        p50[secondary] += secondary_delay
+        p90[secondary] += secondary_delay
+
+    first, second = primary, secondary
+    if p50[primary] is not None and p50[secondary] is not None and p50[secondary] < p50[primary]:
+        first, second = secondary, primary
+
+    # Start the backup once the first backend is slower than it usually is
+    stagger = p90[first] if p90[first] is not None else HEDGE_STAGGER
+    # A backup that typically takes longer than the first's slow case rarely wins; skip it
+    if p50[second] is not None and p90[first] is not None and p50[second] >= p90[first]:
+        return first, second, None
+    return first, second, stagger
+
+
+async def race(legs: List[Tuple[str, Callable[[], Awaitable]]], stagger: Optional[float]):
+    """Run the first leg, start the second after stagger seconds, return the first success.
+
+    A leg succeeds when it returns a truthy result. If the first leg fails before the
+    stagger, the second starts immediately. The losing leg is cancelled, which stops
+    its remote work.
+
+    Returns:
+        (leg name, result), or (None, None) if every leg failed
+    """
+    pending = list(legs)
+    tasks: Dict[asyncio.Task, str] = {}
+
+    def start_next():
+        name, factory = pending.pop(0)
+        logger.info(f"[Hedge] Starting {name}")
+        tasks[asyncio.create_task(factory())] = name
+
+    start_next()
+    started_at = time.monotonic()
+    try:
+        while tasks:
+            timeout = None
+            if pending and stagger is not None:
+                timeout = max(stagger - (time.monotonic() - started_at), 0)
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.info(f"[Hedge] No result after {stagger:.1f}s, hedging")
+                start_next()
+                continue
+            for task in done:
+                name = tasks.pop(task)
+                if not task.cancelled() and task.exception() is None and task.result():
+                    for loser, loser_name in tasks.items():
+                        logger.info(f"[Hedge] {name} won, cancelling {loser_name}")
+                        loser.cancel()
+                    return name, task.result()
+                logger.warning(f"[Hedge] {name} failed: {task.exception() if not task.cancelled() else 'cancelled'}")
+            if pending and not tasks:
+                start_next()
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+    return None, None
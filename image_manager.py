@@ -1,13 +1,15 @@
+import asyncio
+import glob
+import json
 import os
+import random
 import re
+import shutil
+import uuid
 import logging
 import aiohttp
 import base64
-import io
-from PIL import Image
-from datetime import datetime
 from config import (
-    STABLE_DIFFUSION_URL, 
     INSIGHTFACE_MODEL_PATH,
     IMAGE_WIDTH,
     IMAGE_HEIGHT,
@@ -22,15 +24,109 @@ from config import (
     LUMINA_SCHEDULER,
     LUMINA_STEPS,
     LUMINA_CFG_SCALE,
-    LUMINA_SHIFT
+    LUMINA_SHIFT,
+    SD_MAX_BATCH_SIZE,
+    SD_SHARED_OUTPUT_DIR,
+    SD_SHARED_OUTPUT_REMOTE_DIR
 )
+from blob_store import blob_store, unique_timestamp
 from characters import characters
+from deadline import stage_session
+from face_models import face_models, folder_fingerprint
+from render_cache import render_cache, render_key
+from sd_queue import sd_queue
 
 logger = logging.getLogger(__name__)
 
+
+class SDOutputFile:
+    """An image file to store as a result instead of base64 data.
+
+    Either one Forge saved to the shared output folder (moved into the session), or
+    with keep=True an earlier render served from the render cache (linked or copied).
+    """
+
+    def __init__(self, path, keep=False):
+        self.path = path
+        self.keep = keep
+
+    def __repr__(self):
+        return f"SDOutputFile({self.path!r})"
+
+
+def _image_extension(data: bytes) -> str:
+    """File extension matching the encoded image bytes (Forge can be set to jpg/webp output)."""
+    if data[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    return ".png"
+
+
+def _write_base64_image(image_data: str, path: str) -> str:
+    """Decode a base64 image and write the bytes as-is. Returns the path written."""
+    data = base64.b64decode(image_data.split(",", 1)[-1])
+    root, ext = os.path.splitext(path)
+    if ext.lower() in (".png", ".jpg", ".jpeg", ".webp") and _image_extension(data) != ext.lower():
+        path = root + _image_extension(data)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def _move_output_file(src: str, path: str, keep: bool = False) -> str:
+    """Move a file into the session folder (a rename on the same filesystem).
+
+    With keep=True the source stays in place: the file is hard-linked, or copied
+    if it lives on another filesystem.
+    """
+    root, ext = os.path.splitext(path)
+    src_ext = os.path.splitext(src)[1]
+    if src_ext and src_ext.lower() != ext.lower():
+        path = root + src_ext
+    if not keep:
+        shutil.move(src, path)
+        return path
+    try:
+        os.link(src, path)
+    except OSError:
+        shutil.copy2(src, path)
+    return path
+
+
+def _read_base64(path: str) -> str:
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("utf-8")
+
+
+def _use_shared_output(payload) -> str:
+    """Have Forge save the result to the shared output folder instead of returning base64.
+
+    Returns the filename token used to find the saved files afterwards.
+    """
+    token = uuid.uuid4().hex
+    payload["save_images"] = True
+    payload["send_images"] = False
+    payload.setdefault("override_settings", {}).update({
+        "outdir_samples": SD_SHARED_OUTPUT_REMOTE_DIR,
+        "save_to_dirs": False,
+        "samples_format": "png",
+        "samples_filename_pattern": token,
+    })
+    return token
+
+
+def _shared_outputs(token: str):
+    """Files Forge saved for a request, in generation order."""
+    # Forge prefixes a running number (00042-<token>.png), so name order is generation order
+    paths = sorted(glob.glob(os.path.join(SD_SHARED_OUTPUT_DIR, f"*{token}*")))
+    return [SDOutputFile(path) for path in paths]
+
+
 class ImageManager:
-    def __init__(self, conversation_manager, character_name, api_manager):
+    def __init__(self, conversation_manager, character_name, api_manager, media_registry=None):
         self.conversation_manager = conversation_manager
+        self.media_registry = media_registry  # saved images are recorded with their hash
         self.character_name = character_name
         self.api_manager = api_manager # Store api_manager instance
         self.image_prompt = characters[character_name]["image_prompt"]
@@ -181,7 +277,7 @@ class ImageManager:
             logger.error("Failed to get prompt from media LLM")
             return None
 
-    async def generate_image(self, prompt, first_person_mode=False, sd_mode="lumina", sd_checkpoint=None):
+    def _build_txt2img_payload(self, prompt, first_person_mode=False, sd_mode="lumina", sd_checkpoint=None):
         # Determine if we should use ReActor (Face Swap)
         # If first_person_mode is True, we DISABLE ReActor because we want a generic/scene view, not the character's face
         use_reactor = not first_person_mode
@@ -267,30 +363,237 @@ class ImageManager:
             }
             logger.info(f"Using XL mode with model: {xl_model}")
 
-        logger.info(f"Sending payload to Stable Diffusion: {payload}")
+        return payload
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(STABLE_DIFFUSION_URL, json=payload, headers={'Content-Type': 'application/json'}) as response:
-                if response.status == 200:
-                    r = await response.json()
-                    if 'images' in r and len(r['images']) > 0:
-                        image_data = r['images'][0]
-                        return image_data
-                    else:
+    async def _txt2img(self, payload):
+        """Send a txt2img payload to Stable Diffusion. Returns the response JSON, or None on failure.
+
+        In shared output mode the response's "images" are SDOutputFile entries for the
+        files Forge saved, rather than base64 strings.
+        """
+        # Wait for a backend turn (batched with other requests for this checkpoint)
+        checkpoint = payload["override_settings"]["sd_model_checkpoint"]
+        token = _use_shared_output(payload) if SD_SHARED_OUTPUT_DIR else None
+        async with sd_queue.slot(checkpoint) as backend:
+            reactor_args = payload["alwayson_scripts"]["reactor"]["args"]
+            if reactor_args[1]:
+                # The swap runs inside this txt2img call, using the cached face model
+                await self._use_face_model(reactor_args, backend)
+            logger.info(f"Sending payload to Stable Diffusion at {backend.base_url}: {payload}")
+            try:
+                async with stage_session("sd_txt2img", checkpoint) as session:
+                    async with session.post(backend.endpoint("txt2img"), json=payload, headers={'Content-Type': 'application/json'}) as response:
+                        if response.status == 200:
+                            r = await response.json()
+                            if token:
+                                r["images"] = await asyncio.to_thread(_shared_outputs, token)
+                            return r
+                        logger.error(f"[Image Gen] txt2img failed with status {response.status}")
                         return None
-                else:
-                    return None
+            except asyncio.CancelledError:
+                await self.interrupt(backend)
+                raise
+
+    async def _render_params(self, payload):
+        """Everything in a txt2img payload that determines the image, for the render cache key."""
+        params = json.loads(json.dumps({
+            key: value for key, value in payload.items()
+            if key not in ("alwayson_scripts", "batch_size", "n_iter")
+        }))
+        reactor_args = payload["alwayson_scripts"]["reactor"]["args"]
+        params["reactor"] = reactor_args[1:24]
+        if reactor_args[1]:
+            # The faces themselves, not just the folder path
+            params["reactor_faces"] = await asyncio.to_thread(folder_fingerprint, reactor_args[24])
+        return params
+
+    @staticmethod
+    def _response_seeds(r):
+        try:
+            info = json.loads(r.get('info') or '{}')
+        except ValueError:
+            return []
+        return info.get('all_seeds') or ([info['seed']] if 'seed' in info else [])
+
+    async def generate_image(self, prompt, first_person_mode=False, sd_mode="lumina", sd_checkpoint=None, seed=-1, steps=None):
+        """Generate one image, or return the cached render when the seed is given.
+
+        Args:
+            prompt: Image prompt
+            first_person_mode: Disable ReActor face swap
+            sd_mode: "lumina" or "xl"
+            sd_checkpoint: Checkpoint filename
+            seed: Seed to render with (-1 = random)
+            steps: Sampling steps (None = the mode's default)
+
+        Returns:
+            {"image": base64 data or SDOutputFile, "seed": int, "steps": int,
+            "cache_key": str, "cached": bool}, or None if failed
+        """
+        payload = self._build_txt2img_payload(prompt, first_person_mode, sd_mode, sd_checkpoint)
+        if steps:
+            payload["steps"] = steps
+        payload["seed"] = seed
+        params = await self._render_params(payload)
+
+        if seed != -1:
+            cache_key = render_key(params)
+            cached = render_cache.get(cache_key)
+            if cached:
+                logger.info(f"[Image Gen] Render cache hit for seed {seed}: {cached['path']}")
+                return {"image": SDOutputFile(cached["path"], keep=True), "seed": seed,
+                        "steps": payload["steps"], "cache_key": cache_key, "cached": True}
+
+        r = await self._txt2img(payload)
+        if not r or not r.get('images'):
+            return None
+
+        seeds = self._response_seeds(r)
+        params["seed"] = seeds[0] if seeds else seed
+        return {"image": r['images'][0], "seed": params["seed"], "steps": payload["steps"],
+                "cache_key": render_key(params) if params["seed"] != -1 else None, "cached": False}
+
+    async def generate_image_variants(self, prompt, count, first_person_mode=False, sd_mode="lumina", sd_checkpoint=None):
+        """Generate several variants of one prompt in batched txt2img calls (at most two).
+
+        Args:
+            prompt: Image prompt shared by all variants
+            count: Number of variants
+            first_person_mode: Disable ReActor face swap
+            sd_mode: "lumina" or "xl"
+            sd_checkpoint: Checkpoint filename
 
-    async def save_image(self, image_data):
-        image = Image.open(io.BytesIO(base64.b64decode(image_data.split(",", 1)[0])))
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        image_file_name = f"selfie_image_{timestamp}.png"
+        Returns:
+            List of {"image": base64 data or SDOutputFile, "seed": int, "steps": int,
+            "cache_key": str}, or None if failed
+        """
+        payload = self._build_txt2img_payload(prompt, first_person_mode, sd_mode, sd_checkpoint)
+        params = await self._render_params(payload)
+        # Fixed base seed so every variant's seed is known; SD uses seed, seed+1, ... per image
+        base_seed = random.randint(0, 2**32 - 1)
+        batch_size = min(count, SD_MAX_BATCH_SIZE)
+        # Full batches, then one smaller batch for the remainder, so no extra images are rendered
+        full_batches, remainder = divmod(count, batch_size)
+        calls = [(base_seed, batch_size, full_batches)]
+        if remainder:
+            calls.append((base_seed + full_batches * batch_size, remainder, 1))
+
+        variants = []
+        for seed, size, n_iter in calls:
+            r = await self._txt2img({**payload, "seed": seed, "batch_size": size, "n_iter": n_iter})
+            if not r or not r.get('images'):
+                break
+            seeds = self._response_seeds(r)
+            # Extensions may append extra images - keep only what was asked for
+            for i, image in enumerate(r['images'][:size * n_iter]):
+                # Each image matches a single render at its own seed, so it can be cached as one
+                params["seed"] = seeds[i] if i < len(seeds) else seed + i
+                variants.append({"image": image, "seed": params["seed"], "steps": payload["steps"],
+                                 "cache_key": render_key(params)})
+        return variants or None
+
+    async def interrupt(self, backend):
+        """Stop the job a Stable Diffusion backend is currently running."""
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(backend.endpoint("interrupt"), timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    if response.status == 200:
+                        logger.info(f"[Image Gen] Interrupted Stable Diffusion job on {backend.base_url}")
+                    else:
+                        logger.warning(f"[Image Gen] Interrupt failed with status {response.status}")
+        except Exception as e:
+            logger.warning(f"[Image Gen] Interrupt failed: {e}")
+
+    async def save_image(self, image_data, filename=None, cache_key=None, seed=None):
+        """Store a generated image in the session folder without re-encoding it.
+
+        Args:
+            image_data: Base64 image from the SD response, or an SDOutputFile
+            filename: Optional file name (the extension follows the actual image format)
+            cache_key: Render cache key to store the saved file under
+            seed: Seed the image was rendered with (kept alongside the cache entry)
+
+        Returns:
+            Path of the saved image
+        """
+        timestamp = unique_timestamp()
+        image_file_name = filename or f"selfie_image_{timestamp}.png"
         image_file_path = os.path.join(self.conversation_manager.subfolder_path, image_file_name)
-        image.save(image_file_path)
+        # Decoding / file I/O runs in a worker thread to keep the event loop free
+        if isinstance(image_data, SDOutputFile):
+            image_file_path = await asyncio.to_thread(_move_output_file, image_data.path, image_file_path, image_data.keep)
+        else:
+            image_file_path = await asyncio.to_thread(_write_base64_image, image_data, image_file_path)
+        # Stored by content: an identical image (e.g. a repeated face swap) shares the earlier file's data
+        stored = await blob_store.ingest(image_file_path)
+        if stored and self.media_registry:
+            self.media_registry.record(
+                image_file_path,
+                media_type="image",
+                session_id=self.conversation_manager.session_id,
+                size=stored["size"],
+                sha256=stored["sha256"],
+            )
+        if cache_key:
+            render_cache.put(cache_key, image_file_path, seed)
         return image_file_path
 
+    async def _use_face_model(self, reactor_args, backend):
+        """Switch ReActor args from "random image from folder" to the folder's cached face model.
+
+        Returns the face model filename, or None (args unchanged) if it isn't available.
+        """
+        face_model = await face_models.get(backend, reactor_args[24])
+        if face_model:
+            reactor_args[22] = 1  # Select Source: Face Model
+            reactor_args[23] = face_model
+        return face_model
+
+    async def _reactor_swap(self, session, backend, image_base64, face_model):
+        """Swap the face in an image with ReActor's own API (no img2img pass).
+
+        Returns the result as base64, or None if the endpoint failed.
+        """
+        payload = {
+            "source_image": "",
+            "target_image": image_base64,
+            "source_faces_index": [0],
+            "face_index": [0],
+            "upscaler": "None",
+            "scale": 1.5,
+            "upscale_visibility": 1,
+            "face_restorer": "CodeFormer",
+            "restorer_visibility": 1,
+            "codeformer_weight": 0.5,
+            "restore_first": 1,
+            "model": INSIGHTFACE_MODEL_PATH,
+            "gender_source": 0,
+            "gender_target": 0,
+            "save_to_file": 0,
+            "result_file_path": "",
+            "device": "CUDA",
+            "mask_face": 1,
+            "select_source": 1,  # Face Model
+            "face_model": face_model,
+            "source_folder": "",
+            "random_image": 0,
+            "upscale_force": 1,
+            "det_thresh": 0.6,
+            "det_maxnum": 2,
+        }
+        async with session.post(f"{backend.base_url}/reactor/image", json=payload) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                logger.warning(f"[FaceSwap] /reactor/image error {response.status}: {error_text[:200]}")
+                return None
+            r = await response.json()
+            return r.get("image") or None
+
     async def apply_faceswap(self, image_path: str, source_folder: str = None) -> str:
-        """Apply ReActor face swap to an existing image using img2img with denoising_strength=0.
+        """Apply ReActor face swap to an existing image.
+
+        Uses the character's cached face model with ReActor's swap-only endpoint when
+        available, otherwise img2img with denoising_strength=0.1 and ReActor enabled.
         
         Args:
             image_path: Path to the source image to face-swap
@@ -299,13 +602,10 @@ class ImageManager:
         Returns:
             Path to the face-swapped image, or None if failed
         """
-        import base64
-        
         logger.info(f"[FaceSwap] Applying face swap to: {image_path}")
         
         # Read and encode the source image
-        with open(image_path, "rb") as f:
-            image_base64 = base64.b64encode(f.read()).decode("utf-8")
+        image_base64 = await asyncio.to_thread(_read_base64, image_path)
         
         # ReActor args - same as generate_image but always enabled
         reactor_args = [
@@ -357,38 +657,50 @@ class ImageManager:
             "alwayson_scripts": {"reactor": {"args": reactor_args}}
             # No override_settings - use current loaded model
         }
+        token = _use_shared_output(payload) if SD_SHARED_OUTPUT_DIR else None
         
-        img2img_url = STABLE_DIFFUSION_URL.replace("txt2img", "img2img")
-        logger.info(f"[FaceSwap] Sending to img2img API: {img2img_url}")
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(img2img_url, json=payload, headers={'Content-Type': 'application/json'}) as response:
-                    if response.status == 200:
-                        r = await response.json()
-                        if 'images' in r and len(r['images']) > 0:
-                            # Save the face-swapped image
-                            result_data = r['images'][0]
-                            result_image = Image.open(io.BytesIO(base64.b64decode(result_data.split(",", 1)[0])))
-                            
-                            # Save with new filename
-                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            output_filename = f"faceswap_{timestamp}.png"
-                            output_path = os.path.join(self.conversation_manager.subfolder_path, output_filename)
-                            result_image.save(output_path)
-                            
+        # No checkpoint override, so any backend will do
+        async with sd_queue.slot() as backend:
+            face_model = await self._use_face_model(reactor_args, backend)
+            
+            try:
+                async with stage_session("sd_img2img") as session:
+                    if face_model:
+                        # Swap-only endpoint: no sampler pass over the image
+                        result_data = await self._reactor_swap(session, backend, image_base64, face_model)
+                        if result_data:
+                            timestamp = unique_timestamp()
+                            output_path = await self.save_image(result_data, filename=f"faceswap_{timestamp}.png")
                             logger.info(f"[FaceSwap] Success! Saved to: {output_path}")
                             return output_path
+                        logger.warning("[FaceSwap] /reactor/image failed, falling back to img2img")
+                    
+                    logger.info(f"[FaceSwap] Sending to img2img API: {backend.endpoint('img2img')}")
+                    async with session.post(backend.endpoint("img2img"), json=payload, headers={'Content-Type': 'application/json'}) as response:
+                        if response.status == 200:
+                            r = await response.json()
+                            if token:
+                                r['images'] = await asyncio.to_thread(_shared_outputs, token)
+                            if 'images' in r and len(r['images']) > 0:
+                                # Save the face-swapped image with new filename
+                                timestamp = unique_timestamp()
+                                output_path = await self.save_image(r['images'][0], filename=f"faceswap_{timestamp}.png")
+                                
+                                logger.info(f"[FaceSwap] Success! Saved to: {output_path}")
+                                return output_path
+                            else:
+                                logger.error("[FaceSwap] No images in response")
+                                return None
                         else:
-                            logger.error("[FaceSwap] No images in response")
+                            error_text = await response.text()
+                            logger.error(f"[FaceSwap] API error {response.status}: {error_text}")
                             return None
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"[FaceSwap] API error {response.status}: {error_text}")
-                        return None
-        except Exception as e:
-            logger.error(f"[FaceSwap] Exception: {e}")
-            return None
+            except asyncio.CancelledError:
+                await self.interrupt(backend)
+                raise
+            except Exception as e:
+                logger.error(f"[FaceSwap] Exception: {e}")
+                return None
 
 
     async def generate_wan_video_prompt(self, conversation):
@@ -0,0 +1,160 @@
+import asyncio
+import contextvars
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DISCONNECT_POLL_INTERVAL = 0.5  # seconds between client disconnect checks
+MAX_FINISHED_JOBS = 50  # finished jobs kept for /api/jobs
+
+# Id of the job the current task belongs to (inherited by tasks the job starts)
+_current_job_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("job_id", default=None)
+
+
+def current_job_id() -> Optional[str]:
+    return _current_job_id.get()
+
+
+class JobCancelledError(Exception):
+    """Raised when a job was cancelled (by the cancel API or a client disconnect)."""
+
+    def __init__(self, job_id: str, reason: str):
+        super().__init__(f"Job {job_id} cancelled ({reason})")
+        self.job_id = job_id
+        self.reason = reason
+
+
+class DuplicateJobError(Exception):
+    """Raised when a client-chosen job id belongs to a job that is still running."""
+
+    def __init__(self, job_id: str):
+        super().__init__(f"Job {job_id} is already running")
+        self.job_id = job_id
+
+
+class Job:
+    def __init__(self, job_id: str, kind: str):
+        self.id = job_id
+        self.kind = kind
+        self.state = "running"
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_reason = None
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "cancel_reason": self.cancel_reason,
+        }
+
+
+class JobManager:
+    """Tracks running generation jobs so they can be cancelled.
+
+    Each job runs as its own asyncio task. Cancelling the task raises CancelledError
+    inside whatever the managers are awaiting; they use that to cancel the remote
+    work (SD interrupt, Replicate / Wavespeed prediction cancel) before unwinding.
+    """
+
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+
+    @staticmethod
+    def new_job_id() -> str:
+        return uuid.uuid4().hex
+
+    def _prune(self):
+        finished = [job for job in self.jobs.values() if job.state != "running"]
+        finished.sort(key=lambda job: job.finished_at or 0)
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            del self.jobs[job.id]
+
+    def _finish(self, job: Job, state: str):
+        if job.state == "running":
+            job.state = state
+        job.finished_at = job.finished_at or time.time()
+        self._prune()
+
+    async def run(self, kind: str, coro: Awaitable, job_id: Optional[str] = None,
+                  is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+                  timeout: Optional[float] = None):
+        """Run coro as a cancellable job and return its result.
+
+        Args:
+            kind: Short label for the job (e.g. "image", "video")
+            coro: The work to run
+            job_id: Id to run under (from new_job_id() or chosen by the client, so it
+                can cancel the job later)
+            is_disconnected: Optional callable reporting whether the client has gone away
+            timeout: Optional total time budget; the job is cancelled when it runs out
+
+        Raises:
+            DuplicateJobError if a job with this id is still running (coro is closed unrun).
+            JobCancelledError if the job is cancelled before it completes.
+        """
+        job_id = job_id or self.new_job_id()
+        if job_id in self.jobs and self.jobs[job_id].state == "running":
+            coro.close()
+            raise DuplicateJobError(job_id)
+        # Listed in /api/jobs (and cancellable) before any of the work starts
+        job = Job(job_id, kind)
+        self.jobs[job_id] = job
+        token = _current_job_id.set(job_id)
+        try:
+            job.task = asyncio.create_task(coro)
+        finally:
+            _current_job_id.reset(token)
+        logger.info(f"[Jobs] Started {kind} job {job_id}")
+
+        expires_at = time.monotonic() + timeout if timeout is not None else None
+        try:
+            while not job.task.done():
+                await asyncio.wait({job.task}, timeout=DISCONNECT_POLL_INTERVAL)
+                if job.task.done():
+                    break
+                if expires_at is not None and time.monotonic() >= expires_at:
+                    self.cancel(job_id, reason="deadline exceeded")
+                elif is_disconnected and await is_disconnected():
+                    self.cancel(job_id, reason="client disconnected")
+                else:
+                    continue
+                # Let the managers finish cancelling the remote work
+                await asyncio.wait({job.task})
+        except asyncio.CancelledError:
+            # The request handler itself was cancelled (e.g. server shutdown)
+            self.cancel(job_id, reason="request cancelled")
+            raise
+
+        if job.task.cancelled():
+            self._finish(job, "cancelled")
+            raise JobCancelledError(job_id, job.cancel_reason or "cancelled")
+        if job.task.exception() is not None:
+            self._finish(job, "failed")
+        else:
+            self._finish(job, "succeeded")
+        return job.task.result()
+
+    def cancel(self, job_id: str, reason: str = "cancelled by user") -> bool:
+        """Cancel a running job. Returns False if there is no such running job."""
+        job = self.jobs.get(job_id)
+        if not job or job.state != "running":
+            return False
+
+        logger.info(f"[Jobs] Cancelling {job.kind} job {job_id}: {reason}")
+        job.cancel_reason = reason
+        # Mark it finished right away so the slot is free even while remote cleanup runs
+        self._finish(job, "cancelled")
+        job.task.cancel()
+        return True
+
+    def list_jobs(self) -> List[Dict]:
+        """Get all tracked jobs, newest first."""
+        return [job.to_dict() for job in sorted(self.jobs.values(), key=lambda job: job.created_at, reverse=True)]
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+from config import LAST_FRAME_CANDIDATES, LAST_FRAME_BUDGET
+from media_probe import MediaProber
+from media_workers import media_workers
+
+logger = logging.getLogger(__name__)
+
+MAX_CANDIDATE_BYTES = 96 * 1024 * 1024  # raw RGB frames held in memory at once
+SHARPNESS_TOLERANCE = 0.9  # a later frame within this fraction of the sharpest one wins
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def laplacian_variance(frames: np.ndarray) -> np.ndarray:
+    """Sharpness of each frame in a (K, H, W, 3) uint8 stack.
+
+    Variance of the 4-neighbour Laplacian of the luma: motion blur and soft focus
+    flatten edges and pull it down. Computed for all K frames in one pass.
+    """
+    luma = frames @ LUMA_WEIGHTS
+    laplacian = (
+        luma[:, :-2, 1:-1] + luma[:, 2:, 1:-1] + luma[:, 1:-1, :-2] + luma[:, 1:-1, 2:]
+        - 4 * luma[:, 1:-1, 1:-1]
+    )
+    return laplacian.reshape(len(frames), -1).var(axis=1)
+
+
+def pick_frame(scores: np.ndarray) -> int:
+    """Index of the frame to use: the latest one that is nearly as sharp as the sharpest.
+
+    Staying close to the end keeps the next video continuous with this one.
+    """
+    good = np.flatnonzero(scores >= scores.max() * SHARPNESS_TOLERANCE)
+    return int(good[-1])
+
+
+def _save_png(frame: np.ndarray, output_path: str, rotation: int = 0):
+    if rotation:
+        frame = np.ascontiguousarray(np.rot90(frame, -(rotation // 90)))  # np.rot90 turns counter-clockwise
+    Image.fromarray(frame).save(output_path, format="PNG", compress_level=1)
+
+
+async def _sharpest_frame(video_path: str, output_path: str, probe: Dict, candidates: int,
+                          priority: str) -> Optional[Dict]:
+    width, height, fps = probe["width"], probe["height"], probe["fps"]
+    frame_bytes = width * height * 3
+    count = max(1, min(candidates, MAX_CANDIDATE_BYTES // frame_bytes))
+    # Decode a little more than needed from the end; only the last `count` frames are scored
+    seconds = (count + 1) / fps + 0.1
+
+    returncode, raw, stderr = await media_workers.read_ffmpeg([
+        "-sseof", f"-{seconds:.3f}",
+        # Raw frames keep the stored (probed) dimensions; the rotation is applied to the picked one
+        "-noautorotate",
+        "-i", video_path,
+        "-an",
+        "-f", "rawvideo",
+        "-pix_fmt", "rgb24",
+        "pipe:1",
+    ], timeout=LAST_FRAME_BUDGET, kind="last_frame", priority=priority, label=os.path.basename(video_path))
+    if returncode != 0 or len(raw) < frame_bytes or len(raw) % frame_bytes:
+        logger.warning(f"[Last Frame] Could not decode frames of {os.path.basename(video_path)}: {stderr[:200]}")
+        return None
+
+    frames = np.frombuffer(raw, dtype=np.uint8)[-count * frame_bytes:].reshape(-1, height, width, 3)
+    scores = await asyncio.to_thread(laplacian_variance, frames)
+    best = pick_frame(scores)
+    # Written aside and moved into place here, so a save that outlives the time budget can't
+    # overwrite (or interleave with) the fallback frame
+    part_path = f"{output_path}.part"
+    await asyncio.to_thread(_save_png, frames[best], part_path, probe.get("rotation") or 0)
+    os.replace(part_path, output_path)
+    return {
+        "path": output_path,
+        "candidates": len(frames),
+        "frames_from_end": len(frames) - 1 - best,
+        "scores": [round(float(score), 1) for score in scores],
+    }
+
+
+async def extract_last_frame(video_path: str, output_path: str, prober: MediaProber,
+                             priority: str = "interactive", candidates: int = LAST_FRAME_CANDIDATES) -> Optional[Dict]:
+    """Save the sharpest of a video's last few frames as a PNG.
+
+    The last `candidates` frames are decoded in one ffmpeg pass straight into memory
+    and scored by Laplacian variance. If that can't finish within LAST_FRAME_BUDGET
+    seconds (or the video can't be probed) the plain frame at 0.1s before the end is
+    used, as before.
+
+    Returns:
+        {"path", "candidates", "frames_from_end", "scores"}, or None if no frame could
+        be extracted
+    """
+    probe = await prober.probe(video_path)
+    if candidates > 1 and probe and probe.get("width") and probe.get("height") and probe.get("fps"):
+        try:
+            result = await asyncio.wait_for(
+                _sharpest_frame(video_path, output_path, probe, candidates, priority), timeout=LAST_FRAME_BUDGET
+            )
+            if result:
+                return result
+        except asyncio.TimeoutError:
+            logger.warning(f"[Last Frame] Sharpest-frame pick over {LAST_FRAME_BUDGET}s budget, using the final frame")
+
+    root, extension = os.path.splitext(output_path)
+    part_path = f"{root}.part{extension}"
+    returncode, stderr = await media_workers.run_ffmpeg([
+        "-sseof", "-0.1",  # Seek to 0.1s before end
+        "-i", video_path,
+        "-vframes", "1",
+        "-q:v", "2",
+        part_path,
+    ], timeout=30, kind="last_frame", priority=priority, label=os.path.basename(video_path))
+    if returncode != 0 or not os.path.exists(part_path):
+        logger.error(f"[Last Frame] FFmpeg error for {os.path.basename(video_path)}: {stderr[:200]}")
+        return None
+    os.replace(part_path, output_path)
+    return {"path": output_path, "candidates": 1, "frames_from_end": 0, "scores": None}
@@ -29,6 +29,7 @@ from database_manager import DatabaseManager
 from conversation_manager import ConversationManager
 from chub_importer import ChubImporter
 from character_creator import CharacterCreator
+from thumbnails import thumbnails
 
 # Set theme to match web UI (Glassmorphism Premium)
 ctk.set_appearance_mode("Dark")
@@ -59,7 +60,8 @@ class ConversationWindow:
         self.db = db
         self.process_info = process_info
         self.output_dir = os.path.join("output", session_id)
-        self.photo_references = []
+        self.photo_references = {}  # thumbnail path -> PhotoImage shown by the current refresh
+        self.photo_cache = {}  # the same for the previous refresh, reused by the next one
         
         # Configure grid
         self.window.grid_columnconfigure(0, weight=1)
@@ -158,7 +160,8 @@ class ConversationWindow:
             
             self.text.configure(state="normal")
             self.text.delete('1.0', tk.END)
-            self.photo_references.clear()
+            # Photos still shown carry over; the rest go with the old dict, so this stays the size of the chat
+            self.photo_cache, self.photo_references = self.photo_references, {}
             
             for msg in history:
                 timestamp = msg['timestamp']
@@ -172,7 +175,7 @@ class ConversationWindow:
                     self.format_message_with_italics(message, 'user')
                 else:
                     # Check for TTS
-                    tts_pattern = r'Generated TTS file: (tts_response_\d{8}_\d{6}\.mp3|tts_v3_response_\d{8}_\d{6}\.mp3)'
+                    tts_pattern = r'Generated TTS file: ((?:tts|tts_v3)_response_\d{8}_\d{6}(?:_[0-9a-f]{6})?\.mp3)'
                     tts_matches = re.findall(tts_pattern, message)
                     if tts_matches:
                         tts_path = os.path.join(self.output_dir, tts_matches[-1])
@@ -219,16 +222,20 @@ class ConversationWindow:
 
     def load_and_resize_image(self, image_path, max_width=300):
         try:
-            image = Image.open(image_path)
-            width, height = image.size
-            if width > max_width:
-                ratio = max_width / width
-                new_width = max_width
-                new_height = int(height * ratio)
-                image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            photo = ImageTk.PhotoImage(image)
-            self.photo_references.append(photo)
+            # Shared thumbnail cache: the image is only decoded and resized once, not every refresh
+            thumbnail_path = thumbnails.ensure(image_path, "launcher") or image_path
+            photo = self.photo_references.get(thumbnail_path) or self.photo_cache.get(thumbnail_path)
+            if photo is None:
+                image = Image.open(thumbnail_path)
+                width, height = image.size
+                if width > max_width:
+                    ratio = max_width / width
+                    new_width = max_width
+                    new_height = int(height * ratio)
+                    image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+
+                photo = ImageTk.PhotoImage(image)
+            self.photo_references[thumbnail_path] = photo
             return photo
         except Exception as e:
             print(f"Error loading image: {e}")
@@ -0,0 +1,398 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+import urllib.parse
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from config import (
+    CIVITAI_API_TOKEN,
+    LORA_SYNC_CONCURRENCY,
+    LORA_SYNC_CONNECTIONS,
+    LORA_SYNC_SEGMENT_THRESHOLD_MB,
+    MAX_RETRIES,
+    RETRY_BASE_DELAY,
+)
+from download_manager import DownloadError, DownloadManager, sha256_file
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = ".lora_index.json"
+SEGMENT_CHUNK_SIZE = 1024 * 1024
+# Segment progress is saved at most this often, and after this many new bytes at the latest
+SEGMENT_STATE_INTERVAL = 2.0
+SEGMENT_STATE_BYTES = 16 * 1024 * 1024
+
+
+def lora_filename(name: str, url: str) -> str:
+    """Pick a local filename for a LoRA preset (URL basename, else preset name)."""
+    parsed_url = urllib.parse.urlparse(url)
+    filename = os.path.basename(urllib.parse.unquote(parsed_url.path))
+    if not filename or not filename.endswith('.safetensors'):
+        filename = f"{name}.safetensors"
+    return filename
+
+
+def with_civitai_token(url: str) -> str:
+    """Append the CivitAI API token to CivitAI download URLs."""
+    if "civitai.com" not in url or not CIVITAI_API_TOKEN or "token=" in url:
+        return url
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}token={CIVITAI_API_TOKEN}"
+
+
+class LoraSyncManager:
+    """Background, concurrent sync of LoRA presets into a local folder.
+
+    - up to LORA_SYNC_CONCURRENCY files download at once
+    - large files are split into ranged segments fetched over several connections
+    - partial files (.part + .part.json segment state) are resumed on the next sync
+    - downloads are verified against the SHA256 published by CivitAI / HuggingFace
+    - files with identical content are hard-linked instead of stored twice
+    """
+
+    def __init__(self, folder: str, downloader: Optional[DownloadManager] = None):
+        self.folder = folder
+        self.downloader = downloader or DownloadManager()
+        self.max_parallel = LORA_SYNC_CONCURRENCY
+        self.connections = LORA_SYNC_CONNECTIONS
+        self.segment_threshold = LORA_SYNC_SEGMENT_THRESHOLD_MB * 1024 * 1024
+        self.index_path = os.path.join(folder, INDEX_FILENAME)
+        self.index = self._load_index()
+        self.status: Dict = {"state": "idle", "items": {}}
+        self._task: Optional[asyncio.Task] = None
+
+    # --- Index (filename -> sha256/size/mtime) ---
+
+    def _load_index(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"[Sync] Failed to load LoRA index: {e}")
+            return {}
+
+    def _save_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def _index_file(self, filename: str, sha256: str):
+        path = os.path.join(self.folder, filename)
+        stat = os.stat(path)
+        self.index[filename] = {"sha256": sha256.lower(), "size": stat.st_size, "mtime": stat.st_mtime}
+        self._save_index()
+
+    async def _known_sha256(self, filename: str) -> Optional[str]:
+        """SHA256 of a local file, from the index when size/mtime are unchanged."""
+        path = os.path.join(self.folder, filename)
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        entry = self.index.get(filename)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry["sha256"]
+        digest = await asyncio.to_thread(sha256_file, path)
+        self._index_file(filename, digest)
+        return digest
+
+    def _find_by_sha256(self, sha256: str, exclude: str) -> Optional[str]:
+        for filename, entry in self.index.items():
+            if filename != exclude and entry["sha256"] == sha256.lower() \
+                    and os.path.exists(os.path.join(self.folder, filename)):
+                return filename
+        return None
+
+    def _link_duplicate(self, existing: str, filename: str):
+        """Make filename point at the same data as existing (hard link, copy-free)."""
+        src = os.path.join(self.folder, existing)
+        dest = os.path.join(self.folder, filename)
+        tmp_dest = f"{dest}.link"
+        if os.path.exists(tmp_dest):
+            os.unlink(tmp_dest)
+        os.link(src, tmp_dest)
+        os.replace(tmp_dest, dest)
+
+    # --- Remote metadata ---
+
+    async def _expected_sha256(self, session: aiohttp.ClientSession, url: str) -> Optional[str]:
+        """Look up the published SHA256 for a CivitAI or HuggingFace LoRA URL."""
+        try:
+            civitai_match = re.search(r'civitai\.com/api/download/models/(\d+)', url)
+            if civitai_match:
+                meta_url = f"https://civitai.com/api/v1/model-versions/{civitai_match.group(1)}"
+                async with session.get(meta_url, timeout=aiohttp.ClientTimeout(total=20)) as resp:
+                    if resp.status != 200:
+                        return None
+                    data = await resp.json()
+                files = data.get("files", [])
+                primary = next((f for f in files if f.get("primary")), files[0] if files else None)
+                if primary:
+                    return (primary.get("hashes", {}).get("SHA256") or "").lower() or None
+                return None
+
+            if "huggingface.co" in url and "/resolve/" in url:
+                # LFS files expose their sha256 as the linked etag on the un-redirected response
+                async with session.head(url, allow_redirects=False, timeout=aiohttp.ClientTimeout(total=20)) as resp:
+                    etag = resp.headers.get("X-Linked-Etag") or ""
+                etag = etag.strip('"').lower()
+                if re.fullmatch(r'[0-9a-f]{64}', etag):
+                    return etag
+        except Exception as e:
+            logger.warning(f"[Sync] Could not fetch checksum metadata for {url[:80]}: {e}")
+        return None
+
+    async def _probe(self, session: aiohttp.ClientSession, url: str):
+        """Resolve redirects and return (final_url, size, supports_ranges).
+
+        A failed HEAD returns (url, None, False), so the file is fetched with a plain download.
+        """
+        try:
+            async with session.head(url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=30)) as resp:
+                if resp.status != 200:
+                    return url, None, False
+                size = resp.content_length
+                supports_ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+                return str(resp.url), size, supports_ranges
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"[Sync] HEAD failed for {url[:80]} ({e}), using a plain download")
+            return url, None, False
+
+    # --- Segmented download ---
+
+    async def _fetch_segment(self, session: aiohttp.ClientSession, url: str, part_path: str,
+                             segment: Dict, state: Dict, state_path: str, item: Dict, saver: Dict):
+        for attempt in range(MAX_RETRIES):
+            start = segment["start"] + segment["done"]
+            if start > segment["end"]:
+                return
+            try:
+                headers = {"Range": f"bytes={start}-{segment['end']}"}
+                async with session.get(url, headers=headers) as resp:
+                    if resp.status != 206:
+                        raise DownloadError(f"Expected 206 for ranged request, got HTTP {resp.status}")
+                    # Unbuffered, so every byte counted in "done" is already in the file
+                    with open(part_path, 'r+b', buffering=0) as f:
+                        f.seek(start)
+                        async for chunk in resp.content.iter_chunked(SEGMENT_CHUNK_SIZE):
+                            await asyncio.to_thread(f.write, chunk)
+                            segment["done"] += len(chunk)
+                            item["downloaded"] += len(chunk)
+                            await self._checkpoint(state_path, state, saver)
+                await self._checkpoint(state_path, state, saver, force=True)
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError, DownloadError) as e:
+                await self._checkpoint(state_path, state, saver, force=True)
+                if attempt == MAX_RETRIES - 1:
+                    raise DownloadError(f"Segment {segment['start']}-{segment['end']} failed: {e}")
+                delay = RETRY_BASE_DELAY * (2 ** attempt)
+                logger.warning(f"[Sync] Segment failed ({e}), resuming in {delay}s...")
+                await asyncio.sleep(delay)
+
+    async def _checkpoint(self, state_path: str, state: Dict, saver: Dict, force: bool = False):
+        """Save segment progress, one write at a time per download and throttled unless forced.
+
+        Args:
+            saver: Per-download {"lock", "saved_at", "saved_bytes"} shared by its segments
+        """
+        done = sum(segment["done"] for segment in state["segments"])
+        if not force and time.monotonic() - saver["saved_at"] < SEGMENT_STATE_INTERVAL \
+                and done - saver["saved_bytes"] < SEGMENT_STATE_BYTES:
+            return
+        async with saver["lock"]:
+            # Snapshot taken under the lock, so a later snapshot is never overwritten by an earlier one
+            data = json.dumps(state)
+            await asyncio.to_thread(self._save_segment_state, state_path, data)
+            saver["saved_at"] = time.monotonic()
+            saver["saved_bytes"] = sum(segment["done"] for segment in state["segments"])
+
+    @staticmethod
+    def _save_segment_state(state_path: str, data: str):
+        """Write segment state JSON via a temp file, so a reader never sees a partial write."""
+        tmp_path = f"{state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, state_path)
+
+    @staticmethod
+    def _recorded_size(state_path: str) -> Optional[int]:
+        """Total size saved with an interrupted segmented download (None if unreadable)."""
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("size")
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    @staticmethod
+    def _discard_partial(dest_path: str):
+        for path in (f"{dest_path}.part", f"{dest_path}.part.json"):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    async def _segmented_download(self, session: aiohttp.ClientSession, url: str, dest_path: str,
+                                  size: int, item: Dict) -> str:
+        """Download url with several ranged connections; returns the sha256."""
+        part_path = f"{dest_path}.part"
+        state_path = f"{part_path}.json"
+
+        state = None
+        if os.path.exists(part_path) and os.path.exists(state_path):
+            try:
+                with open(state_path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                if state.get("size") != size:
+                    state = None
+            except ValueError:
+                state = None
+
+        if state is None:
+            segment_size = -(-size // self.connections)
+            state = {
+                "size": size,
+                "segments": [
+                    {"start": start, "end": min(start + segment_size, size) - 1, "done": 0}
+                    for start in range(0, size, segment_size)
+                ],
+            }
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+            self._save_segment_state(state_path, json.dumps(state))
+        else:
+            logger.info(f"[Sync] Resuming partial download of {os.path.basename(dest_path)}")
+
+        item["downloaded"] = sum(s["done"] for s in state["segments"])
+        saver = {"lock": asyncio.Lock(), "saved_at": time.monotonic(), "saved_bytes": item["downloaded"]}
+        await asyncio.gather(*[
+            self._fetch_segment(session, url, part_path, segment, state, state_path, item, saver)
+            for segment in state["segments"]
+        ])
+
+        digest = await asyncio.to_thread(sha256_file, part_path)
+        os.replace(part_path, dest_path)
+        os.unlink(state_path)
+        return digest
+
+    # --- Sync orchestration ---
+
+    async def _sync_one(self, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, lora: Dict):
+        filename = lora_filename(lora["name"], lora["url"])
+        item = self.status["items"][lora["name"]]
+        dest_path = os.path.join(self.folder, filename)
+
+        async with semaphore:
+            try:
+                url = with_civitai_token(lora["url"])
+                item["state"] = "checking"
+                expected = await self._expected_sha256(session, url)
+
+                if os.path.exists(dest_path):
+                    local = await self._known_sha256(filename)
+                    if not expected or local == expected:
+                        item["state"] = "skipped"
+                        self.status["skipped"] += 1
+                        return
+                    logger.warning(f"[Sync] {filename} does not match published checksum, re-downloading")
+
+                if expected:
+                    duplicate = self._find_by_sha256(expected, exclude=filename)
+                    if duplicate:
+                        self._link_duplicate(duplicate, filename)
+                        self._index_file(filename, expected)
+                        logger.info(f"[Sync] {filename} is identical to {duplicate}, linked instead of downloading")
+                        item["state"] = "deduplicated"
+                        self.status["deduplicated"] += 1
+                        return
+
+                item["state"] = "downloading"
+                final_url, size, supports_ranges = await self._probe(session, url)
+                state_path = f"{dest_path}.part.json"
+                if not size and os.path.exists(state_path):
+                    # Size unknown now, but a segmented download was under way: resume it at the
+                    # recorded size. A plain download must not Range-resume the preallocated .part
+                    size = self._recorded_size(state_path)
+                    if not size:
+                        self._discard_partial(dest_path)
+                item["size"] = size
+                segmented = bool(size) and (
+                    (supports_ranges and size >= self.segment_threshold and self.connections > 1)
+                    or os.path.exists(state_path)
+                )
+
+                if segmented:
+                    digest = await self._segmented_download(session, final_url, dest_path, size, item)
+                    if expected and digest != expected:
+                        os.unlink(dest_path)
+                        raise DownloadError("Checksum mismatch")
+                else:
+                    # The .part is kept on failure, so the next sync resumes it
+                    result = await self.downloader.download(url, dest_path, sha256=expected, session=session,
+                                                            keep_partial=True)
+                    digest = result["sha256"]
+                    item["downloaded"] = result["size"]
+
+                duplicate = self._find_by_sha256(digest, exclude=filename)
+                if duplicate:
+                    self._link_duplicate(duplicate, filename)
+                    item["state"] = "deduplicated"
+                    self.status["deduplicated"] += 1
+                else:
+                    item["state"] = "done"
+                    self.status["downloaded"] += 1
+                self._index_file(filename, digest)
+                logger.info(f"[Sync] Downloaded {filename} ({os.path.getsize(dest_path) / 1024 / 1024:.1f} MB)")
+            except Exception as e:
+                logger.error(f"[Sync] Error syncing {filename}: {e}")
+                item["state"] = "failed"
+                item["error"] = str(e)
+                self.status["failed"] += 1
+
+    async def _sync_all(self, loras: List[Dict]):
+        semaphore = asyncio.Semaphore(self.max_parallel)
+        try:
+            async with aiohttp.ClientSession() as session:
+                await asyncio.gather(*[self._sync_one(session, semaphore, lora) for lora in loras])
+        finally:
+            self.status["state"] = "finished"
+            self.status["finished_at"] = time.time()
+            logger.info(
+                f"[Sync] Finished: {self.status['downloaded']} downloaded, {self.status['skipped']} skipped, "
+                f"{self.status['deduplicated']} deduplicated, {self.status['failed']} failed"
+            )
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, loras: List[Dict]) -> Dict:
+        """Start syncing in the background. Returns the initial status."""
+        if self.is_running():
+            return self.get_status()
+
+        os.makedirs(self.folder, exist_ok=True)
+        # Same preset listed twice would race on one file
+        unique = {lora["name"]: lora for lora in loras}
+        self.status = {
+            "state": "running",
+            "started_at": time.time(),
+            "total": len(unique),
+            "downloaded": 0,
+            "skipped": 0,
+            "deduplicated": 0,
+            "failed": 0,
+            "folder": self.folder,
+            "items": {
+                name: {"filename": lora_filename(name, lora["url"]), "state": "queued", "downloaded": 0, "size": None}
+                for name, lora in unique.items()
+            },
+        }
+        self._task = asyncio.create_task(self._sync_all(list(unique.values())))
+        return self.get_status()
+
+    def get_status(self) -> Dict:
+        return self.status
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+from media_registry import MediaRegistry
+
+logger = logging.getLogger(__name__)
+
+PROBE_TIMEOUT = 30
+
+
+def _parse_rate(rate: Optional[str]) -> Optional[float]:
+    """Parse an ffprobe frame rate like "30000/1001"."""
+    if not rate or rate in ("0/0", "0"):
+        return None
+    try:
+        if "/" in rate:
+            num, den = rate.split("/", 1)
+            return float(num) / float(den) if float(den) else None
+        return float(rate)
+    except ValueError:
+        return None
+
+
+def _rotation(video: Optional[Dict]) -> int:
+    """Clockwise degrees a player turns the stored frames by (phone videos), from the display matrix."""
+    if not video:
+        return 0
+    for side_data in video.get("side_data_list") or []:
+        if "rotation" in side_data:
+            try:
+                return round(-float(side_data["rotation"]) / 90) * 90 % 360
+            except (TypeError, ValueError):
+                return 0
+    try:
+        return round(float((video.get("tags") or {}).get("rotate", 0)) / 90) * 90 % 360
+    except ValueError:
+        return 0
+
+
+def summarize_probe(data: Dict) -> Dict:
+    """Reduce ffprobe JSON to the fields the media pipeline cares about."""
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    fmt = data.get("format", {})
+
+    duration = fmt.get("duration") or (video or {}).get("duration")
+    fps = None
+    if video:
+        fps = _parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate"))
+    return {
+        "duration": float(duration) if duration else None,
+        "format": fmt.get("format_name"),
+        "width": video.get("width") if video else None,
+        "height": video.get("height") if video else None,
+        "rotation": _rotation(video),
+        "fps": round(fps, 3) if fps else None,
+        "video_codec": video.get("codec_name") if video else None,
+        "video_profile": video.get("profile") if video else None,
+        "video_level": video.get("level") if video else None,
+        "video_time_base": video.get("time_base") if video else None,
+        "pix_fmt": video.get("pix_fmt") if video else None,
+        "sar": video.get("sample_aspect_ratio") if video else None,
+        "has_audio": audio is not None,
+        "audio_codec": audio.get("codec_name") if audio else None,
+        "audio_sample_rate": int(audio["sample_rate"]) if audio and audio.get("sample_rate") else None,
+        "audio_channels": audio.get("channels") if audio else None,
+        "audio_channel_layout": audio.get("channel_layout") if audio else None,
+        "audio_profile": audio.get("profile") if audio else None,
+    }
+
+
+class MediaProber:
+    """ffprobe results for media files, cached in the media registry.
+
+    The summary is stored under the file's "probe" metadata together with the size
+    and mtime it was taken at, so a file is only probed again after it changes.
+    """
+
+    def __init__(self, registry: MediaRegistry):
+        self.registry = registry
+
+    async def probe(self, path: str) -> Optional[Dict]:
+        """Duration, resolution, fps and codecs of a media file (None if ffprobe fails)."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        entry = self.registry.get(path)
+        cached = entry["metadata"].get("probe") if entry else None
+        # Summaries from before "rotation" was recorded are probed again
+        if cached and cached.get("size") == stat.st_size and cached.get("mtime") == stat.st_mtime \
+                and "rotation" in cached:
+            return cached
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                "ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=PROBE_TIMEOUT)
+            except BaseException:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+            if process.returncode != 0:
+                logger.warning(f"[Probe] ffprobe failed for {path}: {stderr.decode('utf-8', errors='replace')[:200]}")
+                return None
+            summary = summarize_probe(json.loads(stdout))
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            logger.warning(f"[Probe] Could not probe {path}: {e}")
+            return None
+
+        summary.update({"size": stat.st_size, "mtime": stat.st_mtime})
+        self.registry.update_metadata(path, probe=summary)
+        return summary
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import sqlite3
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MediaRegistry:
+    """Single record of every media artifact stored in a session folder.
+
+    Each row is keyed by the absolute file path and carries where the file came from,
+    its size and content hash, plus a free-form JSON metadata blob that other
+    pipeline stages (probing, face detection, derived assets...) can extend.
+    """
+
+    def __init__(self, db_path: str = "discord_dreams.db"):
+        self.db_path = db_path
+        self._init_db()
+
+    def _get_connection(self):
+        return sqlite3.connect(self.db_path)
+
+    def _init_db(self):
+        """Initialize the media table."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS media (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        session_id TEXT,
+                        path TEXT NOT NULL UNIQUE,
+                        media_type TEXT,
+                        source_url TEXT,
+                        size INTEGER,
+                        sha256 TEXT,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        metadata TEXT
+                    )
+                """)
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_media_sha256 ON media (sha256)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_media_session ON media (session_id)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_media_source_url ON media (source_url)")
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to initialize media registry: {e}")
+
+    @staticmethod
+    def _normalize(path: str) -> str:
+        return os.path.abspath(path)
+
+    @staticmethod
+    def _row_to_dict(row) -> Dict:
+        entry = dict(row)
+        try:
+            entry["metadata"] = json.loads(entry["metadata"]) if entry.get("metadata") else {}
+        except ValueError:
+            entry["metadata"] = {}
+        return entry
+
+    def record(self, path: str, media_type: str, session_id: Optional[str] = None,
+               source_url: Optional[str] = None, size: Optional[int] = None,
+               sha256: Optional[str] = None, metadata: Optional[Dict] = None):
+        """Add or replace the registry entry for a file."""
+        if size is None and os.path.exists(path):
+            size = os.path.getsize(path)
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO media (session_id, path, media_type, source_url, size, sha256, metadata)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(path) DO UPDATE SET
+                        session_id = excluded.session_id,
+                        media_type = excluded.media_type,
+                        source_url = excluded.source_url,
+                        size = excluded.size,
+                        sha256 = excluded.sha256,
+                        metadata = excluded.metadata
+                """, (session_id, self._normalize(path), media_type, source_url, size, sha256,
+                      json.dumps(metadata or {})))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to record media {path}: {e}")
+
+    def get(self, path: str) -> Optional[Dict]:
+        """Get the registry entry for a file."""
+        try:
+            with self._get_connection() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM media WHERE path = ?", (self._normalize(path),))
+                row = cursor.fetchone()
+                return self._row_to_dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Failed to get media {path}: {e}")
+            return None
+
+    def update_file(self, path: str, size: int, sha256: Optional[str]) -> bool:
+        """Refresh the size and hash of a file that was rewritten in place."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE media SET size = ?, sha256 = ? WHERE path = ?",
+                               (size, sha256, self._normalize(path)))
+                conn.commit()
+                return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Failed to update media file info for {path}: {e}")
+            return False
+
+    def update_metadata(self, path: str, **fields) -> bool:
+        """Merge fields into a file's metadata (creating a bare entry if needed).
+
+        The read and the write share one write transaction, so concurrent updates of
+        different fields (from worker threads or another process) don't drop each other.
+        """
+        normalized = self._normalize(path)
+        conn = None
+        try:
+            conn = self._get_connection()
+            conn.isolation_level = None  # explicit transaction below
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT metadata FROM media WHERE path = ?", (normalized,))
+            row = cursor.fetchone()
+            if row is None:
+                size = os.path.getsize(path) if os.path.exists(path) else None
+                cursor.execute("INSERT INTO media (path, size, metadata) VALUES (?, ?, ?)",
+                               (normalized, size, json.dumps(fields)))
+            else:
+                try:
+                    metadata = json.loads(row[0]) if row[0] else {}
+                except ValueError:
+                    metadata = {}
+                metadata.update(fields)
+                cursor.execute("UPDATE media SET metadata = ? WHERE path = ?", (json.dumps(metadata), normalized))
+            cursor.execute("COMMIT")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to update media metadata for {path}: {e}")
+            return False
+        finally:
+            if conn is not None:
+                conn.close()  # rolls back if the commit wasn't reached
+
+    def find_by_sha256(self, sha256: str) -> List[Dict]:
+        """Get all entries with the given content hash."""
+        try:
+            with self._get_connection() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM media WHERE sha256 = ? ORDER BY id ASC", (sha256,))
+                return [self._row_to_dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to look up media by hash: {e}")
+            return []
+
+    def find_by_source_url(self, source_url: str) -> List[Dict]:
+        """Get all entries downloaded from the given URL, oldest first."""
+        try:
+            with self._get_connection() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM media WHERE source_url = ? ORDER BY id ASC", (source_url,))
+                return [self._row_to_dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to look up media by source URL: {e}")
+            return []
+
+    def get_session_media(self, session_id: str) -> List[Dict]:
+        """Get all entries for a session, oldest first."""
+        try:
+            with self._get_connection() as conn:
+                conn.row_factory = sqlite3.Row
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM media WHERE session_id = ? ORDER BY id ASC", (session_id,))
+                return [self._row_to_dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Failed to get session media: {e}")
+            return []
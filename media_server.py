@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import mimetypes
+import os
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+from download_manager import sha256_file
+from media_registry import MediaRegistry
+from media_variants import MediaVariants, VARY
+
+logger = logging.getLogger(__name__)
+
+MAX_CACHED_DIGESTS = 4096
+VERSION_LENGTH = 16  # hex characters of the content hash used in ?v= URLs
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"  # may be cached, but revalidated (cheap 304) on every use
+
+# HLS renditions (not in every platform's mimetypes table)
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/iso.segment", ".m4s")
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for GET)."""
+    if header.strip() == "*":
+        return True
+    candidates = [value.strip() for value in header.split(",")]
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+class MediaFiles:
+    """Serves session media with content-hash ETags, conditional GETs and byte ranges.
+
+    ETags are the file's SHA256 (from the media registry when it has one, otherwise
+    hashed once and remembered by size and mtime), so they only change when the
+    content does. URLs carrying ?v=<hash prefix> are content-addressed and sent as
+    immutable; plain URLs are revalidated and answered with 304 when unchanged.
+    Range requests (206) and zero-copy sends on ASGI servers that offer the pathsend
+    extension are handled by Starlette's FileResponse.
+
+    With variants, remote clients may get a smaller rendition of the file instead;
+    it has its own ETag (content hash plus profile) and the response varies on the
+    request headers that chose it.
+    """
+
+    def __init__(self, root: str, registry: MediaRegistry, variants: Optional[MediaVariants] = None):
+        self.root = os.path.realpath(root)
+        self.registry = registry
+        self.variants = variants
+        self._digests: "OrderedDict[Tuple[str, int, float], str]" = OrderedDict()
+
+    def resolve(self, relative_path: str) -> Optional[str]:
+        """Absolute path of a file under the root, or None (missing or outside the root)."""
+        path = os.path.realpath(os.path.join(self.root, relative_path))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    async def digest(self, path: str, stat: Optional[os.stat_result] = None) -> str:
+        stat = stat or os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime)
+        digest = self._digests.get(key)
+        if digest is None:
+            entry = self.registry.get(path)
+            if entry and entry.get("sha256") and entry.get("size") == stat.st_size:
+                digest = entry["sha256"]
+            else:
+                digest = await asyncio.to_thread(sha256_file, path)
+            self._digests[key] = digest
+            while len(self._digests) > MAX_CACHED_DIGESTS:
+                self._digests.popitem(last=False)
+        else:
+            self._digests.move_to_end(key)
+        return digest
+
+    async def versioned_url(self, path: Optional[str]) -> Optional[str]:
+        """Content-addressed URL of a file under the root (cached as immutable by browsers)."""
+        if not path or not os.path.isfile(path):
+            return None
+        relative_path = os.path.relpath(os.path.realpath(path), start=os.path.dirname(self.root))
+        digest = await self.digest(os.path.realpath(path))
+        return f"/{relative_path.replace(os.sep, '/')}?v={digest[:VERSION_LENGTH]}"
+
+    async def response(self, request: Request, relative_path: str) -> Response:
+        """Response for GET/HEAD of a file under the root (404 if there is no such file)."""
+        path = self.resolve(relative_path)
+        if path is None:
+            return Response(status_code=404)
+
+        stat = os.stat(path)
+        digest = await self.digest(path, stat)
+        etag = f'"{digest}"'
+        version = request.query_params.get("v")
+        immutable = bool(version and len(version) >= VERSION_LENGTH and digest.startswith(version))
+
+        profile = self.variants.profile_for(request, path) if self.variants else None
+        if profile:
+            variant_path, pending = await self.variants.get(path, digest, stat.st_size, profile)
+            if variant_path:
+                path, stat, etag = variant_path, os.stat(variant_path), f'"{digest}-{profile}"'
+            elif pending:
+                immutable = False  # the variant replaces this once it's ready
+
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+            "Cache-Control": IMMUTABLE if immutable else REVALIDATE,
+        }
+        if self.variants and self.variants.enabled:
+            headers["Vary"] = VARY
+
+        if_none_match = request.headers.get("if-none-match")
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_none_match is not None:
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers=headers)
+        elif if_modified_since:
+            try:
+                if int(stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp():
+                    return Response(status_code=304, headers=headers)
+            except (TypeError, ValueError):
+                pass
+
+        # Range / If-Range handling and the body itself (pathsend when the server supports it)
+        return FileResponse(path, headers=headers, stat_result=stat)
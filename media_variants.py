@@ -0,0 +1,281 @@
+import asyncio
+import ipaddress
+import logging
+import mimetypes
+import os
+from typing import Dict, Optional, Set, Tuple
+
+from fastapi import Request
+from PIL import Image, features
+
+from config import MEDIA_VARIANTS_ENABLED, MEDIA_VARIANT_CACHE_DIR, MEDIA_VARIANT_CACHE_MAX_MB
+from media_probe import MediaProber
+from media_workers import media_workers
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a', '.ogg')
+VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.webm')
+
+IMAGE_WIDTHS = (480, 960, 1440)  # display-size buckets, so nearby viewports share one file
+DEFAULT_IMAGE_WIDTH = 960  # when the browser sends no viewport hints
+DATA_SAVER_IMAGE_WIDTH = 480
+IMAGE_QUALITY = {"webp": 80, "avif": 60}
+AUDIO_BITRATE_KBPS = 64
+DATA_SAVER_AUDIO_BITRATE_KBPS = 32
+VIDEO_HEIGHT = 480
+DATA_SAVER_VIDEO_HEIGHT = 360
+SLOW_CONNECTIONS = ("slow-2g", "2g", "3g")  # ECT client hint values treated like Save-Data
+QUALITIES = ("auto", "data-saver", "original")
+QUALITY_COOKIE = "media_quality"
+
+# Client hints the index page asks for, and the request headers a variant choice depends on
+ACCEPT_CH = "Sec-CH-Viewport-Width, Sec-CH-DPR, ECT, Downlink"
+VARY = "Accept, Cookie, User-Agent, Save-Data, ECT, Sec-CH-Viewport-Width, Sec-CH-DPR"
+
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+mimetypes.add_type("audio/webm", ".weba")
+
+
+def _pil_supports(codec: str) -> bool:
+    try:
+        return bool(features.check_module(codec))
+    except ValueError:
+        return False  # Pillow too old to know the codec
+
+
+AVIF_SUPPORTED = _pil_supports("avif")
+
+
+def is_local(request: Request) -> bool:
+    """Whether a request comes straight from this machine (not through ngrok or a proxy)."""
+    if request.headers.get("x-forwarded-for") or request.headers.get("forwarded"):
+        return False  # the ngrok agent connects from localhost but forwards these
+    host = request.client.host if request.client else None
+    try:
+        return host == "localhost" or ipaddress.ip_address(host).is_loopback
+    except (TypeError, ValueError):
+        return False
+
+
+def _header_float(request: Request, *names: str) -> Optional[float]:
+    for name in names:
+        value = request.headers.get(name)
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    return None
+
+
+def image_width(request: Request) -> int:
+    """Smallest width bucket covering the client's viewport in device pixels."""
+    viewport = _header_float(request, "sec-ch-viewport-width", "viewport-width")
+    if not viewport:
+        return DEFAULT_IMAGE_WIDTH
+    pixels = viewport * (_header_float(request, "sec-ch-dpr", "dpr") or 1.0)
+    return next((width for width in IMAGE_WIDTHS if width >= pixels), IMAGE_WIDTHS[-1])
+
+
+def plays_opus(user_agent: str) -> bool:
+    """Safari (and every iOS browser) can't be relied on to play Opus; it gets AAC instead."""
+    if "iPhone" in user_agent or "iPad" in user_agent:
+        return False
+    return "Safari" not in user_agent or "Chrome" in user_agent or "Chromium" in user_agent
+
+
+def _encode_image(source: str, destination: str, width: int, fmt: str):
+    """Runs in a pool process: downscale (never upscale) and re-encode an image."""
+    with Image.open(source) as image:
+        image.thumbnail((width, width * 4), Image.LANCZOS)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        image.save(destination, format=fmt.upper(), quality=IMAGE_QUALITY[fmt])
+
+
+class MediaVariants:
+    """Lower-bandwidth renditions of session media for remote clients.
+
+    Each /output request is matched to a profile: images become WebP (or AVIF where
+    the browser and Pillow both support it) at a display-size width, audio becomes
+    Opus (AAC for Safari), and video becomes 480p H.264 (480 pixels on the shorter
+    side, portrait or landscape). The choice follows the user's media quality
+    setting (the "media_quality" cookie or ?quality=: "auto", "data-saver" or
+    "original") and the client hints Save-Data, ECT and viewport width. In "auto",
+    requests from this machine keep the originals.
+
+    Variants are made on first request and cached under the original's content
+    hash, so edits get new variants and identical files share them. Images and
+    audio are encoded while the request waits; video is transcoded in the
+    background and the original is served until it is ready.
+    """
+
+    def __init__(self, prober: MediaProber, cache_dir: str = MEDIA_VARIANT_CACHE_DIR,
+                 max_cache_mb: int = MEDIA_VARIANT_CACHE_MAX_MB, enabled: bool = MEDIA_VARIANTS_ENABLED):
+        self.prober = prober
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_mb * 1024 * 1024
+        self.enabled = enabled
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._unavailable: Set[str] = set()  # failed, or no smaller than the original
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def profile_for(self, request: Request, path: str) -> Optional[str]:
+        """Name of the variant to serve for this request, or None for the original."""
+        if not self.enabled:
+            return None
+        quality = request.query_params.get("quality") or request.cookies.get(QUALITY_COOKIE) or "auto"
+        if quality not in QUALITIES:
+            quality = "auto"
+        if quality == "original" or (quality == "auto" and is_local(request)):
+            return None
+        save_data = (
+            quality == "data-saver"
+            or request.headers.get("save-data", "").lower() == "on"
+            or request.headers.get("ect", "").lower() in SLOW_CONNECTIONS
+        )
+
+        extension = os.path.splitext(path)[1].lower()
+        if extension in IMAGE_EXTENSIONS:
+            accept = request.headers.get("accept", "")
+            if AVIF_SUPPORTED and "image/avif" in accept:
+                fmt = "avif"
+            elif "image/webp" in accept:
+                fmt = "webp"
+            else:
+                return None
+            return f"{fmt}{DATA_SAVER_IMAGE_WIDTH if save_data else image_width(request)}"
+        if extension in AUDIO_EXTENSIONS:
+            codec = "opus" if plays_opus(request.headers.get("user-agent", "")) else "aac"
+            return f"{codec}{DATA_SAVER_AUDIO_BITRATE_KBPS if save_data else AUDIO_BITRATE_KBPS}k"
+        if extension in VIDEO_EXTENSIONS:
+            return f"{DATA_SAVER_VIDEO_HEIGHT if save_data else VIDEO_HEIGHT}p"
+        return None
+
+    @staticmethod
+    def _extension(profile: str) -> str:
+        if profile.startswith(("webp", "avif")):
+            return profile[:4]
+        if profile.startswith("opus"):
+            return "weba"
+        if profile.startswith("aac"):
+            return "m4a"
+        return "mp4"
+
+    async def get(self, path: str, digest: str, size: int, profile: str) -> Tuple[Optional[str], bool]:
+        """The cached variant of a file, making it first if needed.
+
+        Args:
+            path: Original file
+            digest: Its SHA256 (the cache key)
+            size: Its size in bytes; a variant that isn't smaller is not used
+            profile: From profile_for()
+
+        Returns:
+            (variant path, pending): the path is None if the original should be served,
+            pending is True while a video variant is still being transcoded
+        """
+        name = f"{digest[:32]}_{profile}.{self._extension(profile)}"
+        if name in self._unavailable:
+            return None, False
+        variant_path = os.path.join(self.cache_dir, name)
+        if os.path.exists(variant_path):
+            try:
+                os.utime(variant_path)  # recently used: pruned last
+            except OSError:
+                pass
+            return variant_path, False
+
+        task = self._tasks.get(name)
+        if task is None:
+            task = asyncio.create_task(self._run(path, variant_path, profile, size, name))
+            self._tasks[name] = task
+        if profile.endswith("p"):
+            return None, True
+        # Shielded so a client going away doesn't cancel an encode other requests share
+        return await asyncio.shield(task), False
+
+    async def _run(self, path: str, variant_path: str, profile: str, size: int, name: str) -> Optional[str]:
+        part_path = f"{variant_path}.part.{self._extension(profile)}"
+        try:
+            made = await self._build(path, part_path, profile)
+            if made and os.path.getsize(part_path) < size:
+                os.replace(part_path, variant_path)
+                await asyncio.to_thread(self._prune_cache)
+                logger.info(f"[Variants] {profile} of {os.path.basename(path)}: "
+                            f"{os.path.getsize(variant_path) // 1024} KB (was {size // 1024} KB)")
+                return variant_path
+            self._unavailable.add(name)
+            return None
+        except Exception as e:
+            logger.warning(f"[Variants] {profile} of {os.path.basename(path)} failed: {e}")
+            self._unavailable.add(name)
+            return None
+        finally:
+            if os.path.exists(part_path):
+                os.unlink(part_path)
+            self._tasks.pop(name, None)
+
+    async def _build(self, path: str, output_path: str, profile: str) -> bool:
+        label = os.path.basename(path)
+        extension = self._extension(profile)
+        if extension in ("webp", "avif"):
+            await media_workers.run_cpu(_encode_image, path, output_path, int(profile[4:]), extension,
+                                        kind="variant_image", priority="interactive", label=label)
+            return True
+
+        if extension in ("weba", "m4a"):
+            codec_args = ["-c:a", "libopus", "-f", "webm"] if extension == "weba" else ["-c:a", "aac", "-f", "mp4"]
+            returncode, stderr = await media_workers.run_ffmpeg([
+                "-i", path,
+                "-vn",
+                *codec_args,
+                "-b:a", profile[4:] if extension == "weba" else profile[3:],
+                output_path,
+            ], timeout=120, kind="variant_audio", priority="interactive", label=label)
+        else:
+            height = int(profile[:-1])
+            probe = await self.prober.probe(path)
+            # The profile height is the shorter side, so portrait videos get the same resolution
+            if not probe or not probe.get("width") or not probe.get("height") or \
+                    min(probe["width"], probe["height"]) <= height:
+                return False  # already small enough
+            duration = probe.get("duration")
+            returncode, stderr = await media_workers.run_ffmpeg([
+                "-i", path,
+                "-vf", f"scale='if(gt(iw,ih),-2,{height})':'if(gt(iw,ih),{height},-2)'",
+                "-c:v", "libx264",
+                "-preset", "veryfast",
+                "-crf", "28",
+                "-pix_fmt", "yuv420p",
+                "-c:a", "aac",
+                "-b:a", "96k",
+                "-movflags", "+faststart",
+                output_path,
+            ], timeout=max(120, (duration or 0) * 4), kind="variant_video", priority="normal",
+                duration=duration, label=label)
+        if returncode != 0:
+            logger.warning(f"[Variants] ffmpeg failed for {label}: {stderr[:200]}")
+            return False
+        return True
+
+    def _prune_cache(self):
+        """Delete least recently used variants once the cache is over its size limit."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if ".part." not in name:
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_cache_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
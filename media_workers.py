@@ -0,0 +1,302 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import psutil
+
+from config import MEDIA_WORKERS, MEDIA_BATCH_WORKERS
+from job_manager import current_job_id
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first: the user is waiting on interactive work, batch work can wait
+PRIORITIES = {"interactive": 0, "normal": 1, "batch": 2}
+MAX_FINISHED_JOBS = 50  # finished media jobs kept for /api/media/jobs
+
+
+class MediaJob:
+    def __init__(self, job_id: int, kind: str, priority: str, label: Optional[str] = None,
+                 duration: Optional[float] = None):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown media job priority: {priority}")
+        self.id = job_id
+        self.kind = kind
+        self.priority = priority
+        self.label = label
+        self.duration = duration  # seconds of output, for ffmpeg progress
+        self.parent_job_id = current_job_id()
+        self.state = "queued"
+        self.progress: Optional[float] = None
+        self.cpu_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "priority": self.priority,
+            "label": self.label,
+            "job_id": self.parent_job_id,
+            "state": self.state,
+            "progress": round(self.progress, 1) if self.progress is not None else None,
+            "cpu_seconds": round(self.cpu_seconds, 3) if self.cpu_seconds is not None else None,
+            "wall_seconds": round((self.finished_at or time.time()) - self.started_at, 3) if self.started_at else None,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def _timed_call(func: Callable, args: tuple):
+    """Runs in a pool process: call func and report the CPU time it used."""
+    started = time.process_time()
+    result = func(*args)
+    return result, time.process_time() - started
+
+
+def _process_cpu_seconds(process: psutil.Process) -> Optional[float]:
+    try:
+        times = process.cpu_times()
+        return times.user + times.system + times.children_user + times.children_system
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return None
+
+
+class MediaWorkerPool:
+    """One concurrency limit for all FFmpeg and CPU-heavy media work.
+
+    Every job waits for one of MEDIA_WORKERS slots (one per core by default), and
+    free slots go to the most urgent waiting job first (interactive > normal > batch,
+    then oldest). Batch jobs never hold more than MEDIA_BATCH_WORKERS slots, so a big
+    story compile can't starve frame extraction or face detection.
+
+    FFmpeg runs as an async subprocess reporting -progress, so jobs show a live
+    percentage; Python functions (OpenCV, image decoding) run in a process pool.
+    Each job records the CPU time it used.
+    """
+
+    def __init__(self, workers: int = MEDIA_WORKERS, batch_workers: int = MEDIA_BATCH_WORKERS):
+        self.workers = workers
+        self.batch_workers = min(batch_workers, workers)
+        self.pending: List[MediaJob] = []
+        self.running: Dict[int, MediaJob] = {}
+        self.finished: Deque[MediaJob] = deque(maxlen=MAX_FINISHED_JOBS)
+        self.cpu_seconds: Dict[str, float] = {}  # total per job kind
+        self._ids = itertools.count(1)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _dispatch(self):
+        # Drop jobs whose waiter was cancelled but hasn't cleaned up yet
+        self.pending = [job for job in self.pending if not job.future.done()]
+        self.pending.sort(key=lambda job: (PRIORITIES[job.priority], job.id))
+        while self.pending and len(self.running) < self.workers:
+            batch_running = sum(1 for job in self.running.values() if job.priority == "batch")
+            job = next((job for job in self.pending
+                        if job.priority != "batch" or batch_running < self.batch_workers), None)
+            if job is None:
+                return
+            self.pending.remove(job)
+            self.running[job.id] = job
+            job.state = "running"
+            job.started_at = time.time()
+            job.future.set_result(True)
+
+    def _finish(self, job: MediaJob, state: str, error: Optional[str] = None):
+        if self.running.pop(job.id, None) is not None:
+            job.finished_at = time.time()
+        job.state = state
+        job.error = error
+        if job.cpu_seconds is not None:
+            self.cpu_seconds[job.kind] = self.cpu_seconds.get(job.kind, 0.0) + job.cpu_seconds
+        self.finished.append(job)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def _slot(self, job: MediaJob):
+        """Wait for a worker slot and hold it while the job runs."""
+        self.pending.append(job)
+        self._dispatch()
+        if not job.future.done():
+            logger.info(f"[Media Workers] {job.kind} job {job.id} ({job.priority}) queued behind {len(self.running)} running")
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if job in self.pending:
+                self.pending.remove(job)
+                job.state = "cancelled"
+                self.finished.append(job)
+            elif job.future.done() and not job.future.cancelled():
+                # Got a slot just as we were cancelled - hand it back
+                self._finish(job, "cancelled")
+            raise
+
+        try:
+            yield job
+        except asyncio.CancelledError:
+            self._finish(job, "cancelled")
+            raise
+        except Exception as e:
+            self._finish(job, "failed", str(e))
+            raise
+        else:
+            if job.state == "running":
+                self._finish(job, "succeeded")
+
+    async def run_ffmpeg(self, args: List[str], timeout: float, kind: str = "ffmpeg", priority: str = "normal",
+                         duration: Optional[float] = None, label: Optional[str] = None) -> Tuple[int, str]:
+        """Run ffmpeg in a worker slot without blocking the event loop.
+
+        Args:
+            args: ffmpeg arguments (after the global -y/-loglevel flags)
+            timeout: Seconds the process may run once started
+            kind: Job kind for status and CPU accounting (e.g. "story_clip", "extract_frame")
+            priority: "interactive", "normal" or "batch"
+            duration: Expected output length in seconds, for the progress percentage
+            label: Optional description shown in the job list
+
+        Returns:
+            (return code, stderr)
+
+        Raises:
+            asyncio.TimeoutError if the process runs past timeout; the process is also
+            killed if the calling task is cancelled
+        """
+        job = MediaJob(next(self._ids), kind, priority, label, duration)
+        async with self._slot(job):
+            process = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-nostats", "-progress", "pipe:1", *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                stats = psutil.Process(process.pid)
+            except psutil.Error:
+                stats = None
+
+            async def read_progress():
+                async for raw in process.stdout:
+                    key, _, value = raw.decode('utf-8', errors='replace').strip().partition("=")
+                    if key in ("out_time_us", "out_time_ms") and duration and value.isdigit():
+                        # out_time_ms is also in microseconds
+                        job.progress = min(100.0, int(value) / 1_000_000 / duration * 100)
+                    elif key == "progress":
+                        # Sampled at every progress block; the last one comes right before exit
+                        cpu = _process_cpu_seconds(stats) if stats else None
+                        job.cpu_seconds = cpu if cpu is not None else job.cpu_seconds
+                        if value == "end":
+                            job.progress = 100.0
+
+            try:
+                _, stderr, _ = await asyncio.wait_for(
+                    asyncio.gather(read_progress(), process.stderr.read(), process.wait()), timeout=timeout
+                )
+            except BaseException:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+            if process.returncode != 0:
+                self._finish(job, "failed", f"ffmpeg exited with {process.returncode}")
+            return process.returncode, stderr.decode('utf-8', errors='replace')
+
+    async def read_ffmpeg(self, args: List[str], timeout: float, kind: str = "ffmpeg", priority: str = "normal",
+                          label: Optional[str] = None) -> Tuple[int, bytes, str]:
+        """Run ffmpeg in a worker slot and collect what it writes to stdout.
+
+        For small outputs read straight into memory (e.g. a few raw frames with
+        "-f rawvideo pipe:1"). No progress is reported since stdout carries the data.
+
+        Returns:
+            (return code, stdout bytes, stderr)
+
+        Raises:
+            asyncio.TimeoutError if the process runs past timeout
+        """
+        job = MediaJob(next(self._ids), kind, priority, label)
+        async with self._slot(job):
+            process = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-nostats", *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                stats = psutil.Process(process.pid)
+            except psutil.Error:
+                stats = None
+
+            async def read_output() -> bytes:
+                chunks = []
+                while True:
+                    chunk = await process.stdout.read(1 << 20)
+                    if not chunk:
+                        return b"".join(chunks)
+                    chunks.append(chunk)
+                    # Sampled per chunk; the process may exit before a final sample
+                    cpu = _process_cpu_seconds(stats) if stats else None
+                    job.cpu_seconds = cpu if cpu is not None else job.cpu_seconds
+
+            try:
+                stdout, stderr, _ = await asyncio.wait_for(
+                    asyncio.gather(read_output(), process.stderr.read(), process.wait()), timeout=timeout
+                )
+            except BaseException:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+            if process.returncode != 0:
+                self._finish(job, "failed", f"ffmpeg exited with {process.returncode}")
+            else:
+                job.progress = 100.0
+            return process.returncode, stdout, stderr.decode('utf-8', errors='replace')
+
+    async def run_cpu(self, func: Callable, *args, kind: str = "cpu", priority: str = "normal",
+                      label: Optional[str] = None):
+        """Run a CPU-bound function in the process pool and return its result.
+
+        func and its arguments must be picklable (a module-level function).
+        """
+        job = MediaJob(next(self._ids), kind, priority, label)
+        async with self._slot(job):
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            result, job.cpu_seconds = await asyncio.get_running_loop().run_in_executor(
+                self._executor, _timed_call, func, args
+            )
+            job.progress = 100.0
+            return result
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        for job in [*self.running.values(), *self.pending, *self.finished]:
+            if job.id == job_id:
+                return job.to_dict()
+        return None
+
+    def status(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "batch_workers": self.batch_workers,
+            "running": [job.to_dict() for job in self.running.values()],
+            "pending": [job.to_dict() for job in self.pending],
+            "finished": [job.to_dict() for job in reversed(self.finished)],
+            "cpu_seconds": {kind: round(seconds, 3) for kind, seconds in self.cpu_seconds.items()},
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Shared pool so all media work in the server counts against one limit
+media_workers = MediaWorkerPool()
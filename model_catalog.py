@@ -0,0 +1,336 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from config import SD_CHECKPOINTS_FOLDER, MODEL_CATALOG_FILE, MODEL_CATALOG_REFRESH_INTERVAL
+from sd_pool import sd_pool
+
+logger = logging.getLogger(__name__)
+
+MODEL_EXTENSIONS = ('.safetensors', '.gguf')
+MAX_HEADER_BYTES = 64 * 1024 * 1024  # sanity limit for a safetensors JSON header
+
+# GGUF metadata value types -> struct format (strings and arrays are handled separately)
+GGUF_SCALARS = {0: '<B', 1: '<b', 2: '<H', 3: '<h', 4: '<I', 5: '<i', 6: '<f', 7: '<?', 10: '<Q', 11: '<q', 12: '<d'}
+GGUF_STRING = 8
+GGUF_ARRAY = 9
+
+# Tensor name fragments that identify an architecture, checked in order
+ARCHITECTURE_MARKERS = [
+    ("lumina", ("cap_embedder", "noise_refiner", "context_refiner")),
+    ("flux", ("double_blocks.", "single_blocks.")),
+    ("sdxl", ("conditioner.embedders.1", "label_emb.")),
+    ("sd15", ("cond_stage_model.transformer",)),
+]
+# modelspec.architecture values of Stable Diffusion checkpoints (SD 1.x / 2.x; XL ones become "sdxl")
+SD_ARCHITECTURE_PREFIXES = ("stable-diffusion", "sd-", "sd1", "sd2")
+
+
+def guess_mode_from_name(name: str) -> str:
+    """Old filename-prefix rule: z-image checkpoints run in Lumina mode, all else in XL mode."""
+    name_lower = os.path.basename(name or "").lower()
+    if name_lower.startswith("zimage") or name_lower.startswith("z_image") or name_lower.startswith("z-image"):
+        return "lumina"
+    return "xl"
+
+
+def architecture_mode(architecture: Optional[str]) -> Optional[str]:
+    """Generation mode for an architecture (None if unknown, so the filename rule decides)."""
+    if not architecture:
+        return None
+    if "lumina" in architecture:
+        return "lumina"
+    if architecture in ("sdxl", "sd15") or architecture.startswith(SD_ARCHITECTURE_PREFIXES):
+        return "xl"
+    return None
+
+
+def _classify_tensor_names(names) -> Optional[str]:
+    for architecture, markers in ARCHITECTURE_MARKERS:
+        if any(marker in name for name in names for marker in markers):
+            return architecture
+    return None
+
+
+def read_safetensors_header(path: str) -> Dict:
+    """Architecture and metadata from a .safetensors header (reads only the header)."""
+    with open(path, 'rb') as f:
+        (header_size,) = struct.unpack('<Q', f.read(8))
+        if header_size > MAX_HEADER_BYTES:
+            raise ValueError(f"implausible header size {header_size}")
+        header = json.loads(f.read(header_size))
+
+    metadata = header.pop('__metadata__', None) or {}
+    architecture = metadata.get('modelspec.architecture')
+    if architecture:
+        architecture = architecture.lower()
+        if 'xl' in architecture:
+            architecture = 'sdxl'
+    return {
+        "format": "safetensors",
+        "architecture": architecture or _classify_tensor_names(header.keys()),
+        "tensors": len(header),
+        "title": metadata.get('modelspec.title'),
+    }
+
+
+def _read_gguf_string(f) -> str:
+    (length,) = struct.unpack('<Q', f.read(8))
+    return f.read(length).decode('utf-8', errors='replace')
+
+
+def _read_gguf_value(f, value_type: int):
+    if value_type == GGUF_STRING:
+        return _read_gguf_string(f)
+    if value_type == GGUF_ARRAY:
+        item_type, count = struct.unpack('<IQ', f.read(12))
+        return [_read_gguf_value(f, item_type) for _ in range(count)]
+    fmt = GGUF_SCALARS[value_type]
+    return struct.unpack(fmt, f.read(struct.calcsize(fmt)))[0]
+
+
+def read_gguf_header(path: str) -> Dict:
+    """Architecture from a .gguf file's metadata and tensor table (reads only the header)."""
+    with open(path, 'rb') as f:
+        if f.read(4) != b'GGUF':
+            raise ValueError("not a GGUF file")
+        version, tensor_count, kv_count = struct.unpack('<IQQ', f.read(20))
+        metadata = {}
+        for _ in range(kv_count):
+            key = _read_gguf_string(f)
+            (value_type,) = struct.unpack('<I', f.read(4))
+            value = _read_gguf_value(f, value_type)
+            if not isinstance(value, list):
+                metadata[key] = value
+        names = []
+        for _ in range(tensor_count):
+            names.append(_read_gguf_string(f))
+            (n_dims,) = struct.unpack('<I', f.read(4))
+            f.seek(8 * n_dims + 4 + 8, os.SEEK_CUR)  # dims, type, offset
+
+    architecture = metadata.get('general.architecture')
+    architecture = architecture.lower() if architecture else _classify_tensor_names(names)
+    if architecture == 'lumina2':
+        architecture = 'lumina'
+    return {
+        "format": "gguf",
+        "architecture": architecture,
+        "tensors": tensor_count,
+        "title": metadata.get('general.name'),
+        "gguf_version": version,
+    }
+
+
+def legacy_model_hash(path: str) -> str:
+    """A1111's short model hash (sha256 of 64 KB at offset 1 MB), cheap even for huge files."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        f.seek(0x100000)
+        sha.update(f.read(0x10000))
+    return sha.hexdigest()[0:8]
+
+
+def inspect_model_file(path: str) -> Dict:
+    """Read a checkpoint's header for architecture, size and hash."""
+    info = {"size": os.path.getsize(path), "hash": None, "architecture": None}
+    try:
+        if path.lower().endswith('.gguf'):
+            info.update(read_gguf_header(path))
+        else:
+            info.update(read_safetensors_header(path))
+        info["hash"] = legacy_model_hash(path)
+    except Exception as e:
+        logger.warning(f"[Model Catalog] Could not read header of {path}: {e}")
+        info["error"] = str(e)
+    return info
+
+
+class ModelCatalog:
+    """Image model list served from memory and refreshed in the background.
+
+    Combines the checkpoints the SD API reports with header metadata read from
+    SD_CHECKPOINTS_FOLDER. Header scans are cached on disk by (size, mtime), so a
+    rescan of a large models folder only opens new or changed files. Each refresh
+    recomputes an ETag so clients can revalidate cheaply.
+    """
+
+    def __init__(self, folder: str = SD_CHECKPOINTS_FOLDER, cache_path: str = MODEL_CATALOG_FILE,
+                 refresh_interval: int = MODEL_CATALOG_REFRESH_INTERVAL):
+        self.folder = folder
+        self.cache_path = cache_path
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        cached = self._load()
+        self.files: Dict[str, Dict] = cached.get("files", {})  # path -> header info
+        self.models: List[Dict] = cached.get("models", [])
+        self.etag = self._etag(self.models)
+        self.source = cached.get("source")
+        self.refreshed_at: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def _load(self) -> Dict:
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load model catalog cache {self.cache_path}: {e}")
+            return {}
+
+    def _save(self):
+        with self._lock:
+            data = {"files": dict(self.files), "models": list(self.models), "source": self.source}
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.cache_path)
+        except Exception as e:
+            logger.warning(f"Failed to save model catalog cache {self.cache_path}: {e}")
+
+    @staticmethod
+    def _etag(models: List[Dict]) -> str:
+        return '"' + hashlib.sha256(json.dumps(models, sort_keys=True).encode('utf-8')).hexdigest()[:16] + '"'
+
+    def _scan_folder(self) -> Dict[str, Dict]:
+        """Header info for every model file in the folder, reusing cached entries."""
+        files = {}
+        if not self.folder or not os.path.isdir(self.folder):
+            return files
+        with self._lock:
+            previous = dict(self.files)
+        scanned = 0
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                if not name.lower().endswith(MODEL_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                cached = previous.get(path)
+                if cached and cached.get("size") == stat.st_size and cached.get("mtime") == stat.st_mtime:
+                    files[path] = cached
+                    continue
+                info = inspect_model_file(path)
+                info["mtime"] = stat.st_mtime
+                files[path] = info
+                scanned += 1
+        if scanned:
+            logger.info(f"[Model Catalog] Read headers of {scanned} new or changed model file(s)")
+        return files
+
+    async def _fetch_api_models(self) -> Optional[List[Dict]]:
+        url = sd_pool.select().endpoint("sd-models")
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+                    if resp.status == 200:
+                        return await resp.json()
+                    logger.warning(f"SD API returned status {resp.status} when fetching models")
+        except Exception as e:
+            logger.warning(f"Could not fetch models from SD API at {url}: {e}")
+        return None
+
+    def _entry(self, value: str, filename: str, info: Optional[Dict], sha256: Optional[str] = None) -> Dict:
+        info = info or {}
+        architecture = info.get("architecture")
+        return {
+            "value": value,
+            "label": value.rsplit('.', 1)[0] if '.' in value else value,
+            "mode": architecture_mode(architecture) or guess_mode_from_name(value),
+            "filename": filename,
+            "architecture": architecture,
+            "size": info.get("size"),
+            "hash": info.get("hash"),
+            "sha256": sha256,
+        }
+
+    async def refresh(self):
+        """Rescan the folder and SD API and rebuild the model list."""
+        files = await asyncio.to_thread(self._scan_folder)
+        by_name = {os.path.basename(path).lower(): info for path, info in files.items()}
+
+        api_models = await self._fetch_api_models()
+        models = []
+        if api_models:
+            source = "api"
+            for model in api_models:
+                value = model.get("model_name", model.get("title", ""))
+                host_path = model.get("filename") or ""
+                info = files.get(host_path) or by_name.get(os.path.basename(host_path.replace("\\", "/")).lower())
+                models.append(self._entry(value, value, info, model.get("sha256")))
+        else:
+            source = "folder"
+            for path, info in files.items():
+                filename = os.path.basename(path)
+                models.append(self._entry(filename, filename, info))
+
+        if not models and self.models:
+            # Keep serving the last good list rather than an empty one
+            logger.warning("[Model Catalog] No models found, keeping the previous list")
+            return
+        models.sort(key=lambda x: (0 if x['mode'] == 'lumina' else 1, x['label'].lower()))
+
+        with self._lock:
+            self.files = files
+            self.models = models
+            self.source = source
+            self.etag = self._etag(models)
+            self.refreshed_at = time.time()
+        await asyncio.to_thread(self._save)
+        logger.info(f"[Model Catalog] {len(models)} model(s) from {source}")
+
+    def refresh_in_background(self) -> asyncio.Task:
+        """Start a refresh unless one is already running."""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+        return self._refresh_task
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh_in_background()
+            except Exception as e:
+                logger.error(f"[Model Catalog] Refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        """Start periodic background refreshes."""
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.create_task(self._refresh_loop())
+
+    async def get_models(self) -> Tuple[List[Dict], str]:
+        """Current model list and its ETag (waits for the first refresh only if nothing is cached)."""
+        if not self.models:
+            try:
+                # Shielded so a client going away doesn't cancel the shared refresh
+                await asyncio.shield(self.refresh_in_background())
+            except Exception as e:
+                logger.error(f"[Model Catalog] Refresh failed: {e}")
+        with self._lock:
+            return list(self.models), self.etag
+
+    def mode_for(self, model: str) -> str:
+        """Generation mode ("lumina" or "xl") for a checkpoint, from its header when known."""
+        key = os.path.basename((model or "").replace("\\", "/")).lower()
+        with self._lock:
+            for entry in self.models:
+                if entry["value"].lower() == (model or "").lower() or os.path.basename(entry["value"].replace("\\", "/")).lower() == key:
+                    return entry["mode"]
+        return guess_mode_from_name(model)
+
+
+# Shared catalog so every request serves the same in-memory list
+model_catalog = ModelCatalog()
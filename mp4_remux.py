@@ -0,0 +1,132 @@
+import logging
+import os
+import shutil
+import struct
+from typing import List, Optional
+
+from config import MP4_STREAMING_MODE, STORY_HLS_MIN_SECONDS
+from media_workers import media_workers
+
+logger = logging.getLogger(__name__)
+
+HLS_SEGMENT_SECONDS = 6
+HLS_FOLDER_SUFFIX = "_hls"
+MOVFLAGS = {
+    "faststart": "+faststart",
+    # Self-contained fragments with an empty moov up front: playable while still downloading
+    "fragmented": "+frag_keyframe+empty_moov+default_base_moof",
+}
+
+
+def movflags(mode: str = MP4_STREAMING_MODE) -> List[str]:
+    """ffmpeg output options that write an MP4 the browser can start playing right away."""
+    return ["-movflags", MOVFLAGS[mode]] if mode in MOVFLAGS else []
+
+
+def top_level_boxes(path: str) -> List[str]:
+    """Types of an MP4 file's top-level boxes in file order (reads only box headers)."""
+    boxes = []
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            size, box_type = struct.unpack('>I4s', f.read(8))
+            if size == 1:
+                (size,) = struct.unpack('>Q', f.read(8))
+            elif size == 0:
+                size = file_size - offset  # box runs to the end of the file
+            if size < 8:
+                break  # corrupt header
+            boxes.append(box_type.decode('latin-1'))
+            offset += size
+    return boxes
+
+
+def is_streamable(path: str, mode: str = MP4_STREAMING_MODE) -> Optional[bool]:
+    """Whether an MP4 already plays before it is fully downloaded (None if it isn't an MP4)."""
+    try:
+        boxes = top_level_boxes(path)
+    except (OSError, struct.error):
+        return None
+    if "moov" not in boxes:
+        return None
+    if "moof" in boxes:
+        return True  # fragmented files stream either way
+    if mode == "fragmented":
+        return False
+    return "mdat" not in boxes or boxes.index("moov") < boxes.index("mdat")
+
+
+async def remux_for_streaming(path: str, mode: str = MP4_STREAMING_MODE, priority: str = "interactive") -> bool:
+    """Rewrite an MP4 in place with the moov atom first (or fragmented), without re-encoding.
+
+    Returns:
+        True if the file was rewritten, False if it was already streamable, remuxing is
+        off, or the remux failed (the original is kept)
+    """
+    if mode not in MOVFLAGS or not path.lower().endswith(('.mp4', '.m4v', '.mov')):
+        return False
+    streamable = is_streamable(path, mode)
+    if streamable is not False:
+        return False
+
+    part_path = f"{path}.remux.mp4"
+    returncode, stderr = await media_workers.run_ffmpeg([
+        "-i", path,
+        "-map", "0",
+        "-c", "copy",
+        *movflags(mode),
+        part_path,
+    ], timeout=120, kind="remux", priority=priority, label=os.path.basename(path))
+    if returncode != 0 or not os.path.exists(part_path):
+        logger.warning(f"[Remux] Failed for {os.path.basename(path)}, keeping original: {stderr[:200]}")
+        if os.path.exists(part_path):
+            os.unlink(part_path)
+        return False
+
+    os.replace(part_path, path)
+    logger.info(f"[Remux] {os.path.basename(path)} rewritten for streaming ({mode})")
+    return True
+
+
+def hls_folder(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}{HLS_FOLDER_SUFFIX}"
+
+
+async def build_hls(path: str, duration: Optional[float], min_seconds: float = STORY_HLS_MIN_SECONDS) -> Optional[str]:
+    """Segment a long video into a stream-copied HLS rendition (fMP4 segments).
+
+    Args:
+        path: H.264/AAC MP4 to segment
+        duration: Its length in seconds; shorter than min_seconds is skipped
+        min_seconds: 0 disables HLS
+
+    Returns:
+        Path of the .m3u8 playlist, or None if skipped or failed
+    """
+    if not min_seconds or not duration or duration < min_seconds:
+        return None
+    folder = hls_folder(path)
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    os.makedirs(folder)
+    playlist = os.path.join(folder, "index.m3u8")
+
+    returncode, stderr = await media_workers.run_ffmpeg([
+        "-i", path,
+        "-map", "0",
+        "-c", "copy",
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_type", "fmp4",
+        "-hls_segment_filename", os.path.join(folder, "segment_%04d.m4s"),
+        playlist,
+    ], timeout=max(120, duration), kind="hls", priority="batch", duration=duration, label=os.path.basename(path))
+    if returncode != 0 or not os.path.exists(playlist):
+        logger.warning(f"[HLS] Failed for {os.path.basename(path)}: {stderr[:200]}")
+        shutil.rmtree(folder, ignore_errors=True)
+        return None
+    logger.info(f"[HLS] Rendition ready for {os.path.basename(path)}")
+    return playlist
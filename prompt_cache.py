@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import (
+    PROMPT_CACHE_ENABLED,
+    PROMPT_CACHE_FILE,
+    PROMPT_CACHE_THRESHOLD,
+    PROMPT_CACHE_WINDOW,
+    PROMPT_CACHE_MAX_ENTRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 512
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+def _bucket(feature: str):
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    return value % EMBEDDING_DIM, 1.0 if (value >> 63) & 1 else -1.0
+
+
+def embed_prompt(prompt: str) -> np.ndarray:
+    """Hashed bag-of-features embedding of a prompt (unit length).
+
+    Uses word unigrams and bigrams plus character trigrams, so reordered or slightly
+    reworded prompts land close together. Runs on CPU with no model to load.
+    """
+    words = _WORD_RE.findall(prompt.lower())
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"#{word}#"
+        features.extend(f"~{padded[i:i + 3]}" for i in range(len(padded) - 2))
+
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for feature in features:
+        index, sign = _bucket(feature)
+        vector[index] += sign
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class PromptCache:
+    """Finds images rendered from a near-identical prompt earlier in the same session.
+
+    Prompt embeddings are kept as one matrix (persisted to an .npz file) so a lookup is a
+    single matrix-vector product. Only the most recent PROMPT_CACHE_WINDOW images of the
+    same session and model are candidates.
+    """
+
+    def __init__(self, path: str = PROMPT_CACHE_FILE, threshold: float = PROMPT_CACHE_THRESHOLD,
+                 window: int = PROMPT_CACHE_WINDOW, max_entries: int = PROMPT_CACHE_MAX_ENTRIES,
+                 enabled: bool = PROMPT_CACHE_ENABLED):
+        self.path = path
+        self.threshold = threshold
+        self.window = window
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.vectors = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.entries: List[Dict] = []
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "forced": 0}
+        self._similarities: List[float] = []  # best similarity of recent lookups
+        if enabled:
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                vectors = data["vectors"].astype(np.float32)
+                entries = json.loads(str(data["entries"]))
+            if vectors.shape == (len(entries), EMBEDDING_DIM):
+                self.vectors, self.entries = vectors, entries
+        except Exception as e:
+            logger.warning(f"Failed to load prompt cache {self.path}: {e}")
+
+    def _save(self):
+        with self._lock:
+            vectors, entries = self.vectors, list(self.entries)
+        tmp_path = f"{self.path}.tmp.npz"
+        try:
+            np.savez(tmp_path, vectors=vectors, entries=np.array(json.dumps(entries)))
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Failed to save prompt cache {self.path}: {e}")
+
+    def lookup(self, session_id: str, model: str, prompt: str) -> Optional[Dict]:
+        """Most similar recent image for a prompt, if it is above the threshold.
+
+        Returns:
+            {"image_path", "prompt", "similarity"} on a hit, otherwise None
+        """
+        if not self.enabled:
+            return None
+        query = embed_prompt(prompt)
+        with self._lock:
+            rows = [i for i, entry in enumerate(self.entries)
+                    if entry["session_id"] == session_id and entry["model"] == model][-self.window:]
+            candidates = self.vectors[rows] if rows else None
+            recent = [self.entries[i] for i in rows]
+
+        self.stats["lookups"] += 1
+        best = None
+        if candidates is not None:
+            similarities = candidates @ query
+            # Most similar first (newest first among equals), skipping images that were deleted
+            for position in np.lexsort((-np.arange(len(rows)), -similarities)):
+                entry = recent[position]
+                if os.path.exists(entry["image_path"]):
+                    best = (float(similarities[position]), entry)
+                    break
+
+        self._similarities = (self._similarities + [best[0] if best else 0.0])[-100:]
+        if best and best[0] >= self.threshold:
+            self.stats["hits"] += 1
+            return {"image_path": best[1]["image_path"], "prompt": best[1]["prompt"], "similarity": round(best[0], 4)}
+        self.stats["misses"] += 1
+        return None
+
+    async def add(self, session_id: str, model: str, prompt: str, image_path: str):
+        """Remember the image rendered for a prompt."""
+        if not self.enabled:
+            return
+        vector = embed_prompt(prompt)
+        with self._lock:
+            self.vectors = np.vstack([self.vectors, vector[None, :]])[-self.max_entries:]
+            self.entries = (self.entries + [{
+                "session_id": session_id,
+                "model": model,
+                "prompt": prompt,
+                "image_path": os.path.abspath(image_path),
+                "created_at": time.time(),
+            }])[-self.max_entries:]
+        await asyncio.to_thread(self._save)
+
+    def record_forced(self):
+        """Count a generation the user asked for despite a cache hit."""
+        if self.enabled:
+            self.stats["forced"] += 1
+
+    def metrics(self) -> Dict:
+        lookups = self.stats["lookups"]
+        recent = self._similarities
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "window": self.window,
+            "entries": len(self.entries),
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "recent_mean_similarity": round(float(np.mean(recent)), 4) if recent else None,
+        }
+
+
+# Shared instance so every session's lookups go through one matrix
+prompt_cache = PromptCache()
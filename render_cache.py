@@ -0,0 +1,81 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def render_key(params: Dict) -> str:
+    """Stable hash of everything that determines a rendered image."""
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """Maps txt2img parameters (including the seed) to an image already rendered with them.
+
+    Asking for the same prompt, checkpoint, sampler settings, size, seed and ReActor
+    source again returns the stored file instead of running Stable Diffusion.
+    """
+
+    def __init__(self, db_path: str = "discord_dreams.db"):
+        self.db_path = db_path
+        self._init_db()
+
+    def _get_connection(self):
+        return sqlite3.connect(self.db_path)
+
+    def _init_db(self):
+        """Initialize the render cache table."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS render_cache (
+                        key TEXT PRIMARY KEY,
+                        path TEXT NOT NULL,
+                        seed INTEGER,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to initialize render cache: {e}")
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Get the cached render for a key, or None (entries whose file is gone are dropped)."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT path, seed FROM render_cache WHERE key = ?", (key,))
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                if not os.path.exists(row[0]):
+                    cursor.execute("DELETE FROM render_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    return None
+                return {"path": row[0], "seed": row[1]}
+        except Exception as e:
+            logger.error(f"Failed to read render cache: {e}")
+            return None
+
+    def put(self, key: str, path: str, seed: Optional[int] = None):
+        """Remember the file rendered for a key."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO render_cache (key, path, seed) VALUES (?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET path = excluded.path, seed = excluded.seed
+                """, (key, os.path.abspath(path), seed))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to write render cache: {e}")
+
+
+# Shared instance so every ImageManager sees the same renders
+render_cache = RenderCache()
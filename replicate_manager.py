@@ -6,6 +6,8 @@ import aiohttp
 import base64
 import replicate
 from config import API_POLL_INTERVAL, DEFAULT_VIDEO_DURATION, CIVITAI_API_TOKEN
+from upload_cache import upload_cache, guess_mime_type, parse_expiry
+from deadline import DeadlineExceeded, stage, stage_session
 
 load_dotenv()
 
@@ -76,13 +78,88 @@ class ReplicateManager:
         # The client automatically uses the REPLICATE_API_TOKEN environment variable
         self.replicate_client = replicate.Client(api_token=self.token)
 
-    async def _poll_prediction(self, session, prediction_id, headers):
-        """Helper method to poll a Replicate prediction until completion."""
+    def _file_to_data_uri(self, file_path):
+        """Read a file into a base64 data URI (fallback when the files API is unavailable)."""
+        with open(file_path, "rb") as f:
+            data = base64.b64encode(f.read()).decode('utf-8')
+        return f"data:{guess_mime_type(file_path)};base64,{data}"
+
+    async def upload_file(self, file_path):
+        """Upload a local file to the Replicate files API and return a URL usable as model input.
+
+        The upload is streamed from disk as multipart form data and cached by content
+        hash, so the same image or audio clip is only sent once while the upload is valid.
+        Falls back to an inline data URI (built off the event loop) if the upload fails.
+        """
+        digest = await upload_cache.file_digest(file_path)
+        cached_url = upload_cache.get("replicate", digest)
+        if cached_url:
+            logger.info(f"Reusing uploaded file for {os.path.basename(file_path)}: {cached_url}")
+            return cached_url
+
+        try:
+            async with stage_session("upload") as session:
+                with open(file_path, "rb") as f:
+                    form = aiohttp.FormData()
+                    form.add_field(
+                        'content', f,
+                        filename=os.path.basename(file_path),
+                        content_type=guess_mime_type(file_path)
+                    )
+                    async with session.post('https://api.replicate.com/v1/files',
+                                            headers={'Authorization': f'Token {self.token}'},
+                                            data=form) as response:
+                        if response.status not in [200, 201]:
+                            error_text = await response.text()
+                            raise RuntimeError(f"HTTP {response.status}: {error_text}")
+                        file_data = await response.json()
+
+            file_url = file_data.get('urls', {}).get('get')
+            if not file_url:
+                raise RuntimeError(f"No URL in upload response: {file_data}")
+
+            upload_cache.put("replicate", digest, file_url, parse_expiry(file_data.get('expires_at')))
+            logger.info(f"Uploaded {os.path.basename(file_path)} to Replicate: {file_url}")
+            return file_url
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            logger.warning(f"Replicate file upload failed for {file_path}, sending inline instead: {e}")
+            return await asyncio.to_thread(self._file_to_data_uri, file_path)
+
+    async def _cancel_prediction(self, session, prediction_id, headers):
+        """Cancel a running prediction so it stops consuming GPU time."""
+        try:
+            async with session.post(f"https://api.replicate.com/v1/predictions/{prediction_id}/cancel",
+                                    headers=headers) as response:
+                if response.status == 200:
+                    logger.info(f"Cancelled Replicate prediction {prediction_id}")
+                else:
+                    logger.warning(f"Failed to cancel prediction {prediction_id}: {await response.text()}")
+        except Exception as e:
+            logger.warning(f"Failed to cancel prediction {prediction_id}: {e}")
+
+    async def _poll_prediction(self, session, prediction_id, headers, model=None):
+        """Helper method to poll a Replicate prediction until completion.
+
+        Polling is bounded by the "replicate_poll" stage limit (per model) and the request
+        deadline. If it times out or the calling task is cancelled, the prediction is
+        cancelled on Replicate too.
+        """
+        try:
+            with stage("replicate_poll", model) as poll_stage:
+                return await self._poll_until_done(session, prediction_id, headers, poll_stage)
+        except (asyncio.CancelledError, DeadlineExceeded):
+            await self._cancel_prediction(session, prediction_id, headers)
+            raise
+
+    async def _poll_until_done(self, session, prediction_id, headers, poll_stage):
         last_log_line = ""
         while True:
             await asyncio.sleep(API_POLL_INTERVAL)
+            poll_stage.check()
             async with session.get(f"https://api.replicate.com/v1/predictions/{prediction_id}", 
-                                 headers=headers) as status_response:
+                                 headers=headers, timeout=poll_stage.timeout) as status_response:
                 if status_response.status != 200:
                     logger.error(f"Error checking status: {await status_response.text()}")
                     return None
@@ -113,6 +190,33 @@ class ReplicateManager:
                     logger.warning(f"Unexpected status: {status}")
                     return None
 
+    async def _run_model(self, model, input_data):
+        """Run an official model by name and wait for its output.
+
+        Same as replicate_client.run, but goes through the HTTP API so the prediction
+        can be polled (and cancelled) from the event loop.
+
+        Returns:
+            The prediction output, or None if it failed
+        """
+        async with aiohttp.ClientSession() as session:
+            headers = {
+                'Authorization': f'Token {self.token}',
+                'Content-Type': 'application/json'
+            }
+            async with session.post(f'https://api.replicate.com/v1/models/{model}/predictions',
+                                    headers=headers,
+                                    json={'input': input_data}) as response:
+                if response.status not in [200, 201]:
+                    error_text = await response.text()
+                    logger.error(f"Error creating {model} prediction: {error_text}")
+                    return None
+                prediction = await response.json()
+
+            prediction_id = prediction.get('id')
+            logger.debug(f"{model} prediction created with ID: {prediction_id}")
+            return await self._poll_prediction(session, prediction_id, headers, model=model)
+
     async def generate_image(self, prompt, size="1024x1536"):
         try:
             logger.info(f"Creating image prediction with Replicate...")
@@ -159,17 +263,14 @@ class ReplicateManager:
                     'Authorization': f'Token {self.token}',
                     'Content-Type': 'application/json'
                 }
-                # Convert files to base64
-                with open(face_path, "rb") as f:
-                    face_data = base64.b64encode(f.read()).decode('utf-8')
-                with open(audio_path, "rb") as f:
-                    audio_data = base64.b64encode(f.read()).decode('utf-8')
+                face_url = await self.upload_file(face_path)
+                audio_url = await self.upload_file(audio_path)
 
                 data = {
                     'version': self.video_retalking_version,
                     'input': {
-                        'face': f"data:image/jpeg;base64,{face_data}",
-                        'input_audio': f"data:audio/wav;base64,{audio_data}"
+                        'face': face_url,
+                        'input_audio': audio_url
                     }
                 }
                 async with session.post('https://api.replicate.com/v1/predictions', 
@@ -345,22 +446,14 @@ class ReplicateManager:
         """Generate a video from an image using the Kling model."""
         logger.info(f"Generating Kling video with image: {image_path} and prompt: '{prompt}'")
         try:
-            with open(image_path, "rb") as image_file:
-                input_data = {
-                    "start_image": image_file,
-                    "prompt": prompt,
-                    "duration": duration
-                }
-                output_url = await asyncio.to_thread(
-                    self.replicate_client.run,
-                    self.kling_model,
-                    input=input_data
-                )
-                logger.info(f"Kling video generation successful. Output URL: {output_url}")
-                return output_url
-        except replicate.exceptions.ReplicateError as e:
-            logger.error(f"Replicate API error during Kling video generation: {e}")
-            return None
+            input_data = {
+                "start_image": await self.upload_file(image_path),
+                "prompt": prompt,
+                "duration": duration
+            }
+            output_url = await self._run_model(self.kling_model, input_data)
+            logger.info(f"Kling video generation successful. Output URL: {output_url}")
+            return output_url
         except FileNotFoundError:
             logger.error(f"Image file not found for Kling video generation: {image_path}")
             return None
@@ -378,14 +471,12 @@ class ReplicateManager:
                     'Content-Type': 'application/json'
                 }
 
-                # Convert audio to base64
-                with open(audio_path, "rb") as f:
-                    audio_data = base64.b64encode(f.read()).decode('utf-8')
+                audio_url = await self.upload_file(audio_path)
 
                 data = {
                     'version': self.latentsync_version,
                     'input': {
-                        'audio': f"data:audio/wav;base64,{audio_data}",
+                        'audio': audio_url,
                         'video': video_url
                     }
                 }
@@ -410,27 +501,16 @@ class ReplicateManager:
             return None
 
     async def generate_wan_video(self, image_path, prompt):
-        """Generates a video using the WAN I2V model via the replicate library."""
+        """Generates a video using the WAN I2V model via the Replicate API."""
         logger.info(f"Generating WAN video with image: {image_path} and prompt: '{prompt}'")
         try:
-            # The replicate library handles opening the file
-            with open(image_path, "rb") as image_file:
-                input_data = {
-                    "image": image_file,
-                    "prompt": prompt
-                }
-                # Use replicate.run which handles waiting for the result
-                output_url = await asyncio.to_thread(
-                    self.replicate_client.run,
-                    self.wan_model_identifier,
-                    input=input_data
-                )
-                # replicate.run returns the output directly when completed
-                logger.info(f"WAN video generation successful. Output URL: {output_url}")
-                return output_url
-        except replicate.exceptions.ReplicateError as e:
-            logger.error(f"Replicate API error during WAN video generation: {e}")
-            return None
+            input_data = {
+                "image": await self.upload_file(image_path),
+                "prompt": prompt
+            }
+            output_url = await self._run_model(self.wan_model_identifier, input_data)
+            logger.info(f"WAN video generation successful. Output URL: {output_url}")
+            return output_url
         except FileNotFoundError:
             logger.error(f"Image file not found for WAN video generation: {image_path}")
             return None
@@ -439,27 +519,20 @@ class ReplicateManager:
             return None
 
     async def generate_omni_human_video(self, image_path, audio_path):
-        """Generates a video using the Omni-Human model via the replicate library."""
+        """Generates a video using the Omni-Human model via the Replicate API."""
         logger.info(f"Generating Omni-Human video with image: {image_path} and audio: {audio_path}")
         try:
-            with open(image_path, "rb") as image_file, open(audio_path, "rb") as audio_file:
-                input_data = {
-                    "image": image_file,
-                    "audio": audio_file
-                }
-                output_url = await asyncio.to_thread(
-                    self.replicate_client.run,
-                    self.omni_human_model,
-                    input=input_data
-                )
-                logger.info(f"Omni-Human video generation successful. Output URL: {output_url}")
-                return output_url
-        except replicate.exceptions.ReplicateError as e:
-            logger.error(f"Replicate API error during Omni-Human video generation: {e}")
-            return None
+            input_data = {
+                "image": await self.upload_file(image_path),
+                "audio": await self.upload_file(audio_path)
+            }
+            output_url = await self._run_model(self.omni_human_model, input_data)
+            logger.info(f"Omni-Human video generation successful. Output URL: {output_url}")
+            return output_url
         except FileNotFoundError as e:
             logger.error(f"File not found for Omni-Human video generation: {e}")
             return None
+        except Exception as e:
             logger.error(f"Unexpected error during Omni-Human video generation: {e}", exc_info=True)
             return None
 
@@ -473,51 +546,37 @@ class ReplicateManager:
                     'Content-Type': 'application/json'
                 }
                 
-                # Convert files to base64
-                with open(image_path, "rb") as f:
-                    image_data = base64.b64encode(f.read()).decode('utf-8')
-                with open(audio_path, "rb") as f:
-                    audio_data = base64.b64encode(f.read()).decode('utf-8')
+                image_url = await self.upload_file(image_path)
+                audio_url = await self.upload_file(audio_path)
+
+                model_info = await self.get_model_info(self.wan_s2v_model)
+                if not model_info or not model_info.get('versions'):
+                    logger.error(f"Could not get model version for {self.wan_s2v_model}")
+                    return None
 
                 data = {
-                    'version': self.wan_s2v_model.split(':')[1] if ':' in self.wan_s2v_model else None, # Handle if version is in string
-                    # For models without explicit version in string, we might need to fetch it or use the owner/name format
-                    # Replicate API usually prefers version hash for predictions, but some endpoints accept model name
-                    # Let's try using the model name in the URL for creating prediction if version is missing
-                }
-                
-                # Construct payload
-                payload = {
-                    "input": {
-                        "image": f"data:image/jpeg;base64,{image_data}", # Assuming JPEG/PNG
-                        "audio": f"data:audio/wav;base64,{audio_data}",   # Assuming WAV
+                    'version': model_info['versions'][0]['id'],
+                    'input': {
+                        "image": image_url,
+                        "audio": audio_url,
                         "prompt": prompt
                     }
                 }
 
-                # If we don't have a version hash, we should probably fetch it or use the deployments endpoint
-                # But wait, self.wan_s2v_model is "wan-video/wan-2.2-s2v"
-                # We can use the replicate client to get the version, or just use the replicate client's create method which handles this?
-                # Actually, replicate client's predictions.create is easier but it's synchronous? No, we can use asyncio.to_thread
-                # But we want to poll manually.
-                
-                # Let's get the latest version first using our existing get_model_info or just hardcode if we knew it.
-                # Better: Use the replicate client to create the prediction, then poll manually using the ID.
-                
-                prediction = await asyncio.to_thread(
-                    self.replicate_client.predictions.create,
-                    version=self.replicate_client.models.get("wan-video/wan-2.2-s2v").latest_version,
-                    input={
-                        "image": open(image_path, "rb"),
-                        "audio": open(audio_path, "rb"),
-                        "prompt": prompt
-                    }
-                )
-                
-                logger.info(f"WAN S2V prediction created with ID: {prediction.id}")
-                
+                async with session.post('https://api.replicate.com/v1/predictions',
+                                        headers=headers,
+                                        json=data) as response:
+                    if response.status != 201:
+                        error_text = await response.text()
+                        logger.error(f"Error response: {error_text}")
+                        return None
+                    prediction = await response.json()
+
+                prediction_id = prediction.get('id')
+                logger.info(f"WAN S2V prediction created with ID: {prediction_id}")
+
                 # Poll for completion using our helper
-                return await self._poll_prediction(session, prediction.id, headers)
+                return await self._poll_prediction(session, prediction_id, headers, model=self.wan_s2v_model)
 
         except Exception as e:
             logger.error(f"Error in generate_wan_s2v_video: {str(e)}", exc_info=True)
@@ -616,9 +675,7 @@ class ReplicateManager:
                     'Content-Type': 'application/json'
                 }
                 
-                # Convert image to base64
-                with open(image_path, "rb") as f:
-                    image_data = base64.b64encode(f.read()).decode('utf-8')
+                image_url = await self.upload_file(image_path)
                 
                 # Get the latest version of the model
                 model_info = await self.get_model_info(model_id)
@@ -634,7 +691,7 @@ class ReplicateManager:
                     payload = {
                         'version': version_id,
                         'input': {
-                            'image': f"data:image/jpeg;base64,{image_data}",
+                            'image': image_url,
                             'prompt': prompt,
                             'go_fast': True,
                             'num_frames': num_frames,
@@ -656,7 +713,7 @@ class ReplicateManager:
                     payload = {
                         'version': version_id,
                         'input': {
-                            'image': f"data:image/jpeg;base64,{image_data}",
+                            'image': image_url,
                             'prompt': prompt
                         }
                     }
@@ -681,7 +738,7 @@ class ReplicateManager:
                     logger.info(f"WAN prediction created with ID: {prediction_id}")
                     
                     # Poll for completion
-                    return await self._poll_prediction(session, prediction_id, headers)
+                    return await self._poll_prediction(session, prediction_id, headers, model=model_id)
                     
         except FileNotFoundError:
             logger.error(f"Image file not found: {image_path}")
@@ -703,25 +760,16 @@ class ReplicateManager:
         logger.info(f"Generating Kling lipsync with video: {video_path}, audio: {audio_path}")
         
         try:
-            # Use replicate client library which handles file uploads and returns URLs
-            with open(video_path, "rb") as video_file, open(audio_path, "rb") as audio_file:
-                output = await asyncio.to_thread(
-                    self.replicate_client.run,
-                    "kwaivgi/kling-lip-sync",
-                    input={
-                        "video_url": video_file,  # Library auto-uploads and converts to URL
-                        "audio_url": audio_file   # Changed from 'audio' to 'audio_url'
-                    }
-                )
-                logger.info(f"Kling lipsync successful. Output: {output}")
-                # Output could be string or list
-                if isinstance(output, list) and len(output) > 0:
-                    return output[0]
-                return output
+            output = await self._run_model("kwaivgi/kling-lip-sync", {
+                    "video_url": await self.upload_file(video_path),
+                    "audio_url": await self.upload_file(audio_path)
+                })
+            logger.info(f"Kling lipsync successful. Output: {output}")
+            # Output could be string or list
+            if isinstance(output, list) and len(output) > 0:
+                return output[0]
+            return output
                 
-        except replicate.exceptions.ReplicateError as e:
-            logger.error(f"Replicate API error during Kling lipsync: {e}")
-            return None
         except FileNotFoundError as e:
             logger.error(f"File not found for Kling lipsync: {e}")
             return None
@@ -742,25 +790,17 @@ class ReplicateManager:
         logger.info(f"Generating Pixverse lipsync with video: {video_path}, audio: {audio_path}")
         
         try:
-            with open(video_path, "rb") as video_file, open(audio_path, "rb") as audio_file:
-                input_data = {
-                    "video": video_file,
-                    "audio": audio_file
-                }
-                output = await asyncio.to_thread(
-                    self.replicate_client.run,
-                    "pixverse/lipsync",
-                    input=input_data
-                )
-                logger.info(f"Pixverse lipsync successful. Output: {output}")
-                # Output could be string or list
-                if isinstance(output, list) and len(output) > 0:
-                    return output[0]
-                return output
+            input_data = {
+                "video": await self.upload_file(video_path),
+                "audio": await self.upload_file(audio_path)
+            }
+            output = await self._run_model("pixverse/lipsync", input_data)
+            logger.info(f"Pixverse lipsync successful. Output: {output}")
+            # Output could be string or list
+            if isinstance(output, list) and len(output) > 0:
+                return output[0]
+            return output
                 
-        except replicate.exceptions.ReplicateError as e:
-            logger.error(f"Replicate API error during Pixverse lipsync: {e}")
-            return None
         except FileNotFoundError as e:
             logger.error(f"File not found for Pixverse lipsync: {e}")
             return None
@@ -793,11 +833,7 @@ class ReplicateManager:
                 "disable_safety_checker": True
             }
             
-            output = await asyncio.to_thread(
-                self.replicate_client.run,
-                "qwen/qwen-image-2512",
-                input=input_data
-            )
+            output = await self._run_model("qwen/qwen-image-2512", input_data)
             
             logger.info(f"[Qwen Image 2512] Generation successful. Output type: {type(output)}")
             
@@ -816,9 +852,6 @@ class ReplicateManager:
                 return str(output)
             return None
             
-        except replicate.exceptions.ReplicateError as e:
-            logger.error(f"[Qwen Image 2512] Replicate API error: {e}")
-            return None
         except Exception as e:
             logger.error(f"[Qwen Image 2512] Error: {e}", exc_info=True)
             return None
@@ -847,11 +880,7 @@ class ReplicateManager:
                 "disable_safety_checker": True
             }
             
-            output = await asyncio.to_thread(
-                self.replicate_client.run,
-                "qwen/qwen-image-edit-2511",
-                input=input_data
-            )
+            output = await self._run_model("qwen/qwen-image-edit-2511", input_data)
             
             logger.info(f"[Qwen Image Edit] Edit successful. Output type: {type(output)}")
             
@@ -870,9 +899,6 @@ class ReplicateManager:
                 return str(output)
             return None
             
-        except replicate.exceptions.ReplicateError as e:
-            logger.error(f"[Qwen Image Edit] Replicate API error: {e}")
-            return None
         except Exception as e:
             logger.error(f"[Qwen Image Edit] Error: {e}", exc_info=True)
             return None
@@ -902,7 +928,6 @@ class ReplicateManager:
         Returns:
             URL to generated video, or None if failed
         """
-        import base64 # Added import here to ensure it's available for this method
         mode = "image-to-video" if image_path else "text-to-video"
         logger.info(f"[LTX-2] Generating {mode} video, duration={duration}s, resolution={resolution}, fps={fps}")
         logger.info(f"[LTX-2] Prompt: {prompt[:200]}...")
@@ -922,17 +947,11 @@ class ReplicateManager:
             
             # Add source image for image-to-video mode
             if image_path:
-                with open(image_path, "rb") as f:
-                    image_data = base64.b64encode(f.read()).decode('utf-8')
-                input_data["image"] = f"data:image/jpeg;base64,{image_data}"
+                input_data["image"] = await self.upload_file(image_path)
                 logger.info(f"[LTX-2] Using source image: {image_path}")
             
-            # Use replicate client
-            output = await asyncio.to_thread(
-                self.replicate_client.run,
-                "lightricks/ltx-2-distilled",
-                input=input_data
-            )
+            # Run via the predictions API (cancellable)
+            output = await self._run_model("lightricks/ltx-2-distilled", input_data)
             
             logger.info(f"[LTX-2] Generation successful. Output type: {type(output)}")
             
@@ -949,9 +968,6 @@ class ReplicateManager:
                 return str(output)
             return None
             
-        except replicate.exceptions.ReplicateError as e:
-            logger.error(f"[LTX-2] Replicate API error: {e}")
-            return None
         except FileNotFoundError:
             logger.error(f"[LTX-2] Image file not found: {image_path}")
             return None
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from config import STABLE_DIFFUSION_URLS, SD_HEALTH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+def checkpoint_key(name: Optional[str]) -> Optional[str]:
+    """Normalize a checkpoint name for comparison.
+
+    Forge reports loaded checkpoints as e.g. "sdxl/lustify.safetensors [a1b2c3d4]" while
+    requests use the bare filename, so compare on the lowercased stem only.
+    """
+    if not name:
+        return None
+    name = name.split(" [")[0].replace("\\", "/")
+    return os.path.splitext(os.path.basename(name))[0].lower()
+
+
+class SDBackend:
+    """One Forge / A1111 instance."""
+
+    def __init__(self, txt2img_url: str):
+        self.base_url = txt2img_url.replace("/sdapi/v1/txt2img", "")
+        self.healthy = True  # optimistic until the first health check
+        self.loaded_checkpoint = None
+        self.active = 0
+        self.last_checked = None
+        self.last_error = None
+
+    def endpoint(self, name: str) -> str:
+        """Full URL for an /sdapi/v1 endpoint, e.g. endpoint("img2img")."""
+        return f"{self.base_url}/sdapi/v1/{name}"
+
+    def to_dict(self) -> Dict:
+        return {
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "loaded_checkpoint": self.loaded_checkpoint,
+            "active": self.active,
+            "last_checked": self.last_checked,
+            "last_error": self.last_error,
+        }
+
+
+class SDPool:
+    """Pool of Stable Diffusion backends with checkpoint-affinity routing.
+
+    Backends are health-checked in the background, which also records the checkpoint
+    each one has loaded. select() prefers a healthy backend that already has the wanted
+    checkpoint loaded (so Forge doesn't swap multi-GB models), otherwise the
+    least-loaded healthy backend. Generation requests are handed out by SDQueue.
+    """
+
+    def __init__(self, urls: List[str] = STABLE_DIFFUSION_URLS, health_interval: int = SD_HEALTH_INTERVAL):
+        self.backends = [SDBackend(url) for url in urls]
+        self.health_interval = health_interval
+        self._health_task: Optional[asyncio.Task] = None
+
+    async def check_backend(self, session: aiohttp.ClientSession, backend: SDBackend):
+        """Refresh a backend's health and loaded checkpoint."""
+        try:
+            async with session.get(backend.endpoint("options"), timeout=aiohttp.ClientTimeout(total=5)) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"HTTP {response.status}")
+                options = await response.json()
+            if not backend.healthy:
+                logger.info(f"[SD Pool] Backend {backend.base_url} is back online")
+            backend.healthy = True
+            backend.loaded_checkpoint = options.get("sd_model_checkpoint")
+            backend.last_error = None
+        except Exception as e:
+            if backend.healthy:
+                logger.warning(f"[SD Pool] Backend {backend.base_url} is unavailable: {e}")
+            backend.healthy = False
+            backend.last_error = str(e)
+        backend.last_checked = time.time()
+
+    async def check_all(self):
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*[self.check_backend(session, backend) for backend in self.backends])
+
+    async def _health_loop(self):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.health_interval)
+
+    def start(self):
+        """Start background health checks."""
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._health_loop())
+            logger.info(f"[SD Pool] Monitoring {len(self.backends)} backend(s)")
+
+    def select(self, checkpoint: Optional[str] = None) -> SDBackend:
+        """Pick the backend for a request that needs the given checkpoint (None = any)."""
+        candidates = [backend for backend in self.backends if backend.healthy] or self.backends
+
+        wanted = checkpoint_key(checkpoint)
+        if wanted:
+            warm = [backend for backend in candidates if checkpoint_key(backend.loaded_checkpoint) == wanted]
+            if warm:
+                return min(warm, key=lambda backend: backend.active)
+        return min(candidates, key=lambda backend: backend.active)
+
+    def status(self) -> List[Dict]:
+        return [backend.to_dict() for backend in self.backends]
+
+
+# Shared pool so every ImageManager routes through the same backends
+sd_pool = SDPool()
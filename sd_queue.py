@@ -0,0 +1,142 @@
+import asyncio
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from config import SD_QUEUE_FAIRNESS_WINDOW
+from job_manager import current_job_id
+from sd_pool import SDBackend, SDPool, checkpoint_key, sd_pool
+
+logger = logging.getLogger(__name__)
+
+
+class QueueEntry:
+    def __init__(self, entry_id: int, checkpoint: Optional[str], job_id: Optional[str]):
+        self.id = entry_id
+        self.checkpoint = checkpoint
+        self.key = checkpoint_key(checkpoint)
+        self.job_id = job_id
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def to_dict(self, position: int) -> Dict:
+        return {
+            "id": self.id,
+            "job_id": self.job_id,
+            "checkpoint": self.checkpoint,
+            "position": position,
+            "waiting_seconds": round(time.monotonic() - self.enqueued_at, 1),
+        }
+
+
+class SDQueue:
+    """Serializes Stable Diffusion requests, one in flight per backend.
+
+    When a backend frees up it takes the oldest pending request that can run on the
+    checkpoint it already has loaded (or needs no particular checkpoint, like faceswap),
+    so requests for the same model are batched together instead of forcing a reload
+    each time. Once the oldest request has waited longer than the fairness window it
+    goes next regardless, so no request starves.
+    """
+
+    def __init__(self, pool: SDPool = sd_pool, fairness_window: float = SD_QUEUE_FAIRNESS_WINDOW):
+        self.pool = pool
+        self.fairness_window = fairness_window
+        self.pending: List[QueueEntry] = []
+        self.running: Dict[int, QueueEntry] = {}
+        self._ids = itertools.count(1)
+
+    def _free_backends(self) -> List[SDBackend]:
+        backends = [backend for backend in self.pool.backends if backend.healthy] or self.pool.backends
+        return [backend for backend in backends if backend.active == 0]
+
+    def _next_for(self, backend: SDBackend) -> QueueEntry:
+        oldest = self.pending[0]
+        if time.monotonic() - oldest.enqueued_at >= self.fairness_window:
+            return oldest
+        loaded = checkpoint_key(backend.loaded_checkpoint)
+        for entry in self.pending:
+            if entry.key is None or entry.key == loaded:
+                return entry
+        return oldest
+
+    def _dispatch(self):
+        # Drop requests whose waiter was cancelled but hasn't cleaned up yet
+        self.pending = [entry for entry in self.pending if not entry.future.done()]
+        for backend in self._free_backends():
+            if not self.pending:
+                return
+            entry = self._next_for(backend)
+            self.pending.remove(entry)
+            backend.active += 1
+            self.running[entry.id] = entry
+            entry.future.set_result(backend)
+
+    def _release(self, entry: QueueEntry, backend: SDBackend):
+        backend.active -= 1
+        self.running.pop(entry.id, None)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, checkpoint: Optional[str] = None):
+        """Wait for a turn on a backend and hold it for one request.
+
+        Yields the SDBackend to send the request to. If the waiting task is cancelled,
+        its place in the queue is given up immediately.
+        """
+        entry = QueueEntry(next(self._ids), checkpoint, current_job_id())
+        self.pending.append(entry)
+        self._dispatch()
+
+        if not entry.future.done():
+            logger.info(f"[SD Queue] Request {entry.id} ({checkpoint or 'any checkpoint'}) queued at position {self.position(entry.id)}")
+        try:
+            backend = await entry.future
+        except asyncio.CancelledError:
+            if entry in self.pending:
+                self.pending.remove(entry)
+            elif entry.future.done() and not entry.future.cancelled():
+                # Got a backend just as we were cancelled - hand it back
+                self._release(entry, entry.future.result())
+            raise
+
+        try:
+            yield backend
+            if checkpoint:
+                backend.loaded_checkpoint = checkpoint
+        except aiohttp.ClientConnectionError as e:
+            backend.healthy = False
+            backend.last_error = str(e)
+            logger.warning(f"[SD Queue] Lost connection to {backend.base_url}: {e}")
+            raise
+        finally:
+            self._release(entry, backend)
+
+    def position(self, entry_id: int) -> Optional[int]:
+        """1-based position among pending requests (None if not waiting)."""
+        for index, entry in enumerate(self.pending):
+            if entry.id == entry_id:
+                return index + 1
+        return None
+
+    def job_position(self, job_id: str) -> Optional[int]:
+        """Queue position of the first pending SD request belonging to a job."""
+        for index, entry in enumerate(self.pending):
+            if entry.job_id == job_id:
+                return index + 1
+        return None
+
+    def status(self) -> Dict:
+        return {
+            "pending": [entry.to_dict(index + 1) for index, entry in enumerate(self.pending)],
+            "running": [entry.to_dict(0) for entry in self.running.values()],
+            "fairness_window": self.fairness_window,
+        }
+
+
+# Shared queue so all SD traffic (generation, faceswap) is serialized together
+sd_queue = SDQueue()
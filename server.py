@@ -1,9 +1,10 @@
+import asyncio
 import os
 import re
 import logging
 from datetime import datetime
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, Response
 import zipfile
 import io
 from fastapi.staticfiles import StaticFiles
@@ -12,6 +13,9 @@ from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import uvicorn
 import json
+import functools
+import inspect
+import time
 
 # Import existing managers (we will refactor them slightly if needed)
 from conversation_manager import ConversationManager
@@ -21,6 +25,28 @@ from image_manager import ImageManager
 from replicate_manager import ReplicateManager
 from wavespeed_manager import WavespeedManager
 from tts_manager import TTSManager
+from media_registry import MediaRegistry
+from download_manager import DownloadManager, DownloadError
+from blob_store import blob_store, unique_timestamp
+from lora_sync import LoraSyncManager
+from job_manager import JobManager, JobCancelledError, DuplicateJobError
+from deadline import Deadline, DeadlineExceeded, set_deadline, reset_deadline
+from sd_pool import sd_pool
+from sd_queue import sd_queue
+from face_models import face_models
+from face_detector import detect_faces
+from prompt_cache import prompt_cache
+from model_catalog import model_catalog
+from hedging import latency_tracker, plan_hedge, race
+from media_probe import MediaProber
+from media_workers import media_workers
+from derived_assets import DerivedAssets
+from last_frame import extract_last_frame
+from mp4_remux import remux_for_streaming, build_hls
+from media_server import MediaFiles, etag_matches
+from media_variants import MediaVariants, ACCEPT_CH
+from story_compiler import StoryCompiler, StoryCompileError
+from thumbnails import thumbnails, ThumbnailService, THUMBNAIL_SIZES
 from config import (
     DISCORD_BOT_TOKEN, # We might not need this, but config imports it
     COMMAND_PREFIX,
@@ -28,7 +54,10 @@ from config import (
     USE_NGROK,
     NGROK_AUTH_TOKEN,
     SD_CHECKPOINTS_FOLDER,
-    STABLE_DIFFUSION_URL
+    API_TIMEOUT,
+    JOB_DEADLINES,
+    RERENDER_MAX_STEPS,
+    HEDGE_SD_MODEL
 )
 
 # Setup logging
@@ -44,14 +73,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Job-Id"],
 )
 
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    """A stage ran out of time outside a cancellable job (e.g. the LLM call behind /api/chat)."""
+    logger.warning(f"[Deadline] {request.url.path} timed out during {exc.stage}")
+    return JSONResponse(status_code=504, content={"detail": f"Timed out during {exc.stage}"})
+
 # StaticFiles mount moved to end of file
 
-# Serve output files (Images/Audio/Video)
+# Output files (Images/Audio/Video) are served by the /output route below
 if not os.path.exists("output"):
     os.makedirs("output")
-app.mount("/output", StaticFiles(directory="output"), name="output")
 
 # Serve reference images for face picker modal
 if os.path.exists("reference_images"):
@@ -61,6 +96,17 @@ if os.path.exists("reference_images"):
 class AppState:
     def __init__(self):
         self.db = DatabaseManager()
+        self.media_registry = MediaRegistry()
+        self.downloader = DownloadManager(self.media_registry, blob_store)
+        self.prober = MediaProber(self.media_registry)
+        # Shared so concurrent compiles share the worker limit and clip cache
+        self.story_compiler = StoryCompiler(self.prober)
+        self.derived_assets = DerivedAssets(self.media_registry, self.prober)
+        self.background_tasks = set()  # references so fire-and-forget tasks aren't garbage collected
+        self.media_variants = MediaVariants(self.prober)
+        self.media_files = MediaFiles("output", self.media_registry, self.media_variants)
+        self.lora_sync = LoraSyncManager(os.path.join(os.getcwd(), "custom_loras"), self.downloader)
+        self.jobs = JobManager()
         self.conversation_manager = None
         self.api_manager = None
         self.image_manager = None
@@ -72,6 +118,11 @@ class AppState:
 
 state = AppState()
 
+@app.api_route("/output/{file_path:path}", methods=["GET", "HEAD"])
+async def serve_output(request: Request, file_path: str):
+    """Session media with content-hash ETags, 304s and byte ranges for seeking."""
+    return await state.media_files.response(request, file_path)
+
 # --- Models ---
 class InitRequest(BaseModel):
     user: str
@@ -90,6 +141,163 @@ class SettingsRequest(BaseModel):
     first_person_mode: Optional[bool] = None
     sd_mode: Optional[str] = None  # "xl" or "lumina"
 
+async def download_media(url: str, filename: str, media_type: str, metadata: Optional[Dict] = None) -> str:
+    """Stream generated media into the session folder and record it in the media registry."""
+    try:
+        path = await state.downloader.download_to_session(
+            url, state.conversation_manager, filename, media_type, metadata=metadata
+        )
+    except DownloadError as e:
+        logger.error(f"[Download] {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to download generated {media_type}")
+    if media_type == "video":
+        # Many providers put the moov atom last, which stalls playback until the whole file is in
+        if await remux_for_streaming(path):
+            stored = await blob_store.ingest(path)
+            if stored:
+                state.media_registry.update_file(path, stored["size"], stored["sha256"])
+        schedule_derived_assets(path)
+    return path
+
+async def build_story_hls(video_path: str):
+    """Add an HLS rendition of a long compiled story (runs in the background)."""
+    try:
+        probe = await state.prober.probe(video_path)
+        playlist = await build_hls(video_path, probe.get("duration") if probe else None)
+        if playlist:
+            state.media_registry.update_metadata(video_path, hls=playlist)
+    except Exception as e:
+        logger.error(f"[HLS] Failed for {os.path.basename(video_path)}: {e}")
+
+def schedule_derived_assets(video_path: str, swap_last_frame: bool = True):
+    """Extract a video's last frame (face-swapped unless VOY mode), poster and sprite in the background."""
+    is_voy_mode = characters.get(state.character_name, {}).get("voy_mode", False)
+    if swap_last_frame and state.image_manager and not is_voy_mode:
+        state.derived_assets.schedule(video_path, faceswap=faceswap_if_face, character=state.character_name)
+    else:
+        state.derived_assets.schedule(video_path)
+
+def media_url(path: Optional[str]) -> Optional[str]:
+    """URL of a file under the working directory (None passes through)."""
+    if not path:
+        return None
+    return "/" + os.path.relpath(path, start=os.getcwd()).replace("\\", "/")
+
+async def faceswap_if_face(image_path: str) -> Optional[str]:
+    """Face-swap an automatically produced image, unless the face gate finds no face in it.
+
+    The gate's decision is recorded in the media registry under "face_gate".
+
+    Returns:
+        Path to the face-swapped image, or None if skipped or the swap failed
+    """
+    detection = await detect_faces(image_path)
+    if detection is not None:
+        swap = detection["faces"] > 0
+        state.media_registry.update_metadata(image_path, face_gate={**detection, "swapped": swap})
+        if not swap:
+            logger.info(f"[Face Gate] No face in {os.path.basename(image_path)} (best score {detection['score']}), skipping face swap")
+            return None
+    return await state.image_manager.apply_faceswap(image_path)
+
+async def save_sd_image(result: Dict, metadata: Dict, filename: Optional[str] = None) -> str:
+    """Save an ImageManager result and record its seed and render settings in the media registry."""
+    image_path = await state.image_manager.save_image(
+        result["image"], filename=filename, cache_key=result.get("cache_key"), seed=result["seed"]
+    )
+    # save_image already recorded the file with its hash; add the render details
+    state.media_registry.update_metadata(
+        image_path, **{**metadata, "seed": result["seed"], "steps": result["steps"], "cached": result.get("cached", False)}
+    )
+    return image_path
+
+def reuse_similar_image(prompt: str, model: str, force: bool = False) -> Optional[Dict]:
+    """Response reusing a recent image whose prompt nearly matches this one, if the prompt cache has one.
+
+    Args:
+        prompt: Final image prompt
+        model: Image model the prompt would be rendered with
+        force: Skip the lookup (the user asked for a fresh image)
+    """
+    if force:
+        prompt_cache.record_forced()
+        return None
+    match = prompt_cache.lookup(state.conversation_manager.session_id, model, prompt)
+    if not match:
+        return None
+
+    logger.info(f"[Prompt Cache] Reusing {os.path.basename(match['image_path'])} (similarity {match['similarity']})")
+    state.conversation_manager.set_last_selfie_path(match["image_path"])
+    relative_path = os.path.relpath(match["image_path"], start=os.getcwd()).replace("\\", "/")
+    return {
+        "image_url": f"/{relative_path}",
+        "prompt": prompt,
+        "reused": True,
+        "similarity": match["similarity"],
+        "matched_prompt": match["prompt"]
+    }
+
+def cancellable_job(kind: str):
+    """Run an endpoint as a cancellable job with a time budget.
+
+    The job is cancelled when the client disconnects or POSTs /api/jobs/{id}/cancel.
+    Clients can pick the id by sending an X-Job-Id header (409 if a job with that id
+    is still running); either way it is returned in the X-Job-Id response header and
+    the job is listed in /api/jobs while it runs. Cancellation propagates into the
+    managers, which stop the SD / Replicate / Wavespeed work they were waiting on.
+
+    Every stage the job runs shares a deadline (JOB_DEADLINES[kind]); running out of
+    time is reported as a 504 naming the stage that timed out.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, job_request: Request, job_response: Response, **kwargs):
+            job_id = job_request.headers.get("X-Job-Id") or state.jobs.new_job_id()
+            job_headers = {"X-Job-Id": job_id}
+            job_response.headers.update(job_headers)
+            deadline = Deadline(JOB_DEADLINES.get(kind, API_TIMEOUT))
+            token = set_deadline(deadline)
+            try:
+                result = await state.jobs.run(
+                    kind,
+                    func(*args, **kwargs),
+                    job_id=job_id,
+                    is_disconnected=job_request.is_disconnected,
+                    timeout=deadline.budget,
+                )
+                if isinstance(result, Response):
+                    result.headers.update(job_headers)  # returned as is, without job_response's headers
+                return result
+            except DuplicateJobError:
+                raise HTTPException(status_code=409, detail=f"A job with id {job_id} is already running")
+            except DeadlineExceeded as e:
+                raise HTTPException(status_code=504, detail=f"Timed out during {e.stage}", headers=job_headers)
+            except JobCancelledError as e:
+                if e.reason == "deadline exceeded":
+                    raise HTTPException(status_code=504, detail=f"Timed out during {deadline.stage or kind}",
+                                        headers=job_headers)
+                raise HTTPException(status_code=499, detail=f"Job cancelled ({e.reason})", headers=job_headers)
+            except HTTPException as e:
+                # Managers report failures as None; if a stage timed out, say so
+                if e.status_code >= 500 and deadline.timed_out_stage:
+                    raise HTTPException(status_code=504, detail=f"Timed out during {deadline.timed_out_stage}",
+                                        headers=job_headers)
+                e.headers = {**(e.headers or {}), **job_headers}
+                raise
+            finally:
+                reset_deadline(token)
+
+        # Expose the original parameters plus the Request / Response so FastAPI injects them
+        wrapper.__signature__ = signature.replace(parameters=[
+            *signature.parameters.values(),
+            inspect.Parameter("job_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+            inspect.Parameter("job_response", inspect.Parameter.KEYWORD_ONLY, annotation=Response),
+        ])
+        return wrapper
+    return decorator
+
 # --- Endpoints ---
 
 @app.on_event("startup")
@@ -100,6 +308,8 @@ async def startup_event():
     # For now, let's create a default session or load the last one.
     state.replicate_manager = ReplicateManager()
     state.wavespeed_manager = WavespeedManager()
+    sd_pool.start()
+    model_catalog.start()
     
     # Load LLM settings from user_settings.json
     llm_settings = None
@@ -165,11 +375,19 @@ async def startup_event():
             state.conversation_manager.set_log_file("latest_session")
         
         # Initialize ImageManager and TTSManager
-        state.image_manager = ImageManager(state.conversation_manager, state.character_name, state.api_manager)
+        state.image_manager = ImageManager(state.conversation_manager, state.character_name, state.api_manager, state.media_registry)
         state.tts_manager = TTSManager(state.character_name, state.conversation_manager)
         
         logger.info(f"Session auto-initialized for {state.character_name}")
 
+    # Drop blobs whose session files were all deleted while the server was down. Done before
+    # startup finishes, so no request can be linking to a blob while it is removed
+    await asyncio.to_thread(blob_store.collect_garbage)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    media_workers.shutdown()
+
 @app.post("/api/init")
 async def init_session(request: InitRequest):
     state.user_id = request.user
@@ -197,7 +415,7 @@ async def init_session(request: InitRequest):
     session_id = state.conversation_manager.session_id
     
     # Initialize ImageManager
-    state.image_manager = ImageManager(state.conversation_manager, state.character_name, state.api_manager)
+    state.image_manager = ImageManager(state.conversation_manager, state.character_name, state.api_manager, state.media_registry)
     
     # Initialize TTSManager
     state.tts_manager = TTSManager(state.character_name, state.conversation_manager)
@@ -412,77 +630,15 @@ async def generate_script_tts(request: ScriptTTSRequest):
         raise HTTPException(status_code=500, detail=f"Script TTS failed: {e}")
 
 @app.get("/api/image-models")
-async def get_image_models():
-    """Fetch available models from SD API (supports remote instances)."""
-    import aiohttp
-    
-    models = []
-    
-    # Try to fetch models from SD API (works for local or remote SD)
-    try:
-        # Construct the sd-models endpoint from the txt2img URL
-        sd_base_url = STABLE_DIFFUSION_URL.replace("/sdapi/v1/txt2img", "")
-        sd_models_url = f"{sd_base_url}/sdapi/v1/sd-models"
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(sd_models_url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                if resp.status == 200:
-                    sd_models = await resp.json()
-                    
-                    for model in sd_models:
-                        # model_name is the full path, title is the display name
-                        filename = model.get("model_name", model.get("title", ""))
-                        name_without_ext = filename.rsplit('.', 1)[0] if '.' in filename else filename
-                        
-                        # Determine mode from filename prefix
-                        name_lower = name_without_ext.lower()
-                        if name_lower.startswith('zimage') or name_lower.startswith('z_image') or name_lower.startswith('z-image'):
-                            mode = 'lumina'
-                        else:
-                            mode = 'xl'
-                        
-                        models.append({
-                            "value": filename,
-                            "label": name_without_ext,
-                            "mode": mode,
-                            "filename": filename
-                        })
-                    
-                    # Sort alphabetically, but put z-image models first
-                    models.sort(key=lambda x: (0 if x['mode'] == 'lumina' else 1, x['label'].lower()))
-                    logger.info(f"Fetched {len(models)} models from SD API at {sd_models_url}")
-                else:
-                    logger.warning(f"SD API returned status {resp.status} when fetching models")
-    except aiohttp.ClientError as e:
-        logger.warning(f"Could not connect to SD API to fetch models: {e}")
-    except Exception as e:
-        logger.warning(f"Error fetching models from SD API: {e}")
-    
-    # Fallback: scan local folder if API fetch failed and folder exists
-    if not models and os.path.exists(SD_CHECKPOINTS_FOLDER):
-        import glob
-        extensions = ["*.safetensors", "*.gguf"]
-        for ext in extensions:
-            pattern = os.path.join(SD_CHECKPOINTS_FOLDER, ext)
-            for filepath in glob.glob(pattern):
-                filename = os.path.basename(filepath)
-                name_without_ext = filename.rsplit('.', 1)[0]
-                
-                name_lower = name_without_ext.lower()
-                if name_lower.startswith('zimage') or name_lower.startswith('z_image') or name_lower.startswith('z-image'):
-                    mode = 'lumina'
-                else:
-                    mode = 'xl'
-                
-                models.append({
-                    "value": filename,
-                    "label": name_without_ext,
-                    "mode": mode,
-                    "filename": filename
-                })
-        
-        models.sort(key=lambda x: (0 if x['mode'] == 'lumina' else 1, x['label'].lower()))
-    
+async def get_image_models(request: Request):
+    """Available image models, served from the background-refreshed model catalog.
+
+    Supports If-None-Match: returns 304 when the client already has the current list.
+    """
+    models, etag = await model_catalog.get_models()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
     if not models:
         logger.warning(f"No SD models found (API unreachable and local folder doesn't exist: {SD_CHECKPOINTS_FOLDER})")
     
@@ -493,10 +649,24 @@ async def get_image_models():
         "mode": "cloud",
         "filename": None
     })
+    models.append({
+        "value": "fastest",
+        "label": "⚡ Fastest (Local vs Cloud)",
+        "mode": "hedged",
+        "filename": None
+    })
     
-    return {"models": models}
+    return JSONResponse({"models": models}, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.post("/api/image-models/refresh")
+async def refresh_image_models():
+    """Rescan the SD API and checkpoints folder now (new files only get their headers read)."""
+    await model_catalog.refresh_in_background()
+    models, etag = await model_catalog.get_models()
+    return {"count": len(models), "etag": etag, "source": model_catalog.source}
 
 @app.post("/api/generate/image")
+@cancellable_job("image")
 async def generate_image(model: str = "z-image-turbo", spycam: bool = False):
     """Generate image with specified model."""
     if not state.image_manager:
@@ -505,14 +675,11 @@ async def generate_image(model: str = "z-image-turbo", spycam: bool = False):
     # Check if cloud model (Qwen)
     if model == "qwen-image-2512":
         return await generate_image_qwen()
+    if model == "fastest":
+        return await generate_image_fastest(spycam)
     
-    # Dynamic model detection based on filename prefix
-    # zImage*, z_image*, z-image* (any casing) → lumina mode, all else → xl mode
-    model_lower = model.lower()
-    if model_lower.startswith("zimage") or model_lower.startswith("z_image") or model_lower.startswith("z-image"):
-        sd_mode = "lumina"
-    else:
-        sd_mode = "xl"
+    # Lumina vs XL mode from the checkpoint's header (filename prefix if unknown)
+    sd_mode = model_catalog.mode_for(model)
     
     # Model value is already the full filename with extension from the dropdown
     sd_checkpoint = model
@@ -532,14 +699,8 @@ async def generate_image(model: str = "z-image-turbo", spycam: bool = False):
     if not prompt:
         raise HTTPException(status_code=500, detail="Failed to generate image prompt")
         
-    # 2. Generate Image
-    image_data = await state.image_manager.generate_image(prompt, first_person_mode=first_person_mode, sd_mode=sd_mode, sd_checkpoint=sd_checkpoint)
-    
-    if not image_data:
-        raise HTTPException(status_code=500, detail="Failed to generate image")
-        
-    # 3. Save Image
-    image_path = await state.image_manager.save_image(image_data)
+    # 2. Generate and save Image (with its seed, so it can be re-rendered)
+    image_path, seed = await render_sd_selfie(prompt, sd_checkpoint, sd_mode, first_person_mode)
     
     # Update conversation manager with last selfie path (needed for video)
     state.conversation_manager.set_last_selfie_path(image_path)
@@ -549,9 +710,226 @@ async def generate_image(model: str = "z-image-turbo", spycam: bool = False):
     
     return {
         "image_url": f"/{relative_path}",
+        "prompt": prompt,
+        "seed": seed
+    }
+
+@app.post("/api/generate/image/variants")
+@cancellable_job("image")
+async def generate_image_variants(model: str = "z-image-turbo", count: int = 4, spycam: bool = False):
+    """Generate several variants of one selfie prompt in a single SD call."""
+    if not state.image_manager:
+        raise HTTPException(status_code=400, detail="Session not initialized")
+    if model in ("qwen-image-2512", "fastest"):
+        raise HTTPException(status_code=400, detail="Variants are only supported for local SD models")
+    if not 1 <= count <= 8:
+        raise HTTPException(status_code=400, detail="count must be between 1 and 8")
+
+    sd_mode = model_catalog.mode_for(model)
+
+    logger.info(f"[Image Variants] Model: {model}, sd_mode: {sd_mode}, count: {count}, spycam: {spycam}")
+
+    # 1. Generate one prompt for all variants
+    conversation = state.conversation_manager.get_conversation()
+    char_settings = characters.get(state.character_name, {})
+    pov_mode = char_settings.get("pov_mode", False)
+    first_person_mode = char_settings.get("first_person_mode", False)
+
+    prompt = await state.image_manager.generate_selfie_prompt(conversation, pov_mode=pov_mode, first_person_mode=first_person_mode, spycam_mode=spycam)
+    if not prompt:
+        raise HTTPException(status_code=500, detail="Failed to generate image prompt")
+
+    # 2. Generate all variants in one txt2img call
+    variants = await state.image_manager.generate_image_variants(prompt, count, first_person_mode=first_person_mode, sd_mode=sd_mode, sd_checkpoint=model)
+    if not variants:
+        raise HTTPException(status_code=500, detail="Failed to generate images")
+
+    # 3. Save each variant with its seed
+    timestamp = unique_timestamp()
+    images = []
+    saved_paths = []
+    for i, variant in enumerate(variants):
+        image_path = await save_sd_image(
+            variant,
+            {"prompt": prompt, "checkpoint": model, "sd_mode": sd_mode, "first_person_mode": first_person_mode, "variant_of": timestamp},
+            filename=f"selfie_image_{timestamp}_v{i + 1}.png",
+        )
+        saved_paths.append(image_path)
+        relative_path = os.path.relpath(image_path, start=os.getcwd()).replace("\\", "/")
+        images.append({"image_url": f"/{relative_path}", "seed": variant["seed"]})
+
+    # First variant is the default for video until the user picks another
+    state.conversation_manager.set_last_selfie_path(saved_paths[0])
+
+    return {
+        "images": images,
         "prompt": prompt
     }
 
+class RerenderRequest(BaseModel):
+    image_url: str  # Relative URL of an image generated with local SD
+    steps: Optional[int] = None  # Defaults to double the original steps
+
+@app.post("/api/generate/image/rerender")
+@cancellable_job("image")
+async def rerender_image(request: RerenderRequest):
+    """Re-render a generated image with the same prompt and seed at more sampling steps."""
+    if not state.image_manager:
+        raise HTTPException(status_code=400, detail="Session not initialized")
+
+    absolute_path = os.path.join(os.getcwd(), request.image_url.lstrip('/'))
+    entry = state.media_registry.get(absolute_path)
+    metadata = entry["metadata"] if entry else {}
+    if metadata.get("seed") is None or not metadata.get("prompt") or not metadata.get("checkpoint"):
+        raise HTTPException(status_code=400, detail="No recorded seed for this image - only local SD images can be re-rendered")
+
+    steps = request.steps or min(metadata.get("steps", RERENDER_MAX_STEPS // 2) * 2, RERENDER_MAX_STEPS)
+    if not 1 <= steps <= RERENDER_MAX_STEPS:
+        raise HTTPException(status_code=400, detail=f"steps must be between 1 and {RERENDER_MAX_STEPS}")
+
+    logger.info(f"[Rerender] {request.image_url}: seed {metadata['seed']}, {metadata.get('steps')} -> {steps} steps")
+    result = await state.image_manager.generate_image(
+        metadata["prompt"],
+        first_person_mode=metadata.get("first_person_mode", False),
+        sd_mode=metadata.get("sd_mode", "lumina"),
+        sd_checkpoint=metadata["checkpoint"],
+        seed=metadata["seed"],
+        steps=steps,
+    )
+    if not result:
+        raise HTTPException(status_code=500, detail="Failed to re-render image")
+
+    timestamp = unique_timestamp()
+    image_path = await save_sd_image(
+        result,
+        {"prompt": metadata["prompt"], "checkpoint": metadata["checkpoint"], "sd_mode": metadata.get("sd_mode", "lumina"),
+         "first_person_mode": metadata.get("first_person_mode", False), "rerender_of": absolute_path},
+        filename=f"selfie_image_{timestamp}_s{steps}.png",
+    )
+    state.conversation_manager.set_last_selfie_path(image_path)
+
+    relative_path = os.path.relpath(image_path, start=os.getcwd()).replace("\\", "/")
+    return {
+        "image_url": f"/{relative_path}",
+        "prompt": metadata["prompt"],
+        "seed": result["seed"],
+        "steps": result["steps"],
+        "cached": result["cached"]
+    }
+
+class SelectImageRequest(BaseModel):
+    image_url: str  # Relative URL like /conversations/.../image.png
+
+@app.post("/api/select-image")
+async def select_image(request: SelectImageRequest):
+    """Use an existing image (e.g. a picked variant) as the source for the next video."""
+    if not state.conversation_manager:
+        raise HTTPException(status_code=400, detail="Session not initialized")
+
+    absolute_path = os.path.join(os.getcwd(), request.image_url.lstrip('/'))
+    if not os.path.exists(absolute_path):
+        raise HTTPException(status_code=400, detail=f"Image not found: {request.image_url}")
+
+    state.conversation_manager.set_last_selfie_path(absolute_path)
+    return {"image_url": request.image_url}
+
+async def render_sd_selfie(prompt: str, sd_checkpoint: str, sd_mode: str, first_person_mode: bool):
+    """Generate a selfie with local SD and save it. Returns (image path, seed)."""
+    started_at = time.monotonic()
+    try:
+        result = await state.image_manager.generate_image(prompt, first_person_mode=first_person_mode, sd_mode=sd_mode, sd_checkpoint=sd_checkpoint)
+    except asyncio.CancelledError:
+        # Lost a hedge: still counts, or SD's history would only ever hold its wins
+        latency_tracker.record_cancelled("sd", time.monotonic() - started_at)
+        raise
+    if not result:
+        raise HTTPException(status_code=500, detail="Failed to generate image")
+    
+    image_path = await save_sd_image(result, {"prompt": prompt, "checkpoint": sd_checkpoint, "sd_mode": sd_mode, "first_person_mode": first_person_mode})
+    if not result["cached"]:
+        latency_tracker.record("sd", time.monotonic() - started_at)
+    return image_path, result["seed"]
+
+async def render_qwen_selfie(prompt: str, first_person_mode: bool) -> str:
+    """Generate a selfie with Qwen on Replicate, download it and face swap it. Returns the image path."""
+    started_at = time.monotonic()
+    try:
+        image_url = await state.replicate_manager.generate_qwen_image(prompt, aspect_ratio="3:4")
+    
+        if not image_url:
+            raise HTTPException(status_code=500, detail="Failed to generate image with Qwen")
+    
+        # Download and save image
+        timestamp = unique_timestamp()
+        image_path = await download_media(image_url, f"qwen_image_{timestamp}.webp", "image", {"prompt": prompt})
+        logger.info(f"[Qwen Image Gen] Saved to: {image_path}")
+    
+        # Apply face swap (unless first_person_mode is enabled)
+        final_path = image_path
+        if not first_person_mode and state.image_manager:
+            logger.info("[Qwen Image Gen] Applying face swap...")
+            faceswap_path = await faceswap_if_face(image_path)
+            if faceswap_path:
+                final_path = faceswap_path
+                logger.info(f"[Qwen Image Gen] Face swap applied: {final_path}")
+            else:
+                logger.info("[Qwen Image Gen] No face swap applied, using original image")
+    except asyncio.CancelledError:
+        latency_tracker.record_cancelled("qwen", time.monotonic() - started_at)
+        raise
+
+    latency_tracker.record("qwen", time.monotonic() - started_at)
+    return final_path
+
+async def generate_image_fastest(spycam: bool = False):
+    """Generate a selfie prompt and render it with whichever of local SD / Qwen is faster."""
+    conversation = state.conversation_manager.get_conversation()
+    char_settings = characters.get(state.character_name, {})
+    pov_mode = char_settings.get("pov_mode", False)
+    first_person_mode = char_settings.get("first_person_mode", False)
+    
+    prompt = await state.image_manager.generate_selfie_prompt(conversation, pov_mode=pov_mode, first_person_mode=first_person_mode, spycam_mode=spycam)
+    if not prompt:
+        raise HTTPException(status_code=500, detail="Failed to generate image prompt")
+    return await render_selfie_fastest(prompt, first_person_mode)
+
+async def render_selfie_fastest(prompt: str, first_person_mode: bool):
+    """Race local SD against Qwen on Replicate and keep whichever image is ready first.
+
+    The backend expected to be faster (from recent latencies and the SD queue) starts
+    first; the other starts if no result arrives within the stagger, and the loser is
+    cancelled.
+    """
+    if not state.replicate_manager:
+        raise HTTPException(status_code=400, detail="Replicate manager not initialized")
+    
+    sd_mode = model_catalog.mode_for(HEDGE_SD_MODEL)
+    legs = {
+        "sd": lambda: render_sd_selfie(prompt, HEDGE_SD_MODEL, sd_mode, first_person_mode),
+        "qwen": lambda: render_qwen_selfie(prompt, first_person_mode),
+    }
+    # Requests already waiting for SD push its expected latency up, and Qwen's too:
+    # its face swap joins the same queue
+    queued = len(sd_queue.pending)
+    swap_wait = 0.0
+    if not first_person_mode and state.image_manager:
+        swap_wait = queued * (latency_tracker.percentile("sd", 50) or 0.0)
+    first, second, stagger = plan_hedge("sd", "qwen", primary_penalty=1 + queued, secondary_delay=swap_wait)
+    logger.info(f"[Fastest Image] {first} first, {second} after {f'{stagger:.1f}s' if stagger is not None else 'failure only'}")
+    
+    winner, result = await race([(first, legs[first]), (second, legs[second])], stagger)
+    if not winner:
+        raise HTTPException(status_code=500, detail="Failed to generate image with both local SD and Qwen")
+    
+    image_path = result[0] if winner == "sd" else result
+    state.conversation_manager.set_last_selfie_path(image_path)
+    relative_path = os.path.relpath(image_path, start=os.getcwd()).replace("\\", "/")
+    return {
+        "image_url": f"/{relative_path}",
+        "prompt": prompt,
+        "backend": winner
+    }
+
 async def generate_image_qwen():
     """Generate image using Qwen Image 2512 (cloud model via Replicate)."""
     if not state.replicate_manager:
@@ -573,39 +951,8 @@ async def generate_image_qwen():
     
     logger.info(f"[Qwen Image Gen] Prompt: {prompt[:100]}...")
     
-    # 2. Generate Image via Replicate
-    image_url = await state.replicate_manager.generate_qwen_image(prompt, aspect_ratio="3:4")
-    
-    if not image_url:
-        raise HTTPException(status_code=500, detail="Failed to generate image with Qwen")
-    
-    # 3. Download and save image
-    import aiohttp
-    async with aiohttp.ClientSession() as session:
-        async with session.get(image_url) as resp:
-            if resp.status == 200:
-                image_data = await resp.read()
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                image_filename = f"qwen_image_{timestamp}.webp"
-                image_path = os.path.join(state.conversation_manager.subfolder_path, image_filename)
-                
-                with open(image_path, "wb") as f:
-                    f.write(image_data)
-                    
-                logger.info(f"[Qwen Image Gen] Saved to: {image_path}")
-            else:
-                raise HTTPException(status_code=500, detail="Failed to download generated image")
-    
-    # 4. Apply face swap (unless first_person_mode is enabled)
-    final_path = image_path
-    if not first_person_mode and state.image_manager:
-        logger.info("[Qwen Image Gen] Applying face swap...")
-        faceswap_path = await state.image_manager.apply_faceswap(image_path)
-        if faceswap_path:
-            final_path = faceswap_path
-            logger.info(f"[Qwen Image Gen] Face swap applied: {final_path}")
-        else:
-            logger.warning("[Qwen Image Gen] Face swap failed, using original image")
+    # 2. Generate, download and face swap
+    final_path = await render_qwen_selfie(prompt, first_person_mode)
     
     # Update conversation manager
     state.conversation_manager.set_last_selfie_path(final_path)
@@ -619,7 +966,7 @@ async def generate_image_qwen():
         "prompt": prompt
     }
 
-async def generate_image_direct_qwen():
+async def generate_image_direct_qwen(force: bool = False):
     """Generate image using Qwen cloud model with prompt extracted from last bot message's delimited text."""
     if not state.replicate_manager:
         raise HTTPException(status_code=400, detail="Replicate manager not initialized")
@@ -659,6 +1006,10 @@ async def generate_image_direct_qwen():
         prompt = f"{image_prompt}, {prompt}"
         logger.info(f"[Qwen Direct Image] Combined prompt: {prompt[:100]}...")
     
+    reused = reuse_similar_image(prompt, "qwen-image-2512", force)
+    if reused:
+        return reused
+    
     # 4. Generate Image via Replicate Qwen
     image_url = await state.replicate_manager.generate_qwen_image(prompt, aspect_ratio="3:4")
     
@@ -666,36 +1017,25 @@ async def generate_image_direct_qwen():
         raise HTTPException(status_code=500, detail="Failed to generate image with Qwen")
     
     # 5. Download and save image
-    import aiohttp
-    async with aiohttp.ClientSession() as session:
-        async with session.get(image_url) as resp:
-            if resp.status == 200:
-                image_data = await resp.read()
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                image_filename = f"qwen_direct_{timestamp}.webp"
-                image_path = os.path.join(state.conversation_manager.subfolder_path, image_filename)
-                
-                with open(image_path, "wb") as f:
-                    f.write(image_data)
-                    
-                logger.info(f"[Qwen Direct Image] Saved to: {image_path}")
-            else:
-                raise HTTPException(status_code=500, detail="Failed to download generated image")
+    timestamp = unique_timestamp()
+    image_path = await download_media(image_url, f"qwen_direct_{timestamp}.webp", "image", {"prompt": prompt})
+    logger.info(f"[Qwen Direct Image] Saved to: {image_path}")
     
     # 6. Apply face swap (unless first_person_mode is enabled)
     final_path = image_path
     if not first_person_mode and state.image_manager:
         logger.info("[Qwen Direct Image] Applying face swap...")
-        faceswap_path = await state.image_manager.apply_faceswap(image_path)
+        faceswap_path = await faceswap_if_face(image_path)
         if faceswap_path:
             final_path = faceswap_path
             logger.info(f"[Qwen Direct Image] Face swap applied: {final_path}")
         else:
-            logger.warning("[Qwen Direct Image] Face swap failed, using original image")
+            logger.info("[Qwen Direct Image] No face swap applied, using original image")
     
     # Update conversation manager
     state.conversation_manager.set_last_selfie_path(final_path)
     logger.info(f"[Qwen Direct Image] Set last_selfie_path to: {final_path}")
+    await prompt_cache.add(state.conversation_manager.session_id, "qwen-image-2512", prompt, final_path)
     
     relative_path = os.path.relpath(final_path, start=os.getcwd())
     relative_path = relative_path.replace("\\", "/")
@@ -706,22 +1046,22 @@ async def generate_image_direct_qwen():
     }
 
 @app.post("/api/generate/image/direct")
-async def generate_image_direct(model: str = "z-image-turbo"):
-    """Generate image using prompt extracted directly from the last bot message's delimited text."""
+@cancellable_job("image")
+async def generate_image_direct(model: str = "z-image-turbo", force: bool = False):
+    """Generate image using prompt extracted directly from the last bot message's delimited text.
+
+    With the prompt cache enabled, a near-identical recent prompt reuses its image
+    (response has "reused": true) unless force is set.
+    """
     if not state.image_manager:
         raise HTTPException(status_code=400, detail="Session not initialized")
     
     # Check if cloud model (Qwen)
     if model == "qwen-image-2512":
-        return await generate_image_direct_qwen()
+        return await generate_image_direct_qwen(force)
     
-    # Dynamic model detection based on filename prefix
-    # zImage*, z_image*, z-image* (any casing) → lumina mode, all else → xl mode
-    model_lower = model.lower()
-    if model_lower.startswith("zimage") or model_lower.startswith("z_image") or model_lower.startswith("z-image"):
-        sd_mode = "lumina"
-    else:
-        sd_mode = "xl"
+    # Lumina vs XL mode from the checkpoint's header (filename prefix if unknown)
+    sd_mode = model_catalog.mode_for(model)
     
     # Always pass the checkpoint filename (model value is already full filename with extension)
     sd_checkpoint = model
@@ -761,25 +1101,37 @@ async def generate_image_direct(model: str = "z-image-turbo"):
         prompt = f"{image_prompt}, {prompt}"
         logger.info(f"[Direct Image] Combined prompt: {prompt[:100]}...")
     
+    reused = reuse_similar_image(prompt, sd_checkpoint, force)
+    if reused:
+        return reused
+    
+    if model == "fastest":
+        response = await render_selfie_fastest(prompt, first_person_mode)
+        await prompt_cache.add(state.conversation_manager.session_id, model, prompt, os.path.join(os.getcwd(), response["image_url"].lstrip('/')))
+        return response
+    
     # 4. Generate Image
-    image_data = await state.image_manager.generate_image(prompt, first_person_mode=first_person_mode, sd_mode=sd_mode, sd_checkpoint=sd_checkpoint)
+    result = await state.image_manager.generate_image(prompt, first_person_mode=first_person_mode, sd_mode=sd_mode, sd_checkpoint=sd_checkpoint)
     
-    if not image_data:
+    if not result:
         raise HTTPException(status_code=500, detail="Failed to generate image")
     
     # 5. Save Image
-    image_path = await state.image_manager.save_image(image_data)
+    image_path = await save_sd_image(result, {"prompt": prompt, "checkpoint": sd_checkpoint, "sd_mode": sd_mode, "first_person_mode": first_person_mode})
     state.conversation_manager.set_last_selfie_path(image_path)
+    await prompt_cache.add(state.conversation_manager.session_id, sd_checkpoint, prompt, image_path)
     
     relative_path = os.path.relpath(image_path, start=os.getcwd())
     relative_path = relative_path.replace("\\", "/")
     
     return {
         "image_url": f"/{relative_path}",
-        "prompt": prompt
+        "prompt": prompt,
+        "seed": result["seed"]
     }
 
 @app.post("/api/generate/video")
+@cancellable_job("video")
 async def generate_video():
     if not state.replicate_manager:
         raise HTTPException(status_code=400, detail="Session not initialized")
@@ -813,19 +1165,8 @@ async def generate_video():
     video_url = output[0] if isinstance(output, list) else output
     
     # 4. Download Video
-    import aiohttp
-    async with aiohttp.ClientSession() as session:
-        async with session.get(video_url) as resp:
-            if resp.status == 200:
-                video_data = await resp.read()
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                video_filename = f"video_{timestamp}.mp4"
-                video_path = os.path.join(state.conversation_manager.subfolder_path, video_filename)
-                
-                with open(video_path, "wb") as f:
-                    f.write(video_data)
-            else:
-                raise HTTPException(status_code=500, detail="Failed to download generated video")
+    timestamp = unique_timestamp()
+    video_path = await download_media(video_url, f"video_{timestamp}.mp4", "video", {"prompt": prompt})
     
     # 5. Return relative path
     relative_path = os.path.relpath(video_path, start=os.getcwd())
@@ -837,6 +1178,7 @@ async def generate_video():
     }
 
 @app.post("/api/generate/video/wavespeed")
+@cancellable_job("video")
 async def generate_video_wavespeed(model: str = "infinitetalk"):
     """Generate video with specified model. Options: wan, infinitetalk, infinitetalk-fast, hunyuan-avatar"""
     
@@ -884,19 +1226,8 @@ async def generate_video_wavespeed(model: str = "infinitetalk"):
         raise HTTPException(status_code=500, detail=f"Failed to generate video with {model}")
     
     # 4. Download Video
-    import aiohttp
-    async with aiohttp.ClientSession() as session:
-        async with session.get(video_url) as resp:
-            if resp.status == 200:
-                video_data = await resp.read()
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                video_filename = f"{model}_video_{timestamp}.mp4"
-                video_path = os.path.join(state.conversation_manager.subfolder_path, video_filename)
-                
-                with open(video_path, "wb") as f:
-                    f.write(video_data)
-            else:
-                raise HTTPException(status_code=500, detail="Failed to download generated video")
+    timestamp = unique_timestamp()
+    video_path = await download_media(video_url, f"{model}_video_{timestamp}.mp4", "video", {"prompt": prompt, "model": model})
     
     # 5. Return relative path
     relative_path = os.path.relpath(video_path, start=os.getcwd())
@@ -920,6 +1251,7 @@ class LoraVideoRequest(BaseModel):
     use_preview_image: bool = False  # If true, use the most recently generated image
 
 @app.post("/api/generate/video/lora")
+@cancellable_job("video")
 async def generate_video_lora(request: LoraVideoRequest):
     """Generate video using WAN with a custom LoRA."""
     
@@ -967,19 +1299,8 @@ async def generate_video_lora(request: LoraVideoRequest):
     video_url = output[0] if isinstance(output, list) else output
     
     # 3. Download Video
-    import aiohttp
-    async with aiohttp.ClientSession() as session:
-        async with session.get(video_url) as resp:
-            if resp.status == 200:
-                video_data = await resp.read()
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                video_filename = f"lora_video_{timestamp}.mp4"
-                video_path = os.path.join(state.conversation_manager.subfolder_path, video_filename)
-                
-                with open(video_path, "wb") as f:
-                    f.write(video_data)
-            else:
-                raise HTTPException(status_code=500, detail="Failed to download generated video")
+    timestamp = unique_timestamp()
+    video_path = await download_media(video_url, f"lora_video_{timestamp}.mp4", "video", {"prompt": request.prompt, "model": request.wan_model})
     
     # 4. Return relative path
     relative_path = os.path.relpath(video_path, start=os.getcwd())
@@ -991,6 +1312,7 @@ async def generate_video_lora(request: LoraVideoRequest):
     }
 
 @app.post("/api/generate/lipsync")
+@cancellable_job("lipsync")
 async def generate_lipsync(model: str = "veed"):
     """Lipsync last video with last audio. Models: veed (default), kling (relaxed), pixverse (express)."""
     
@@ -1031,22 +1353,11 @@ async def generate_lipsync(model: str = "veed"):
         raise HTTPException(status_code=500, detail=f"Failed to generate lipsync with {model}")
     
     # Download the video
-    import aiohttp
-    async with aiohttp.ClientSession() as session:
-        async with session.get(video_url) as resp:
-            if resp.status == 200:
-                video_data = await resp.read()
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                video_filename = f"lipsync_{model}_{timestamp}.mp4"
-                output_path = os.path.join(state.conversation_manager.subfolder_path, video_filename)
-                
-                with open(output_path, "wb") as f:
-                    f.write(video_data)
-                    
-                # Set as last video for continuity
-                state.conversation_manager.set_last_video_path(output_path)
-            else:
-                raise HTTPException(status_code=500, detail="Failed to download lipsynced video")
+    timestamp = unique_timestamp()
+    output_path = await download_media(video_url, f"lipsync_{model}_{timestamp}.mp4", "video", {"model": model})
+
+    # Set as last video for continuity
+    state.conversation_manager.set_last_video_path(output_path)
     
     relative_path = os.path.relpath(output_path, start=os.getcwd())
     relative_path = relative_path.replace("\\", "/")
@@ -1080,6 +1391,7 @@ async def generate_ltx_prompt(style: Optional[str] = None):
     return {"prompt": prompt}
 
 @app.post("/api/generate/ltx-video")
+@cancellable_job("video")
 async def generate_ltx_video(request: LTXVideoRequest):
     """Generate video with audio using LTX-2 Distilled model."""
     
@@ -1113,23 +1425,12 @@ async def generate_ltx_video(request: LTXVideoRequest):
         raise HTTPException(status_code=500, detail="Failed to generate LTX-2 video")
     
     # Download video
-    import aiohttp
-    async with aiohttp.ClientSession() as session:
-        async with session.get(video_url) as resp:
-            if resp.status == 200:
-                video_data = await resp.read()
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                video_filename = f"ltx_video_{timestamp}.mp4"
-                video_path = os.path.join(state.conversation_manager.subfolder_path, video_filename)
-                
-                with open(video_path, "wb") as f:
-                    f.write(video_data)
-                    
-                # Set as last video for chaining (lipsync, etc)
-                state.conversation_manager.set_last_video_path(video_path)
-                logger.info(f"[LTX Video] Saved to: {video_path}")
-            else:
-                raise HTTPException(status_code=500, detail="Failed to download generated video")
+    timestamp = unique_timestamp()
+    video_path = await download_media(video_url, f"ltx_video_{timestamp}.mp4", "video", {"prompt": request.prompt})
+
+    # Set as last video for chaining (lipsync, etc)
+    state.conversation_manager.set_last_video_path(video_path)
+    logger.info(f"[LTX Video] Saved to: {video_path}")
     
     relative_path = os.path.relpath(video_path, start=os.getcwd())
     relative_path = relative_path.replace("\\", "/")
@@ -1151,54 +1452,19 @@ class SyncLorasRequest(BaseModel):
 
 @app.post("/api/sync/loras")
 async def sync_loras(request: SyncLorasRequest):
-    """Download LoRA files to custom_loras folder for backup."""
-    import aiohttp
-    import urllib.parse
-    
-    # Create custom_loras folder if it doesn't exist
-    loras_folder = os.path.join(os.getcwd(), "custom_loras")
-    os.makedirs(loras_folder, exist_ok=True)
-    
-    downloaded = 0
-    skipped = 0
-    
-    async with aiohttp.ClientSession() as session:
-        for lora in request.loras:
-            # Extract filename from URL
-            parsed_url = urllib.parse.urlparse(lora.url)
-            filename = os.path.basename(urllib.parse.unquote(parsed_url.path))
-            
-            # Use preset name if filename is unclear
-            if not filename or not filename.endswith('.safetensors'):
-                filename = f"{lora.name}.safetensors"
-            
-            filepath = os.path.join(loras_folder, filename)
-            
-            # Skip if already exists
-            if os.path.exists(filepath):
-                logger.info(f"[Sync] Skipping {filename} - already exists")
-                skipped += 1
-                continue
-            
-            try:
-                logger.info(f"[Sync] Downloading {filename}...")
-                async with session.get(lora.url) as resp:
-                    if resp.status == 200:
-                        content = await resp.read()
-                        with open(filepath, 'wb') as f:
-                            f.write(content)
-                        logger.info(f"[Sync] Downloaded {filename} ({len(content) / 1024 / 1024:.1f} MB)")
-                        downloaded += 1
-                    else:
-                        logger.error(f"[Sync] Failed to download {filename}: HTTP {resp.status}")
-            except Exception as e:
-                logger.error(f"[Sync] Error downloading {filename}: {e}")
-    
-    return {
-        "downloaded": downloaded,
-        "skipped": skipped,
-        "folder": loras_folder
-    }
+    """Start downloading LoRA files to the custom_loras folder for backup.
+
+    Runs in the background; poll /api/sync/loras/status for progress.
+    """
+    if state.lora_sync.is_running():
+        raise HTTPException(status_code=409, detail="LoRA sync already in progress")
+    return state.lora_sync.start([lora.dict() for lora in request.loras])
+
+
+@app.get("/api/sync/loras/status")
+async def sync_loras_status():
+    """Get progress of the current (or last) LoRA sync."""
+    return state.lora_sync.get_status()
 
 class SceneItem(BaseModel):
     url: str
@@ -1210,9 +1476,6 @@ class CompileStoryRequest(BaseModel):
 @app.post("/api/compile-story")
 async def compile_story(request: CompileStoryRequest):
     """Compile multiple images/videos into a single story video using FFmpeg."""
-    import subprocess
-    import tempfile
-    
     if not request.scenes or len(request.scenes) < 2:
         raise HTTPException(status_code=400, detail="Need at least 2 items to compile")
     
@@ -1236,103 +1499,41 @@ async def compile_story(request: CompileStoryRequest):
         })
         logger.info(f"[Compile Story] Added {scene.mediaType}: {absolute_path}")
     
-    # Check if we have any images
-    has_images = any(s['mediaType'] == 'image' for s in scenes)
-    
-    # Target resolution for all content
-    TARGET_WIDTH = 1280
-    TARGET_HEIGHT = 720
-    SCALE_FILTER = f"scale={TARGET_WIDTH}:{TARGET_HEIGHT}:force_original_aspect_ratio=decrease,pad={TARGET_WIDTH}:{TARGET_HEIGHT}:(ow-iw)/2:(oh-ih)/2,fps=30"
-    
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = unique_timestamp()
         output_filename = f"story_{timestamp}.mp4"
         output_path = os.path.join(state.conversation_manager.subfolder_path, output_filename)
         
-        # Always pre-process all scenes to normalize resolution
-        temp_videos = []
-        
-        for i, scene in enumerate(scenes):
-            temp_video = os.path.join(tempfile.gettempdir(), f"scene_{timestamp}_{i}.mp4")
-            
-            if scene['mediaType'] == 'image':
-                # Convert image to 2s video at target resolution
-                cmd = [
-                    "ffmpeg", "-y",
-                    "-loop", "1",
-                    "-i", scene['path'],
-                    "-c:v", "libx264",
-                    "-t", "2",  # 2 seconds
-                    "-pix_fmt", "yuv420p",
-                    "-vf", SCALE_FILTER,
-                    temp_video
-                ]
-                subprocess.run(cmd, capture_output=True, timeout=30)
-                temp_videos.append({'path': temp_video, 'temp': True})
-            else:
-                # Normalize video to target resolution
-                cmd = [
-                    "ffmpeg", "-y",
-                    "-i", scene['path'],
-                    "-c:v", "libx264",
-                    "-preset", "fast",
-                    "-crf", "23",
-                    "-pix_fmt", "yuv420p",
-                    "-vf", SCALE_FILTER,
-                    "-c:a", "aac",
-                    "-b:a", "128k",
-                    temp_video
-                ]
-                result = subprocess.run(cmd, capture_output=True, timeout=120)
-                if result.returncode == 0:
-                    temp_videos.append({'path': temp_video, 'temp': True})
-                else:
-                    # Fallback: use original if scaling fails
-                    logger.warning(f"[Compile Story] Failed to scale video {i}, using original")
-                    temp_videos.append({'path': scene['path'], 'temp': False})
-        
-        # Concatenate all normalized clips
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
-            concat_file = f.name
-            for tv in temp_videos:
-                escaped_path = tv['path'].replace("\\", "/").replace("'", "'\\''")
-                f.write(f"file '{escaped_path}'\n")
-        
-        cmd = [
-            "ffmpeg", "-y",
-            "-f", "concat",
-            "-safe", "0",
-            "-i", concat_file,
-            "-c", "copy",  # Stream copy since already encoded
-            output_path
-        ]
-        
-        logger.info(f"[Compile Story] Concatenating {len(temp_videos)} normalized clips to {TARGET_WIDTH}x{TARGET_HEIGHT}...")
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
-        
-        # Clean up temp files
-        os.unlink(concat_file)
-        for tv in temp_videos:
-            if tv['temp'] and os.path.exists(tv['path']):
-                os.unlink(tv['path'])
-        
-        if result.returncode != 0:
-            logger.error(f"[Compile Story] FFmpeg error: {result.stderr}")
-            raise HTTPException(status_code=500, detail=f"FFmpeg failed: {result.stderr[:200]}")
+        # Stream-copy conforming clips, re-encode the rest (reusing earlier encodes) and concatenate
+        stats = await state.story_compiler.compile(scenes, output_path)
+        # Recompiling the same scenes gives the same file; keep one copy
+        stored = await blob_store.ingest(output_path)
+        if stored:
+            state.media_registry.record(output_path, media_type="video",
+                                        session_id=state.conversation_manager.session_id,
+                                        size=stored["size"], sha256=stored["sha256"])
         
         logger.info(f"[Compile Story] Success! Output: {output_path}")
+        schedule_derived_assets(output_path)
+        hls_task = asyncio.create_task(build_story_hls(output_path))
+        state.background_tasks.add(hls_task)
+        hls_task.add_done_callback(state.background_tasks.discard)
         
         relative_path = os.path.relpath(output_path, start=os.getcwd())
         relative_path = relative_path.replace("\\", "/")
         
         return {
             "video_url": f"/{relative_path}",
-            "clips_count": len(scenes)
+            "clips_count": len(scenes),
+            "compile": stats
         }
         
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         logger.error("[Compile Story] FFmpeg timeout")
         raise HTTPException(status_code=500, detail="Video compilation timed out")
+    except StoryCompileError as e:
+        logger.error(f"[Compile Story] {e}")
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         logger.error(f"[Compile Story] Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1340,11 +1541,33 @@ async def compile_story(request: CompileStoryRequest):
 class ExtractFrameRequest(BaseModel):
     video_url: str
 
+async def extract_and_swap_last_frame(video_path: str, is_voy_mode: bool) -> str:
+    """Extract a video's last frame now and face-swap it (unless VOY mode). Returns the image path."""
+    logger.info(f"[Extract Frame] Extracting last frame from: {video_path}")
+    timestamp = unique_timestamp()
+    output_path = os.path.join(state.conversation_manager.subfolder_path, f"frame_{timestamp}.png")
+
+    # Sharpest of the last few frames (interactive, so it goes ahead of batch compiles)
+    picked = await extract_last_frame(video_path, output_path, state.prober)
+    if not picked:
+        raise HTTPException(status_code=500, detail="Failed to extract frame")
+
+    logger.info(f"[Extract Frame] Frame extracted: {output_path} ({picked['frames_from_end']} frame(s) from the end of {picked['candidates']})")
+
+    if state.image_manager and not is_voy_mode:
+        logger.info("[Extract Frame] Applying face swap...")
+        faceswap_path = await faceswap_if_face(output_path)
+        if faceswap_path:
+            logger.info(f"[Extract Frame] Face swap applied: {faceswap_path}")
+            return faceswap_path
+        logger.info("[Extract Frame] No face swap applied, using original frame")
+    elif is_voy_mode:
+        logger.info("[Extract Frame] VOY mode - skipping face swap")
+    return output_path
+
 @app.post("/api/extract-frame")
 async def extract_frame(request: ExtractFrameRequest):
     """Extract the last frame of a video and set it as the current image."""
-    import subprocess
-    
     if not state.conversation_manager:
         raise HTTPException(status_code=400, detail="Session not initialized")
     
@@ -1355,49 +1578,26 @@ async def extract_frame(request: ExtractFrameRequest):
     if not os.path.exists(video_path):
         raise HTTPException(status_code=400, detail=f"Video not found: {request.video_url}")
     
-    logger.info(f"[Extract Frame] Extracting last frame from: {video_path}")
-    
+    char_data = characters.get(state.character_name, {})
+    is_voy_mode = char_data.get("voy_mode", False)
+
     try:
-        # Output path
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"frame_{timestamp}.png"
-        output_path = os.path.join(state.conversation_manager.subfolder_path, output_filename)
-        
-        # Use FFmpeg to extract last frame
-        # First get video duration, then seek to near end
-        cmd = [
-            "ffmpeg", "-y",
-            "-sseof", "-0.1",  # Seek to 0.1s before end
-            "-i", video_path,
-            "-vframes", "1",
-            "-q:v", "2",
-            output_path
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode != 0 or not os.path.exists(output_path):
-            logger.error(f"[Extract Frame] FFmpeg error: {result.stderr}")
-            raise HTTPException(status_code=500, detail="Failed to extract frame")
-        
-        logger.info(f"[Extract Frame] Frame extracted: {output_path}")
-        
-        # Apply face swap using ReActor (if image_manager is available)
-        # Skip faceswap if character is in VOY mode
-        final_path = output_path
-        char_data = characters.get(state.character_name, {})
-        is_voy_mode = char_data.get("voy_mode", False)
-        
-        if state.image_manager and not is_voy_mode:
-            logger.info("[Extract Frame] Applying face swap...")
-            faceswap_path = await state.image_manager.apply_faceswap(output_path)
-            if faceswap_path:
-                final_path = faceswap_path
-                logger.info(f"[Extract Frame] Face swap applied: {final_path}")
-            else:
-                logger.warning("[Extract Frame] Face swap failed, using original frame")
-        elif is_voy_mode:
-            logger.info("[Extract Frame] VOY mode - skipping face swap")
+        # Usually already extracted (and face-swapped) in the background when the video arrived;
+        # an in-flight build is only waited on up to the stage this request needs, not the poster and sprite
+        swap_wanted = bool(state.image_manager) and not is_voy_mode
+        derived = await state.derived_assets.get(video_path, until="last_frame_swapped" if swap_wanted else "last_frame")
+        if derived and derived.get("last_frame") and os.path.exists(derived["last_frame"]):
+            logger.info(f"[Extract Frame] Using pre-extracted last frame of: {video_path}")
+            final_path = derived["last_frame"]
+            if swap_wanted:
+                swapped = derived.get("last_frame_swapped")  # None when the face gate skipped the swap
+                if derived.get("swapped_for") == state.character_name and (swapped is None or os.path.exists(swapped)):
+                    final_path = swapped or final_path
+                else:
+                    # Swapped for another character (or not at all) when extracted - swap now
+                    final_path = await faceswap_if_face(final_path) or final_path
+        else:
+            final_path = await extract_and_swap_last_frame(video_path, is_voy_mode)
         
         # Set as last selfie path for next video generation
         state.conversation_manager.set_last_selfie_path(final_path)
@@ -1409,7 +1609,7 @@ async def extract_frame(request: ExtractFrameRequest):
             "image_url": f"/{relative_path}"
         }
         
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         raise HTTPException(status_code=500, detail="Frame extraction timed out")
     except Exception as e:
         logger.error(f"[Extract Frame] Error: {e}")
@@ -1513,10 +1713,16 @@ async def export_conversation():
             # Sort by creation time (chronological order)
             all_files.sort(key=lambda x: x[2])
             
-            # Add files to ZIP with sequential prefixes
+            # Add files to ZIP with sequential prefixes; files linked to the same blob go in once
+            zip_names = []
+            written = {}  # (device, inode) -> name in the ZIP
             for i, (filename, full_path, _) in enumerate(all_files, 1):
-                new_filename = f"{i:03d}_{filename}"
-                zip_file.write(full_path, arcname=new_filename)
+                stat = os.stat(full_path)
+                blob_key = (stat.st_dev, stat.st_ino)
+                if blob_key not in written:
+                    written[blob_key] = f"{i:03d}_{filename}"
+                    zip_file.write(full_path, arcname=written[blob_key])
+                zip_names.append((filename, written[blob_key]))
             
             # Generate standalone gallery.html
             gallery_html = f"""<!DOCTYPE html>
@@ -1564,8 +1770,7 @@ async def export_conversation():
         <h2>📸 Media Gallery</h2>
         <div class="media-grid">
 """
-            for i, (filename, _, _) in enumerate(all_files, 1):
-                zip_filename = f"{i:03d}_{filename}"
+            for filename, zip_filename in zip_names:
                 if filename.endswith(('.png', '.jpg', '.jpeg')):
                     gallery_html += f'<div class="media-item"><img src="{zip_filename}"><div class="media-label">{zip_filename}</div></div>\n'
                 elif filename.endswith('.mp3') or filename.endswith('.wav'):
@@ -1655,6 +1860,7 @@ class EditImageRequest(BaseModel):
     prompt: str     # Edit instruction
 
 @app.post("/api/edit/image")
+@cancellable_job("image_edit")
 async def edit_image(request: EditImageRequest):
     """Edit an image using Qwen Image Edit 2511 via Replicate."""
     if not state.replicate_manager:
@@ -1671,42 +1877,19 @@ async def edit_image(request: EditImageRequest):
     if not os.path.exists(absolute_path):
         raise HTTPException(status_code=400, detail=f"Image not found: {request.image_url}")
     
-    # For Replicate, we need a publicly accessible URL
-    # Upload the image to Replicate first using base64 data URI
-    import base64
-    with open(absolute_path, "rb") as f:
-        image_data = base64.b64encode(f.read()).decode('utf-8')
-    
-    # Determine mime type from extension
-    ext = os.path.splitext(absolute_path)[1].lower()
-    mime_types = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.webp': 'image/webp'}
-    mime_type = mime_types.get(ext, 'image/png')
-    
-    # Create data URI for the image
-    image_data_uri = f"data:{mime_type};base64,{image_data}"
-    
+    # For Replicate, we need a URL - upload via the files API (cached by content hash)
+    image_url = await state.replicate_manager.upload_file(absolute_path)
+
     # Call the edit method
-    edited_url = await state.replicate_manager.edit_image(image_data_uri, request.prompt)
+    edited_url = await state.replicate_manager.edit_image(image_url, request.prompt)
     
     if not edited_url:
         raise HTTPException(status_code=500, detail="Failed to edit image")
     
     # Download the edited image
-    import aiohttp
-    async with aiohttp.ClientSession() as session:
-        async with session.get(edited_url) as resp:
-            if resp.status == 200:
-                edited_data = await resp.read()
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                edited_filename = f"edited_image_{timestamp}.webp"
-                edited_path = os.path.join(state.conversation_manager.subfolder_path, edited_filename)
-                
-                with open(edited_path, "wb") as f:
-                    f.write(edited_data)
-                    
-                logger.info(f"[Image Edit] Saved edited image to: {edited_path}")
-            else:
-                raise HTTPException(status_code=500, detail="Failed to download edited image")
+    timestamp = unique_timestamp()
+    edited_path = await download_media(edited_url, f"edited_image_{timestamp}.webp", "image", {"prompt": request.prompt})
+    logger.info(f"[Image Edit] Saved edited image to: {edited_path}")
     
     result_relative = os.path.relpath(edited_path, start=os.getcwd())
     result_relative = result_relative.replace("\\", "/")
@@ -1716,78 +1899,106 @@ async def edit_image(request: EditImageRequest):
         "prompt": request.prompt
     }
 
+# source_faces_folder -> (folder mtime, first image), so listing faces doesn't rescan every folder
+_face_previews: Dict[str, Any] = {}
+
+def face_preview_image(source_folder: Optional[str]) -> Optional[str]:
+    """First reference image in a faces folder (rescanned only when the folder changes)."""
+    if not source_folder or not os.path.isdir(source_folder):
+        return None
+    mtime = os.stat(source_folder).st_mtime
+    cached = _face_previews.get(source_folder)
+    if cached and cached[0] == mtime and (cached[1] is None or os.path.exists(cached[1])):
+        return cached[1]
+    images = sorted(
+        name for name in os.listdir(source_folder)
+        if name.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))
+    )
+    preview = os.path.join(source_folder, images[0]) if images else None
+    _face_previews[source_folder] = (mtime, preview)
+    return preview
+
+async def thumbnail_response(request: Request, source: str, size: str) -> Response:
+    """A cached thumbnail of an image, revalidated by ETag (immutable when ?v= matches)."""
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=404, detail=f"Unknown thumbnail size: {size}")
+    path = await thumbnails.get(source, size)
+    if not path:
+        raise HTTPException(status_code=404, detail="Could not make a thumbnail of that image")
+    version = ThumbnailService.version(source)
+    etag = f'"{version}-{size}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable" if request.query_params.get("v") == version else "no-cache",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/webp", headers=headers)
+
+@app.get("/api/thumbnails/{size}/{file_path:path}")
+async def get_thumbnail(request: Request, size: str, file_path: str):
+    """Thumbnail of a session image under /output (size: small, medium or large)."""
+    source = state.media_files.resolve(file_path)
+    if source is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return await thumbnail_response(request, source, size)
+
 @app.get("/api/characters/faces")
 async def get_character_faces():
     """Get all characters with reference images for face picker modal."""
-    import glob
-    
+    from urllib.parse import quote
+
     faces = []
-    cwd = os.getcwd()
-    
     # Get faces from all character definitions that have source_faces_folder
     for char_name, char_data in characters.items():
         source_folder = char_data.get("source_faces_folder")
-        if source_folder and os.path.exists(source_folder):
-            # Find first image in folder
-            images = []
-            for ext in ["*.png", "*.jpg", "*.jpeg", "*.webp"]:
-                images.extend(glob.glob(os.path.join(source_folder, ext)))
-            
-            if images:
-                # Use first image as preview
-                preview_path = images[0]
-                
-                # Try to make a relative URL, fallback to dynamic API endpoint
-                try:
-                    relative_preview = os.path.relpath(preview_path, start=cwd)
-                    preview_url = "/" + relative_preview.replace("\\", "/")
-                except ValueError:
-                    # Cross-drive path on Windows - use dynamic API endpoint
-                    # URL-encode character name for safety
-                    from urllib.parse import quote
-                    preview_url = f"/api/face-image/{quote(char_name, safe='')}"
-                
-                faces.append({
-                    "name": char_name,
-                    "preview_url": preview_url,
-                    "folder_path": source_folder
-                })
-    
+        preview_path = face_preview_image(source_folder)
+        if preview_path:
+            # Served through the API so folders on other drives work too
+            image_url = f"/api/face-image/{quote(char_name, safe='')}"
+            faces.append({
+                "name": char_name,
+                "preview_url": f"{image_url}?size=small&v={ThumbnailService.version(preview_path)}",
+                "image_url": image_url,
+                "folder_path": source_folder
+            })
+
     logger.info(f"[FacePicker] Found {len(faces)} characters with faces: {[f['name'] for f in faces]}")
     return {"faces": faces}
 
 @app.get("/api/face-image/{character_name}")
-async def get_face_image(character_name: str):
-    """Serve a character's face preview image from their source_faces_folder (supports cross-drive paths)."""
-    import glob
-    from fastapi.responses import FileResponse
+async def get_face_image(request: Request, character_name: str, size: Optional[str] = None):
+    """Serve a character's face preview image from their source_faces_folder (supports cross-drive paths).
+
+    With ?size= (small, medium or large) a cached thumbnail is served instead of the full image.
+    """
     from urllib.parse import unquote
-    
+
     char_name = unquote(character_name)
     char_data = characters.get(char_name)
-    
+
     if not char_data:
         raise HTTPException(status_code=404, detail=f"Character not found: {char_name}")
-    
+
     source_folder = char_data.get("source_faces_folder")
     if not source_folder or not os.path.exists(source_folder):
         raise HTTPException(status_code=404, detail=f"No source faces folder for: {char_name}")
-    
-    # Find first image in folder
-    images = []
-    for ext in ["*.png", "*.jpg", "*.jpeg", "*.webp"]:
-        images.extend(glob.glob(os.path.join(source_folder, ext)))
-    
-    if not images:
+
+    preview_path = face_preview_image(source_folder)
+    if not preview_path:
         raise HTTPException(status_code=404, detail=f"No images found in folder for: {char_name}")
-    
-    return FileResponse(images[0])
+
+    if size:
+        return await thumbnail_response(request, preview_path, size)
+    return FileResponse(preview_path)
 
 class FaceswapRequest(BaseModel):
     image_url: str  # Relative URL like /conversations/.../image.png
     source_character: Optional[str] = None  # If provided, use this character's face instead of current
 
 @app.post("/api/faceswap")
+@cancellable_job("faceswap")
 async def faceswap_image(request: FaceswapRequest):
     """Apply face swap to any image using ReActor via local SD."""
     if not state.image_manager:
@@ -1829,6 +2040,98 @@ async def faceswap_image(request: FaceswapRequest):
         "image_url": f"/{result_relative}"
     }
 
+@app.get("/api/sd/backends")
+async def get_sd_backends():
+    """Health, loaded checkpoint and load of each Stable Diffusion backend."""
+    return {"backends": sd_pool.status()}
+
+@app.get("/api/sd/face-models")
+async def get_face_models():
+    """ReActor face models built from character faces folders, per backend."""
+    return {"face_models": face_models.status()}
+
+@app.get("/api/metrics/latency")
+async def get_latency_metrics():
+    """Recent image generation latency per backend, as used by the fastest mode."""
+    return {"backends": latency_tracker.status()}
+
+@app.get("/api/metrics/prompt-cache")
+async def get_prompt_cache_metrics():
+    """Prompt cache threshold, lookups, hits and hit rate."""
+    return prompt_cache.metrics()
+
+@app.get("/api/sd/queue")
+async def get_sd_queue():
+    """Pending and running Stable Diffusion requests."""
+    return sd_queue.status()
+
+@app.get("/api/media/derived")
+async def get_derived_media(url: str, wait: bool = False, until: Optional[str] = None):
+    """Poster, last frame and seek-thumbnail sprite of a video, once extracted.
+
+    Args:
+        url: Video URL as returned by the generate endpoints
+        wait: Wait for an extraction that is still running instead of reporting "pending"
+        until: With wait, answer once this asset ("last_frame" or "poster") is ready;
+            "building" in the response then says whether the rest is still coming
+    """
+    if until not in (None, "last_frame", "poster"):
+        raise HTTPException(status_code=400, detail=f"Unknown asset: {until}")
+    video_path = os.path.realpath(os.path.join(os.getcwd(), url.lstrip('/')))
+    if not video_path.startswith(os.path.realpath(os.getcwd()) + os.sep) or not os.path.exists(video_path):
+        raise HTTPException(status_code=404, detail=f"Video not found: {url}")
+
+    derived = await state.derived_assets.get(video_path, wait=wait, until=until)
+    if not derived:
+        if not state.derived_assets.enabled:
+            return {"status": "disabled"}
+        # Older videos get their assets on first request; the face swap waits for "Use Last Frame"
+        schedule_derived_assets(video_path, swap_last_frame=False)
+        return {"status": "pending"}
+    sprite = derived.get("sprite")
+    entry = state.media_registry.get(video_path)
+    hls = entry["metadata"].get("hls") if entry else None
+    # Versioned URLs, so browsers keep these small files as immutable
+    return {
+        "status": "ready",
+        "building": state.derived_assets.building(video_path),
+        "hls_url": media_url(hls) if hls and os.path.exists(hls) else None,
+        "poster_url": await state.media_files.versioned_url(derived.get("poster")),
+        "last_frame_url": await state.media_files.versioned_url(derived.get("last_frame")),
+        "sprite": {
+            **{k: v for k, v in sprite.items() if k != "path"},
+            "url": await state.media_files.versioned_url(sprite["path"]),
+        } if sprite else None,
+    }
+
+@app.get("/api/media/jobs")
+async def get_media_jobs():
+    """Running, queued and recent FFmpeg / CPU media jobs with progress and CPU time."""
+    return media_workers.status()
+
+@app.get("/api/media/jobs/{media_job_id}")
+async def get_media_job(media_job_id: int):
+    """Progress and CPU time of one media job."""
+    job = media_workers.get(media_job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="No media job with that id")
+    return job
+
+@app.get("/api/jobs")
+async def list_jobs():
+    """List running and recently finished generation jobs."""
+    jobs = state.jobs.list_jobs()
+    for job in jobs:
+        job["queue_position"] = sd_queue.job_position(job["id"])
+    return {"jobs": jobs}
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Cancel a running generation job (and the remote work behind it)."""
+    if not state.jobs.cancel(job_id):
+        raise HTTPException(status_code=404, detail="No running job with that id")
+    return {"status": "cancelled", "job_id": job_id}
+
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
@@ -1836,7 +2139,8 @@ async def health_check():
 # Serve static files (Frontend) manually to avoid shadowing API routes
 @app.get("/")
 async def read_index():
-    return FileResponse('web/index.html')
+    # Ask browsers for the client hints media variants are chosen by
+    return FileResponse('web/index.html', headers={"Accept-CH": ACCEPT_CH})
 
 @app.get("/{filename}")
 async def read_root_file(filename: str):
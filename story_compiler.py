@@ -0,0 +1,326 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+from config import STORY_CLIP_CACHE_DIR, STORY_CLIP_CACHE_MAX_MB, STORY_ONE_PASS_MAX_SECONDS
+from download_manager import sha256_file
+from media_probe import MediaProber
+from media_workers import media_workers
+from mp4_remux import movflags
+
+logger = logging.getLogger(__name__)
+
+# Every scene is normalized to this before concatenation
+TARGET_WIDTH = 1280
+TARGET_HEIGHT = 720
+TARGET_FPS = 30
+TARGET_SAMPLE_RATE = 44100
+TARGET_CHANNELS = 2
+IMAGE_SCENE_SECONDS = 2
+NORMALIZE_PROFILE = {
+    "width": TARGET_WIDTH,
+    "height": TARGET_HEIGHT,
+    "fps": TARGET_FPS,
+    "image_seconds": IMAGE_SCENE_SECONDS,
+    "video": ["libx264", "fast", "23", "yuv420p"],
+    "audio": ["aac", "128k", TARGET_SAMPLE_RATE, TARGET_CHANNELS],
+}
+PROFILE_KEY = hashlib.sha256(json.dumps(NORMALIZE_PROFILE, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+SCALE_FILTER = (
+    f"scale={TARGET_WIDTH}:{TARGET_HEIGHT}:force_original_aspect_ratio=decrease,"
+    f"pad={TARGET_WIDTH}:{TARGET_HEIGHT}:(ow-iw)/2:(oh-ih)/2,fps={TARGET_FPS}"
+)
+VIDEO_FILTER = f"{SCALE_FILTER},format=yuv420p,setsar=1"
+AUDIO_FILTER = f"aresample={TARGET_SAMPLE_RATE},aformat=sample_fmts=fltp:channel_layouts=stereo"
+SILENCE = f"anullsrc=r={TARGET_SAMPLE_RATE}:cl=stereo"
+# Stream parameters of clips made by _normalize_args: a copy concat takes its codec setup from
+# the first clip, so a copied clip must match these too (libx264 picks High@3.1 for 720p30,
+# the mp4 muxer a 512*fps timescale)
+TARGET_H264_PROFILE = "High"
+TARGET_H264_LEVEL = 31
+TARGET_TIME_BASE = f"1/{512 * TARGET_FPS}"
+VIDEO_CODEC_ARGS = ["-c:v", "libx264", "-preset", "fast", "-crf", "23", "-pix_fmt", "yuv420p", "-r", str(TARGET_FPS)]
+AUDIO_CODEC_ARGS = ["-c:a", "aac", "-b:a", "128k", "-ar", str(TARGET_SAMPLE_RATE), "-ac", str(TARGET_CHANNELS)]
+
+
+def conforms(probe: Optional[Dict]) -> bool:
+    """Whether a probed clip already matches the profile and can be stream-copied.
+
+    Every clip in a copy concat needs the same streams and codec parameters, so a
+    conforming clip must also match the H.264 profile, level and time base of the
+    normalized clips and carry AAC-LC audio in the target layout. Probes cached
+    before these fields were recorded don't conform (the clip is re-encoded).
+    """
+    if not probe:
+        return False
+    fps = probe.get("fps") or 0
+    return (
+        probe.get("video_codec") == "h264"
+        and probe.get("width") == TARGET_WIDTH
+        and probe.get("height") == TARGET_HEIGHT
+        and abs(fps - TARGET_FPS) < 0.01
+        and probe.get("video_profile") == TARGET_H264_PROFILE
+        and probe.get("video_level") == TARGET_H264_LEVEL
+        and probe.get("video_time_base") == TARGET_TIME_BASE
+        and probe.get("pix_fmt") == "yuv420p"
+        and probe.get("sar") in (None, "1:1", "0:1")
+        and probe.get("audio_codec") == "aac"
+        and probe.get("audio_sample_rate") == TARGET_SAMPLE_RATE
+        and probe.get("audio_channels") == TARGET_CHANNELS
+        and probe.get("audio_channel_layout") == "stereo"
+        and probe.get("audio_profile") == "LC"
+    )
+
+
+class StoryCompileError(Exception):
+    """Raised when a story video can't be built."""
+
+
+class StoryCompiler:
+    """Builds story videos from images and clips.
+
+    Every scene has to match one resolution / frame rate / codec profile before the
+    stream-copy concat. Videos are probed first (results cached in the media
+    registry) and clips that already match are copied as-is. The rest are normalized
+    in parallel as batch jobs on the shared media worker pool and cached by
+    (source SHA256, profile), so recompiling a story only encodes new scenes.
+
+    When nothing can be reused and the encode is short (stills plus at most
+    STORY_ONE_PASS_MAX_SECONDS of video), the story is encoded in one pass through a
+    single filter_complex graph instead, skipping the temp clips and the concat.
+    """
+
+    def __init__(self, prober: MediaProber, cache_dir: str = STORY_CLIP_CACHE_DIR,
+                 max_cache_mb: int = STORY_CLIP_CACHE_MAX_MB,
+                 one_pass_max_seconds: float = STORY_ONE_PASS_MAX_SECONDS):
+        self.prober = prober
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_mb * 1024 * 1024
+        self.one_pass_max_seconds = one_pass_max_seconds
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # (path, size, mtime) -> sha256, so unchanged sources are not re-hashed
+        self._digests: Dict[Tuple[str, int, float], str] = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    async def _digest(self, path: str) -> str:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        if key not in self._digests:
+            self._digests[key] = await asyncio.to_thread(sha256_file, path)
+        return self._digests[key]
+
+    async def _cached_path(self, scene: Dict) -> str:
+        digest = await self._digest(scene['path'])
+        return os.path.join(self.cache_dir, f"{digest[:24]}_{scene['mediaType']}_{PROFILE_KEY}.mp4")
+
+    def _normalize_args(self, scene: Dict, probe: Optional[Dict], output_path: str) -> List[str]:
+        if scene['mediaType'] == 'image':
+            # Still image -> short clip at the target resolution with a silent track
+            inputs = [
+                "-loop", "1", "-t", str(IMAGE_SCENE_SECONDS), "-i", scene['path'],
+                "-f", "lavfi", "-t", str(IMAGE_SCENE_SECONDS), "-i", SILENCE,
+            ]
+        elif probe["has_audio"]:
+            inputs = ["-i", scene['path']]
+        else:
+            inputs = ["-i", scene['path'], "-f", "lavfi", "-i", SILENCE]
+        audio = "0:a:0" if scene['mediaType'] == 'video' and probe["has_audio"] else "1:a:0"
+        return [
+            *inputs,
+            "-map", "0:v:0", "-map", audio,
+            "-vf", VIDEO_FILTER,
+            "-af", AUDIO_FILTER,
+            *VIDEO_CODEC_ARGS,
+            *AUDIO_CODEC_ARGS,
+            "-shortest",
+            output_path,
+        ]
+
+    async def normalize(self, scene: Dict, probe: Optional[Dict] = None) -> str:
+        """Path of the scene normalized to the target profile, encoding it only if not cached."""
+        cached_path = await self._cached_path(scene)
+
+        lock = self._locks.setdefault(cached_path, asyncio.Lock())
+        async with lock:
+            if os.path.exists(cached_path):
+                os.utime(cached_path)  # keep recently used clips when pruning
+                logger.info(f"[Compile Story] Cached clip for {os.path.basename(scene['path'])}")
+                return cached_path
+
+            if scene['mediaType'] == 'video' and probe is None:
+                probe = await self.prober.probe(scene['path'])
+                if probe is None:
+                    raise StoryCompileError(f"Could not read video {os.path.basename(scene['path'])}")
+
+            part_path = f"{cached_path[:-4]}.part.mp4"
+            duration = IMAGE_SCENE_SECONDS if scene['mediaType'] == 'image' else probe.get("duration")
+            timeout = 30 if scene['mediaType'] == 'image' else max(120, 4 * (duration or 0))
+            logger.info(f"[Compile Story] Normalizing {scene['mediaType']}: {os.path.basename(scene['path'])}")
+            returncode, stderr = await media_workers.run_ffmpeg(
+                self._normalize_args(scene, probe, part_path), timeout,
+                kind="story_clip", priority="batch", duration=duration, label=os.path.basename(scene['path']),
+            )
+
+            if returncode != 0:
+                if os.path.exists(part_path):
+                    os.unlink(part_path)
+                raise StoryCompileError(
+                    f"Failed to convert {scene['mediaType']} {os.path.basename(scene['path'])}: {stderr[:200]}"
+                )
+
+            os.replace(part_path, cached_path)
+            return cached_path
+
+    async def _plan(self, scene: Dict) -> Dict:
+        """Probe a scene and find a clip that can go into the concat without encoding."""
+        plan = {"scene": scene, "probe": None, "clip": None, "duration": float(IMAGE_SCENE_SECONDS)}
+        if scene['mediaType'] == 'video':
+            probe = await self.prober.probe(scene['path'])
+            if probe is None:
+                raise StoryCompileError(f"Could not read video {os.path.basename(scene['path'])}")
+            plan["probe"] = probe
+            plan["duration"] = probe.get("duration")
+            if conforms(probe):
+                plan["clip"] = scene['path']
+                return plan
+        cached_path = await self._cached_path(scene)
+        if os.path.exists(cached_path):
+            plan["clip"] = cached_path
+        return plan
+
+    async def _clip(self, plan: Dict) -> str:
+        if plan["clip"] == plan["scene"]['path']:
+            return plan["clip"]
+        return await self.normalize(plan["scene"], plan["probe"])
+
+    def _one_pass_args(self, plans: List[Dict], output_path: str) -> List[str]:
+        """Scale, pad, resample and concatenate every scene in one filter_complex graph."""
+        inputs, graph, segments = [], [], []
+        for i, plan in enumerate(plans):
+            scene = plan["scene"]
+            if scene['mediaType'] == 'image':
+                inputs += ["-loop", "1", "-t", str(IMAGE_SCENE_SECONDS), "-i", scene['path']]
+            else:
+                inputs += ["-i", scene['path']]
+            graph.append(f"[{i}:v:0]{VIDEO_FILTER}[v{i}]")
+            if plan["probe"] and plan["probe"]["has_audio"]:
+                graph.append(f"[{i}:a:0]{AUDIO_FILTER}[a{i}]")
+            else:
+                graph.append(f"{SILENCE},atrim=duration={plan['duration']}[a{i}]")
+            segments.append(f"[v{i}][a{i}]")
+        graph.append(f"{''.join(segments)}concat=n={len(plans)}:v=1:a=1[v][a]")
+        return [
+            *inputs,
+            "-filter_complex", ";".join(graph),
+            "-map", "[v]", "-map", "[a]",
+            *VIDEO_CODEC_ARGS,
+            *AUDIO_CODEC_ARGS,
+            *movflags(),  # moov first so the story starts playing before it has fully loaded
+            output_path,
+        ]
+
+    @staticmethod
+    def _total_duration(plans: List[Dict]) -> Optional[float]:
+        if any(plan["duration"] is None for plan in plans):
+            return None
+        return sum(plan["duration"] for plan in plans)
+
+    def _prefer_one_pass(self, plans: List[Dict]) -> bool:
+        """One pass wins when no clip can be reused and the encode is cheap to redo."""
+        if any(plan["clip"] for plan in plans):
+            return False
+        video_seconds = 0.0
+        for plan in plans:
+            if plan["scene"]['mediaType'] == 'video':
+                if plan["duration"] is None:
+                    return False
+                video_seconds += plan["duration"]
+        return video_seconds <= self.one_pass_max_seconds
+
+    def _prune_cache(self):
+        """Delete least recently used clips once the cache is over its size limit."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.mp4') and not name.endswith('.part.mp4'):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_cache_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+    async def compile(self, scenes: List[Dict], output_path: str) -> Dict:
+        """Build the story video, encoding only scenes that don't already match the profile.
+
+        Args:
+            scenes: [{"path": absolute path, "mediaType": "image" | "video"}, ...] in story order
+            output_path: Where to write the story video
+
+        Returns:
+            {"mode": "one_pass" | "concat", "copied": clips used as-is, "cached": clips
+            reused from the cache, "encoded": scenes encoded for this compile}
+
+        Raises:
+            StoryCompileError if a scene can't be read or converted, or ffmpeg fails
+            asyncio.TimeoutError if an ffmpeg step runs too long
+        """
+        plans = await asyncio.gather(*[self._plan(scene) for scene in scenes])
+
+        if self._prefer_one_pass(plans):
+            total = self._total_duration(plans)
+            logger.info(f"[Compile Story] Encoding {len(plans)} scenes in one pass to {TARGET_WIDTH}x{TARGET_HEIGHT}...")
+            returncode, stderr = await media_workers.run_ffmpeg(
+                self._one_pass_args(plans, output_path), timeout=max(120, 4 * total),
+                kind="story_compile", priority="batch", duration=total, label=os.path.basename(output_path),
+            )
+            if returncode != 0:
+                raise StoryCompileError(f"FFmpeg failed: {stderr[:200]}")
+            return {"mode": "one_pass", "copied": 0, "cached": 0, "encoded": len(plans)}
+
+        stats = {"mode": "concat", "copied": 0, "cached": 0, "encoded": 0}
+        for plan in plans:
+            if plan["clip"] is None:
+                stats["encoded"] += 1
+            elif plan["clip"] == plan["scene"]['path']:
+                stats["copied"] += 1
+            else:
+                stats["cached"] += 1
+        clips = await asyncio.gather(*[self._clip(plan) for plan in plans])
+
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
+            concat_file = f.name
+            for clip in clips:
+                escaped_path = clip.replace("\\", "/").replace("'", "'\\''")
+                f.write(f"file '{escaped_path}'\n")
+
+        logger.info(
+            f"[Compile Story] Concatenating {len(clips)} clips ({stats['copied']} copied, "
+            f"{stats['cached']} cached, {stats['encoded']} encoded)..."
+        )
+        try:
+            returncode, stderr = await media_workers.run_ffmpeg([
+                "-f", "concat",
+                "-safe", "0",
+                "-i", concat_file,
+                "-c", "copy",  # Stream copy since every clip matches the profile
+                *movflags(),
+                output_path,
+            ], timeout=120, kind="story_concat", priority="batch", duration=self._total_duration(plans),
+                label=os.path.basename(output_path))
+        finally:
+            os.unlink(concat_file)
+
+        if returncode != 0:
+            raise StoryCompileError(f"FFmpeg failed: {stderr[:200]}")
+        await asyncio.to_thread(self._prune_cache)
+        return stats
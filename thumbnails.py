@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps
+
+from config import THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_MB
+from media_workers import media_workers
+
+logger = logging.getLogger(__name__)
+
+# Bounding boxes (width, height) in pixels: face picker cards (80px at 2x), chat and web
+# gallery tiles, and the launcher's chat column, which is 300px wide whatever the orientation
+THUMBNAIL_SIZES = {"small": (160, 160), "medium": (300, 300), "large": (640, 640), "launcher": (300, 1200)}
+THUMBNAIL_QUALITY = 82
+VERSION_LENGTH = 16  # hex characters of the cache key used in ?v= URLs
+PRUNE_EVERY = 100  # renders between cache size checks
+
+
+def thumbnail_key(path: str, stat: Optional[os.stat_result] = None) -> str:
+    """Cache key of an image: its absolute path, size and mtime (a new key when it changes)."""
+    stat = stat or os.stat(path)
+    return hashlib.sha1(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8')).hexdigest()
+
+
+def render_thumbnails(source: str, outputs: Dict[str, str]):
+    """Decode an image once and write every requested size.
+
+    Sizes are made largest first, each from the previous one when its box fits
+    inside the previous box, otherwise from the decoded image.
+
+    Args:
+        source: Image file
+        outputs: {size name: output path}
+    """
+    boxes = [THUMBNAIL_SIZES[size] for size in outputs]
+    with Image.open(source) as image:
+        # Fast JPEG downscale on decode
+        image.draft("RGB", (max(width for width, _ in boxes), max(height for _, height in boxes)))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        previous, previous_box = image, None
+        for size in sorted(outputs, key=lambda name: THUMBNAIL_SIZES[name], reverse=True):
+            box = THUMBNAIL_SIZES[size]
+            fits = previous_box and box[0] <= previous_box[0] and box[1] <= previous_box[1]
+            thumbnail = (previous if fits else image).copy()
+            thumbnail.thumbnail(box, Image.LANCZOS)
+            part_path = f"{outputs[size]}.part"
+            thumbnail.save(part_path, format="WEBP", quality=THUMBNAIL_QUALITY)
+            os.replace(part_path, outputs[size])
+            previous, previous_box = thumbnail, box
+
+
+class ThumbnailService:
+    """Multi-size WebP thumbnails of images, made once and kept in a cache directory.
+
+    All sizes of an image are rendered in one pass the first time any of them is
+    asked for. Thumbnails are named after the image's path, size and mtime, so an
+    edited image gets fresh ones and stale ones age out of the cache (least
+    recently used first, past THUMBNAIL_CACHE_MAX_MB). Shared by the web server
+    (gallery and face picker) and the launcher's chat window.
+    """
+
+    def __init__(self, cache_dir: str = THUMBNAIL_CACHE_DIR, max_cache_mb: int = THUMBNAIL_CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_mb * 1024 * 1024
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._writes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, key: str) -> Dict[str, str]:
+        return {size: os.path.join(self.cache_dir, f"{key}_{size}.webp") for size in THUMBNAIL_SIZES}
+
+    def _cached(self, key: str, size: str) -> Optional[str]:
+        path = self._paths(key)[size]
+        if not os.path.exists(path):
+            return None
+        try:
+            os.utime(path)  # recently used: pruned last
+        except OSError:
+            pass
+        return path
+
+    def _rendered(self):
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            self._prune_cache()
+
+    def ensure(self, source: str, size: str = "medium") -> Optional[str]:
+        """Path of an image's thumbnail, rendering it now if needed (blocking, for the launcher).
+
+        Returns None if the image can't be read.
+        """
+        if size not in THUMBNAIL_SIZES:
+            raise ValueError(f"Unknown thumbnail size: {size}")
+        try:
+            key = thumbnail_key(source)
+            cached = self._cached(key, size)
+            if cached:
+                return cached
+            render_thumbnails(source, self._paths(key))
+            self._rendered()
+            return self._paths(key)[size]
+        except (OSError, ValueError) as e:
+            logger.warning(f"[Thumbnails] Could not thumbnail {source}: {e}")
+            return None
+
+    async def get(self, source: str, size: str = "medium") -> Optional[str]:
+        """Like ensure(), rendering off the event loop; concurrent requests share one render."""
+        if size not in THUMBNAIL_SIZES:
+            raise ValueError(f"Unknown thumbnail size: {size}")
+        try:
+            key = thumbnail_key(source)
+        except OSError:
+            return None
+        cached = self._cached(key, size)
+        if cached:
+            return cached
+
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(source, key))
+            self._tasks[key] = task
+        # Shielded so a client going away doesn't cancel a render other requests share
+        if not await asyncio.shield(task):
+            return None
+        return self._paths(key)[size]
+
+    async def _run(self, source: str, key: str) -> bool:
+        try:
+            await media_workers.run_cpu(render_thumbnails, source, self._paths(key), kind="thumbnail",
+                                        priority="interactive", label=os.path.basename(source))
+            await asyncio.to_thread(self._rendered)
+            return True
+        except (OSError, ValueError) as e:
+            logger.warning(f"[Thumbnails] Could not thumbnail {os.path.basename(source)}: {e}")
+            return False
+        finally:
+            self._tasks.pop(key, None)
+
+    @staticmethod
+    def version(source: str) -> Optional[str]:
+        """Short cache key for ?v= on thumbnail URLs (None if the image is missing)."""
+        try:
+            return thumbnail_key(source)[:VERSION_LENGTH]
+        except OSError:
+            return None
+
+    def _prune_cache(self):
+        """Delete least recently used thumbnails once the cache is over its size limit."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.webp'):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_cache_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+
+# Shared so the server and launcher use the same cache
+thumbnails = ThumbnailService()
@@ -2,10 +2,11 @@ import os
 import re
 import asyncio
 import aiohttp  
-from datetime import datetime
 import logging
 from config import ELEVENLABS_API_KEY, ELEVENLABS_VOICE_SETTINGS, MAX_RETRIES, RETRY_BASE_DELAY
 from characters import characters
+from deadline import stage_session
+from blob_store import unique_timestamp
 
 logger = logging.getLogger(__name__)
 
@@ -70,11 +71,11 @@ class TTSManager:
 
         for attempt in range(MAX_RETRIES):
             try:
-                async with aiohttp.ClientSession() as session:
+                async with stage_session("tts", "eleven_v3") as session:
                     async with session.post(url, json=data, headers=headers) as response:
                         if response.status == 200:
                             audio_data = await response.read()
-                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                            timestamp = unique_timestamp()
                             tts_file_name = f"tts_v3_response_{timestamp}.mp3"
                             tts_file_path = os.path.join(self.conversation_manager.subfolder_path, tts_file_name)
                             with open(tts_file_path, 'wb') as f:
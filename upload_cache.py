@@ -0,0 +1,159 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from config import UPLOAD_CACHE_FILE
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+SAVE_DELAY = 1.0  # seconds; changes made meanwhile are written together
+
+MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.webp': 'image/webp',
+    '.mp3': 'audio/mpeg',
+    '.wav': 'audio/wav',
+    '.m4a': 'audio/mp4',
+    '.mp4': 'video/mp4',
+    '.webm': 'video/webm',
+}
+
+
+def guess_mime_type(file_path: str) -> str:
+    """Return the mime type for a media file based on its extension."""
+    ext = os.path.splitext(file_path)[1].lower()
+    return MIME_TYPES.get(ext, 'application/octet-stream')
+
+
+def parse_expiry(value) -> Optional[float]:
+    """Convert an ISO-8601 timestamp (as returned by provider APIs) to epoch seconds."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        logger.warning(f"Could not parse expiry timestamp: {value}")
+        return None
+
+
+class UploadCache:
+    """Remembers provider URLs for files that were already uploaded.
+
+    Entries are keyed by provider and the SHA256 of the file content, so the same
+    selfie or audio clip is only uploaded once even if it is copied or renamed.
+    Entries expire slightly before the provider deletes the file. Changes are
+    written to disk shortly afterwards in a worker thread, never on the event loop.
+    """
+
+    def __init__(self, path: str = UPLOAD_CACHE_FILE, expiry_margin: int = 300):
+        self.path = path
+        self.expiry_margin = expiry_margin
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = self._load()
+        self._dirty = False
+        self._save_task: Optional[asyncio.Task] = None
+        # (path, size, mtime) -> sha256, so unchanged files are not re-hashed
+        self._digests: Dict[Tuple[str, int, float], str] = {}
+
+    def _load(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load upload cache {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        with self._lock:
+            data = json.dumps(self._entries, indent=2)
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Failed to save upload cache {self.path}: {e}")
+
+    def _request_save(self):
+        """Write the entries soon, off the event loop (right away when there is no loop)."""
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._dirty = False
+            self._save()
+            return
+        if self._save_task is None or self._save_task.done():
+            self._save_task = loop.create_task(self._save_later())
+
+    async def _save_later(self):
+        while self._dirty:
+            await asyncio.sleep(SAVE_DELAY)
+            # Cleared before the write, so changes made during it get another pass
+            self._dirty = False
+            await asyncio.to_thread(self._save)
+
+    def _hash_file(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime)
+        digest = self._digests.get(key)
+        if digest:
+            return digest
+
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        self._digests[key] = digest
+        return digest
+
+    async def file_digest(self, file_path: str) -> str:
+        """SHA256 of a file, computed off the event loop."""
+        return await asyncio.to_thread(self._hash_file, file_path)
+
+    def get(self, provider: str, digest: str) -> Optional[str]:
+        """Return a still-valid uploaded URL for this content, if any."""
+        key = f"{provider}:{digest}"
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            expires_at = entry.get('expires_at')
+            if not expires_at or expires_at - self.expiry_margin > time.time():
+                return entry.get('url')
+            del self._entries[key]
+        self._request_save()
+        return None
+
+    def put(self, provider: str, digest: str, url: str, expires_at: Optional[float] = None):
+        """Store an uploaded URL. expires_at is epoch seconds (None = never expires)."""
+        key = f"{provider}:{digest}"
+        with self._lock:
+            now = time.time()
+            # Drop expired entries while we're here so the file doesn't grow forever
+            self._entries = {
+                k: v for k, v in self._entries.items()
+                if not v.get('expires_at') or v['expires_at'] > now
+            }
+            self._entries[key] = {
+                'url': url,
+                'expires_at': expires_at,
+                'uploaded_at': now,
+            }
+        self._request_save()
+
+
+# Shared instance so every manager sees the same uploads
+upload_cache = UploadCache()
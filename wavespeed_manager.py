@@ -3,7 +3,10 @@ import os
 import logging
 import aiohttp
 import base64
-from config import WAVESPEED_API_KEY, WAVESPEED_API_URL
+import time
+from config import WAVESPEED_API_KEY, WAVESPEED_API_URL, WAVESPEED_UPLOAD_TTL
+from upload_cache import upload_cache, guess_mime_type
+from deadline import DeadlineExceeded, stage, stage_session
 
 logger = logging.getLogger(__name__)
 
@@ -29,28 +32,87 @@ class WavespeedManager:
             'Content-Type': 'application/json'
         }
     
-    async def _file_to_base64(self, file_path: str) -> str:
-        """Convert a file to base64 data URI."""
+    def _read_data_uri(self, file_path: str) -> str:
         with open(file_path, 'rb') as f:
             data = base64.b64encode(f.read()).decode('utf-8')
-        
-        # Determine mime type
-        ext = os.path.splitext(file_path)[1].lower()
-        mime_types = {
-            '.png': 'image/png',
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.webp': 'image/webp',
-            '.mp3': 'audio/mpeg',
-            '.wav': 'audio/wav',
-            '.m4a': 'audio/mp4'
-        }
-        mime_type = mime_types.get(ext, 'application/octet-stream')
-        
-        return f"data:{mime_type};base64,{data}"
+        return f"data:{guess_mime_type(file_path)};base64,{data}"
+
+    async def _file_to_base64(self, file_path: str) -> str:
+        """Convert a file to base64 data URI (read and encoded off the event loop)."""
+        return await asyncio.to_thread(self._read_data_uri, file_path)
+
+    async def _upload_file(self, file_path: str) -> str:
+        """Upload a file to Wavespeed media storage and return its download URL.
+
+        Uploads are streamed from disk and cached by content hash, so re-used
+        images and audio clips are only sent once. Falls back to a base64 data URI
+        if the upload endpoint is unavailable.
+        """
+        digest = await upload_cache.file_digest(file_path)
+        cached_url = upload_cache.get("wavespeed", digest)
+        if cached_url:
+            logger.info(f"Reusing uploaded file for {os.path.basename(file_path)}: {cached_url}")
+            return cached_url
+
+        upload_url = f"{self.base_url}/media/upload/binary"
+        try:
+            async with stage_session("upload") as session:
+                with open(file_path, 'rb') as f:
+                    form = aiohttp.FormData()
+                    form.add_field(
+                        'file', f,
+                        filename=os.path.basename(file_path),
+                        content_type=guess_mime_type(file_path)
+                    )
+                    async with session.post(upload_url,
+                                            headers={'Authorization': f'Bearer {self.api_key}'},
+                                            data=form) as response:
+                        if response.status not in [200, 201]:
+                            error_text = await response.text()
+                            raise RuntimeError(f"HTTP {response.status}: {error_text}")
+                        data = await response.json()
+
+            response_data = data.get('data', data)
+            download_url = response_data.get('download_url') or response_data.get('url')
+            if not download_url:
+                raise RuntimeError(f"No download URL in upload response: {data}")
+
+            upload_cache.put("wavespeed", digest, download_url, time.time() + WAVESPEED_UPLOAD_TTL)
+            logger.info(f"Uploaded {os.path.basename(file_path)} to Wavespeed: {download_url}")
+            return download_url
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            logger.warning(f"Wavespeed upload failed for {file_path}, sending inline instead: {e}")
+            return await self._file_to_base64(file_path)
     
-    async def _poll_for_result(self, session: aiohttp.ClientSession, request_id: str) -> str | None:
-        """Poll the API for task completion and return the result URL."""
+    async def _cancel_task(self, session: aiohttp.ClientSession, request_id: str):
+        """Cancel a running task so it stops consuming credits."""
+        cancel_url = f"{self.base_url}/predictions/{request_id}/cancel"
+        try:
+            async with session.post(cancel_url, headers=self._get_headers()) as response:
+                if response.status == 200:
+                    logger.info(f"Cancelled Wavespeed task {request_id}")
+                else:
+                    logger.warning(f"Failed to cancel task {request_id}: {response.status} - {await response.text()}")
+        except Exception as e:
+            logger.warning(f"Failed to cancel task {request_id}: {e}")
+
+    async def _poll_for_result(self, session: aiohttp.ClientSession, request_id: str, model: str = None) -> str | None:
+        """Poll the API for task completion and return the result URL.
+
+        Polling is bounded by the "wavespeed_poll" stage limit (per model) and the request
+        deadline. If it times out or the calling task is cancelled, the Wavespeed task is
+        cancelled too.
+        """
+        try:
+            with stage("wavespeed_poll", model) as poll_stage:
+                return await self._poll_until_done(session, request_id, poll_stage)
+        except (asyncio.CancelledError, DeadlineExceeded):
+            await self._cancel_task(session, request_id)
+            raise
+
+    async def _poll_until_done(self, session: aiohttp.ClientSession, request_id: str, poll_stage) -> str | None:
         result_url = f"{self.base_url}/predictions/{request_id}/result"
         headers = self._get_headers()
         
@@ -58,9 +120,10 @@ class WavespeedManager:
         
         while True:
             await asyncio.sleep(self.poll_interval)
+            poll_stage.check()
             
             try:
-                async with session.get(result_url, headers=headers) as response:
+                async with session.get(result_url, headers=headers, timeout=poll_stage.timeout) as response:
                     if response.status != 200:
                         error_text = await response.text()
                         logger.error(f"Error polling result: {response.status} - {error_text}")
@@ -156,9 +219,9 @@ class WavespeedManager:
         logger.info(f"Generating video with {model} ({model_id}) - image: {image_path}")
         
         try:
-            # Convert files to base64
-            image_data = await self._file_to_base64(image_path)
-            audio_data = await self._file_to_base64(audio_path)
+            # Upload inputs (cached by content hash)
+            image_data = await self._upload_file(image_path)
+            audio_data = await self._upload_file(audio_path)
             
             # Build request payload
             payload = {
@@ -198,7 +261,7 @@ class WavespeedManager:
                     logger.info(f"Task submitted with ID: {request_id}")
                     
                     # Poll for result
-                    video_url = await self._poll_for_result(session, request_id)
+                    video_url = await self._poll_for_result(session, request_id, model=model_id)
                     
                     if video_url:
                         logger.info(f"Video generated successfully: {video_url}")
@@ -247,9 +310,9 @@ class WavespeedManager:
         logger.info(f"Generating lipsync video with {model} ({model_id})")
         
         try:
-            # Convert files to base64
-            video_data = await self._file_to_base64(video_path)
-            audio_data = await self._file_to_base64(audio_path)
+            # Upload inputs (cached by content hash)
+            video_data = await self._upload_file(video_path)
+            audio_data = await self._upload_file(audio_path)
             
             # Build request payload
             payload = {
@@ -282,7 +345,7 @@ class WavespeedManager:
                     logger.info(f"Lipsync task submitted with ID: {request_id}")
                     
                     # Poll for result
-                    video_url = await self._poll_for_result(session, request_id)
+                    video_url = await self._poll_for_result(session, request_id, model=model_id)
                     
                     if video_url:
                         logger.info(f"Lipsync video generated successfully: {video_url}")
@@ -50,6 +50,7 @@ const sendBtn = document.getElementById('send-btn');
 const genImageBtn = document.getElementById('gen-image-btn');
 const spycamBtn = document.getElementById('spycam-btn');
 const genImageDirectBtn = document.getElementById('gen-image-direct-btn');
+const genVariantsBtn = document.getElementById('gen-variants-btn');
 const genVideoBtn = document.getElementById('gen-video-btn');
 const videoModelSelect = document.getElementById('video-model-select');
 const settingsBtn = document.getElementById('settings-btn');
@@ -492,6 +493,9 @@ function addImage(url, prompt) {
                     <button class="faceswap-btn" onclick="applyFaceswap('${escapedUrl}', this)">
                         🔄 Face
                     </button>
+                    <button class="rerender-btn" onclick="rerenderImage('${escapedUrl}', this)" title="Re-render with the same seed at more steps">
+                        ⏫ HQ
+                    </button>
                 </div>
             </div>
         `;
@@ -509,6 +513,9 @@ function addImage(url, prompt) {
                     <button class="faceswap-btn" onclick="applyFaceswap('${escapedUrl}', this)">
                         🔄 Face
                     </button>
+                    <button class="rerender-btn" onclick="rerenderImage('${escapedUrl}', this)" title="Re-render with the same seed at more steps">
+                        ⏫ HQ
+                    </button>
                 </div>
             </div>
         `;
@@ -548,7 +555,7 @@ function addVideo(url, prompt, type = 'video') {
         // Normal mode: show video but NO autoplay - user must click play
         msgDiv.innerHTML = `
             <div class="content">
-                <video id="${videoId}" controls loop preload="metadata">
+                <video id="${videoId}" controls loop preload="none" data-src="${url}">
                     <source src="${url}" type="video/mp4">
                     Your browser does not support the video tag.
                 </video>
@@ -565,6 +572,35 @@ function addVideo(url, prompt, type = 'video') {
     }
     messagesDiv.appendChild(msgDiv);
     scrollToBottom();
+    if (!stealthMode) loadVideoPreview(videoId, url);
+}
+
+// Poster and seek sprite are extracted server-side in the background; show the poster
+// instead of loading the MP4 until the user presses play
+async function loadVideoPreview(videoId, url, until = 'poster') {
+    try {
+        // The poster comes back first; the sprite is picked up by a second call once the build is done
+        const query = `url=${encodeURIComponent(url)}&wait=true${until ? `&until=${until}` : ''}`;
+        const response = await fetch(`${API_BASE}/media/derived?${query}`);
+        if (!response.ok) return;
+        const data = await response.json();
+        if (data.status !== 'ready') return;
+
+        const video = document.getElementById(videoId);
+        if (!video) return;
+        if (data.poster_url) {
+            video.poster = data.poster_url;
+            video.dataset.poster = data.poster_url;
+        }
+        if (data.sprite) video.dataset.sprite = JSON.stringify(data.sprite);
+        // Long stories have an HLS rendition; use it where the browser plays HLS natively
+        if (data.hls_url && video.canPlayType('application/vnd.apple.mpegurl') && !video.src.endsWith('.m3u8')) {
+            video.src = data.hls_url;
+        }
+        if (data.building && until) loadVideoPreview(videoId, url, null);
+    } catch (error) {
+        console.warn('Video preview unavailable:', error);
+    }
 }
 
 function addAudio(url) {
@@ -602,10 +638,12 @@ function scrollToBottom() {
 // ============ SCENE QUEUE ============
 function addToSceneQueue(url, type, elementId, btn, mediaType = 'video') {
     // Add to queue with mediaType for proper handling during compilation
+    const element = elementId ? document.getElementById(elementId) : null;
     sceneQueue.push({
         url: url,
         type: type,
         mediaType: mediaType,  // 'image' or 'video'
+        poster: element && element.dataset.poster ? element.dataset.poster : null,
         timestamp: Date.now()
     });
 
@@ -665,10 +703,12 @@ function renderSceneQueue() {
         else if (scene.type === 's2v') typeLabel = 'S2V';
         else if (scene.type === 'infinitetalk') typeLabel = 'Talk';
 
-        // Use img or video based on mediaType
+        // Use img or video based on mediaType (videos show their poster when there is one)
         const thumbnail = scene.mediaType === 'image'
             ? `<img class="scene-thumbnail" src="${scene.url}">`
-            : `<video class="scene-thumbnail" src="${scene.url}" muted></video>`;
+            : scene.poster
+                ? `<img class="scene-thumbnail" src="${scene.poster}">`
+                : `<video class="scene-thumbnail" src="${scene.url}" muted preload="metadata"></video>`;
 
         card.innerHTML = `
             <span class="scene-number">${index + 1}</span>
@@ -914,16 +954,76 @@ async function generateSpycam() {
     }
 }
 
-async function generateImageDirect() {
+async function generateImageVariants(count = 4) {
+    const imageModel = document.getElementById('image-model-select').value;
+    addSystemMessage(`Generating ${count} variants (${imageModel})...`);
+    try {
+        const response = await fetch(`${API_BASE}/generate/image/variants?model=${imageModel}&count=${count}`, { method: 'POST' });
+        if (!response.ok) {
+            const errorData = await response.json();
+            throw new Error(errorData.detail || 'Generation failed');
+        }
+        const data = await response.json();
+        addImageVariants(data.images, data.prompt);
+    } catch (error) {
+        console.error('Variant gen failed:', error);
+        addSystemMessage(`Failed: ${error.message}`);
+    }
+}
+
+function addImageVariants(images, prompt) {
+    const msgDiv = document.createElement('div');
+    msgDiv.className = 'message bot';
+    const items = images.map(img => {
+        const escapedUrl = img.image_url.replace(/'/g, "\\'");
+        const preview = stealthMode
+            ? `<span class="stealth-icon">📷</span>`
+            : `<img src="${img.image_url}" alt="seed ${img.seed}" loading="lazy">`;
+        return `
+            <div class="variant-item" onclick="pickImageVariant('${escapedUrl}', this)" title="Use this variant">
+                ${preview}
+                <span class="variant-seed">seed ${img.seed}</span>
+            </div>
+        `;
+    }).join('');
+    msgDiv.innerHTML = `<div class="content"><div class="variant-grid">${items}</div></div>`;
+    msgDiv.dataset.prompt = prompt || '';
+    messagesDiv.appendChild(msgDiv);
+    scrollToBottom();
+}
+
+async function pickImageVariant(url, element) {
+    try {
+        const response = await fetch(`${API_BASE}/select-image`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ image_url: url })
+        });
+        if (!response.ok) throw new Error('Could not select image');
+        element.closest('.variant-grid').querySelectorAll('.variant-item').forEach(item => item.classList.remove('selected'));
+        element.classList.add('selected');
+        // Show the pick as a regular image so it gets the usual actions
+        addImage(url, element.closest('.message').dataset.prompt);
+    } catch (error) {
+        console.error('Variant pick failed:', error);
+        addSystemMessage(`Failed: ${error.message}`);
+    }
+}
+
+async function generateImageDirect(force = false) {
     const imageModel = document.getElementById('image-model-select').value;
     addSystemMessage(`Generating image from direct prompt (${imageModel})...`);
     try {
-        const response = await fetch(`${API_BASE}/generate/image/direct?model=${imageModel}`, { method: 'POST' });
+        const response = await fetch(`${API_BASE}/generate/image/direct?model=${imageModel}${force ? '&force=true' : ''}`, { method: 'POST' });
         if (!response.ok) {
             const errorData = await response.json();
             throw new Error(errorData.detail || 'Generation failed');
         }
         const data = await response.json();
+        if (data.reused) {
+            // Near-identical prompt to a recent image - offer a fresh render instead
+            addSystemMessage(`Prompt is ${Math.round(data.similarity * 100)}% similar to a recent image, reusing it. <button class="rerender-btn" onclick="generateImageDirect(true)">🎲 Generate new</button>`);
+        }
         addImage(data.image_url, data.prompt);
     } catch (error) {
         console.error('Direct image gen failed:', error);
@@ -960,6 +1060,7 @@ async function openSettings() {
         document.getElementById('read-narration').checked = data.read_narration;
         document.getElementById('pov-mode').checked = data.pov_mode;
         document.getElementById('first-person-mode').checked = data.first_person_mode;
+        document.getElementById('media-quality').value = getMediaQuality();
 
         settingsModal.classList.remove('hidden');
     } catch (error) {
@@ -967,7 +1068,18 @@ async function openSettings() {
     }
 }
 
+// Per-device media quality, sent with every /output request as a cookie
+function getMediaQuality() {
+    const match = document.cookie.match(/(?:^|;\s*)media_quality=([^;]+)/);
+    return match ? decodeURIComponent(match[1]) : 'auto';
+}
+
+function setMediaQuality(quality) {
+    document.cookie = `media_quality=${encodeURIComponent(quality)}; path=/; max-age=31536000; SameSite=Lax`;
+}
+
 async function saveSettings() {
+    setMediaQuality(document.getElementById('media-quality').value);
     const settings = {
         system_prompt: document.getElementById('system-prompt').value,
         image_prompt: document.getElementById('image-prompt').value,
@@ -1165,6 +1277,7 @@ if (messageInput) {
 
 if (genImageBtn) genImageBtn.addEventListener('click', generateImage);
 if (genImageDirectBtn) genImageDirectBtn.addEventListener('click', generateImageDirect);
+if (genVariantsBtn) genVariantsBtn.addEventListener('click', () => generateImageVariants(4));
 if (genVideoBtn) genVideoBtn.addEventListener('click', generateVideo);
 
 if (settingsBtn) settingsBtn.addEventListener('click', openSettings);
@@ -1637,8 +1750,19 @@ async function syncLorasToLocal() {
             throw new Error(errorData.detail || 'Sync failed');
         }
 
-        const data = await response.json();
-        addSystemMessage(`✅ Synced ${data.downloaded} LoRAs, ${data.skipped} already existed.`);
+        // Sync runs in the background on the server - poll until it finishes
+        let data = await response.json();
+        while (data.state === 'running') {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            const statusResponse = await fetch(`${API_BASE}/sync/loras/status`);
+            if (!statusResponse.ok) throw new Error('Lost track of sync progress');
+            data = await statusResponse.json();
+        }
+
+        let summary = `✅ Synced ${data.downloaded} LoRAs, ${data.skipped} already existed`;
+        if (data.deduplicated) summary += `, ${data.deduplicated} linked as duplicates`;
+        if (data.failed) summary += `, ${data.failed} failed`;
+        addSystemMessage(`${summary}.`);
     } catch (error) {
         console.error('LoRA sync failed:', error);
         addSystemMessage(`Failed to sync: ${error.message}`);
@@ -1880,6 +2004,41 @@ async function doFaceswap(imageUrl, sourceCharacter, btn) {
     }
 }
 
+// Re-render a local SD image with the same prompt and seed at higher steps
+async function rerenderImage(imageUrl, btn) {
+    if (btn) {
+        btn.disabled = true;
+        btn.textContent = '⏳...';
+    }
+
+    addSystemMessage('Re-rendering at higher steps...');
+
+    try {
+        const response = await fetch(`${API_BASE}/generate/image/rerender`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ image_url: imageUrl })
+        });
+
+        if (!response.ok) {
+            const errorData = await response.json();
+            throw new Error(errorData.detail || 'Re-render failed');
+        }
+
+        const data = await response.json();
+        addImage(data.image_url, data.prompt);
+        addSystemMessage(`Re-rendered with seed ${data.seed} at ${data.steps} steps${data.cached ? ' (cached)' : ''}`);
+    } catch (error) {
+        console.error('Re-render failed:', error);
+        addSystemMessage(`Failed to re-render image: ${error.message}`);
+    } finally {
+        if (btn) {
+            btn.disabled = false;
+            btn.textContent = '⏫ HQ';
+        }
+    }
+}
+
 // ============ FACE PICKER (VOY MODE) ============
 const facePickerModal = document.getElementById('face-picker-modal');
 const facePickerGrid = document.getElementById('face-picker-grid');
@@ -2005,29 +2164,42 @@ if (editPromptInput) {
 // ============ END IMAGE EDIT & FACESWAP ============
 
 // ============ IMAGE GALLERY ============
+// Cached server-side thumbnail of a session image (other URLs are returned unchanged)
+function thumbnailUrl(src, size) {
+    const url = new URL(src, window.location.origin);
+    if (url.origin !== window.location.origin || !url.pathname.startsWith('/output/')) return src;
+    return `/api/thumbnails/${size}/${url.pathname.slice('/output/'.length)}`;
+}
+
 function openGallery() {
-    // Collect all images from the chat
-    const messageImages = document.querySelectorAll('#messages .message img');
+    // Collect all images from the chat, plus videos that have a poster
+    const messageMedia = document.querySelectorAll('#messages .message img, #messages .message video[data-poster]');
 
     if (!galleryGrid) return;
 
     galleryGrid.innerHTML = '';
 
-    if (messageImages.length === 0) {
+    if (messageMedia.length === 0) {
         galleryGrid.innerHTML = '<div class="gallery-empty">No images in this chat yet. Generate some images to see them here! 📷</div>';
     } else {
-        // Add images in chronological order (they're already in order in DOM)
+        // Add media in chronological order (they're already in order in DOM)
         let index = 1;
-        messageImages.forEach(img => {
+        messageMedia.forEach(media => {
+            const isVideo = media.tagName === 'VIDEO';
+            const src = isVideo ? media.dataset.poster : thumbnailUrl(media.src, 'large');
+            const openUrl = isVideo ? media.dataset.src : media.src;
             const item = document.createElement('div');
-            item.className = 'gallery-item';
+            item.className = isVideo ? 'gallery-item gallery-video' : 'gallery-item';
             item.innerHTML = `
-                <span class="gallery-index">#${index}</span>
-                <img src="${img.src}" alt="Gallery image ${index}">
+                <span class="gallery-index">#${index}${isVideo ? ' ▶' : ''}</span>
+                <img src="${src}" alt="Gallery ${isVideo ? 'video' : 'image'} ${index}">
             `;
+            if (isVideo && media.dataset.sprite) {
+                attachSpriteScrub(item, JSON.parse(media.dataset.sprite));
+            }
             // Click to open full size in new tab
             item.addEventListener('click', () => {
-                window.open(img.src, '_blank');
+                window.open(openUrl, '_blank');
             });
             galleryGrid.appendChild(item);
             index++;
@@ -2039,6 +2211,35 @@ function openGallery() {
     if (galleryView) galleryView.classList.remove('hidden');
 }
 
+// Hovering a video tile scrubs through its thumbnail sprite sheet
+function attachSpriteScrub(item, sprite) {
+    const overlay = document.createElement('div');
+    overlay.className = 'gallery-sprite';
+    const frame = document.createElement('div');
+    frame.className = 'gallery-sprite-frame';
+    frame.style.backgroundImage = `url('${sprite.url}')`;
+    frame.style.backgroundSize = `${sprite.columns * 100}% ${sprite.rows * 100}%`;
+    // Letterbox the thumbnail inside the square tile
+    const aspect = sprite.thumb_width / sprite.thumb_height;
+    frame.style.width = aspect >= 1 ? '100%' : `${aspect * 100}%`;
+    frame.style.height = aspect >= 1 ? `${100 / aspect}%` : '100%';
+    overlay.appendChild(frame);
+    item.appendChild(overlay);
+
+    item.addEventListener('mousemove', (event) => {
+        const rect = item.getBoundingClientRect();
+        const fraction = Math.min(Math.max((event.clientX - rect.left) / rect.width, 0), 0.9999);
+        const thumb = Math.floor(fraction * sprite.count);
+        const column = thumb % sprite.columns;
+        const row = Math.floor(thumb / sprite.columns);
+        const x = sprite.columns > 1 ? (column / (sprite.columns - 1)) * 100 : 0;
+        const y = sprite.rows > 1 ? (row / (sprite.rows - 1)) * 100 : 0;
+        frame.style.backgroundPosition = `${x}% ${y}%`;
+        overlay.classList.add('visible');
+    });
+    item.addEventListener('mouseleave', () => overlay.classList.remove('visible'));
+}
+
 function closeGallery() {
     // Hide gallery, show chat
     if (galleryView) galleryView.classList.add('hidden');